@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Admission control for new presentation jobs.
+
+Without it, every upload is queued however far behind the workers are, and clients find out
+only when they time out. The AdmissionController sheds a submission with HTTP 429 when the
+job queue is already deeper than `max_queue`, or when the submitting client alone has
+`max_client_queue` jobs waiting. Its Retry-After is the time the workers need to work the
+queue back under the limit: the jobs over the limit, times the expected job time, divided
+by the number of job workers across all processes sharing the queue. For a client over its
+own limit, the other clients' waiting jobs count too: clients take turns, so those can start
+before enough of the client's own jobs have.
+
+Every queued job is checked as it is inserted, under the job store's lock (or in its
+transaction), so concurrent requests cannot overshoot the limits between check and insert,
+and each document of a batch counts against them like a separate upload. Requests are also
+checked before their body is read, so a full queue costs no upload parsing.
+
+The expected job time is built from observed stage latencies. Each finished job's stage
+timings (see metrics.RequestTrace) update a moving average per stage, and a stage a job
+did not run counts as zero for it, so the sum over stages is the average time a job keeps a
+worker busy. Until a job has finished, `default_job_seconds` is used.
+
+Queued jobs are claimed fairly (see jobs.py): clients with queued jobs take turns, so one
+client's batch does not hold every worker while others wait.
+"""
+import math
+import threading
+
+# Stages that overlap others or happen outside a worker, so they do not add to a job's time
+EXCLUDED_STAGES = {'queue', 'llm_admission', 'parse_streamed'}
+LATENCY_WEIGHT = 0.2 # Weight of each finished job in the per-stage moving averages
+MAX_RETRY_AFTER = 600
+
+
+class AdmissionRejected(Exception):
+    """Raised when a submission is shed; `retry_after` is the suggested wait in whole seconds."""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(f"{reason}; retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Sheds new jobs while the queue is too deep, with a Retry-After estimated from observed stage latencies."""
+
+    def __init__(self, max_queue, max_client_queue, workers, default_job_seconds=30.0):
+        self.max_queue = max_queue
+        self.max_client_queue = max_client_queue
+        self.workers = max(1, workers)
+        self.default_job_seconds = default_job_seconds
+        self._lock = threading.Lock()
+        self._stage_seconds = {} # stage -> moving average of seconds per job
+        self._queue_seconds = None # Moving average of the time jobs waited for a worker
+        self._stats = {"admitted": 0, "rejected_queue": 0, "rejected_client": 0, "jobs_observed": 0}
+
+    def observe(self, stages):
+        """Folds a finished job's (stage, seconds) timings into the per-stage averages."""
+        job_stages = {}
+        for stage, seconds in stages:
+            job_stages[stage] = job_stages.get(stage, 0.0) + seconds
+        with self._lock:
+            if 'queue' in job_stages:
+                previous = self._queue_seconds
+                self._queue_seconds = job_stages['queue'] if previous is None else \
+                    previous + LATENCY_WEIGHT * (job_stages['queue'] - previous)
+            for stage in (set(self._stage_seconds) | set(job_stages)) - EXCLUDED_STAGES:
+                seconds = job_stages.get(stage, 0.0)
+                previous = self._stage_seconds.get(stage)
+                if previous is None: # A stage seen for the first time was zero for the jobs before
+                    previous = 0.0 if self._stats["jobs_observed"] else seconds
+                self._stage_seconds[stage] = previous + LATENCY_WEIGHT * (seconds - previous)
+            self._stats["jobs_observed"] += 1
+
+    def job_seconds(self):
+        """Expected seconds a job keeps a worker busy."""
+        with self._lock:
+            if not self._stats["jobs_observed"]:
+                return self.default_job_seconds
+            return sum(self._stage_seconds.values())
+
+    def retry_after(self, jobs_over_limit):
+        """Seconds until the workers have started `jobs_over_limit` more jobs, at the expected job time."""
+        seconds = math.ceil(max(1, jobs_over_limit) * self.job_seconds() / self.workers)
+        return max(1, min(MAX_RETRY_AFTER, seconds))
+
+    def check(self, queued, client_queued, final=True):
+        """Admits a submission given the queued job counts (overall and the client's), or raises AdmissionRejected.
+
+        `final` is False for the early check made before a request's body is read; only the
+        check made as each job is queued counts it as admitted.
+        """
+        if self.max_queue and queued >= self.max_queue:
+            self._count("rejected_queue")
+            raise AdmissionRejected(self.retry_after(queued - self.max_queue + 1),
+                                    f"{queued} jobs are already waiting")
+        if self.max_client_queue and client_queued >= self.max_client_queue:
+            self._count("rejected_client")
+            # Fair claiming interleaves everyone else's waiting jobs with this client's, so at worst all of them go first
+            others_queued = max(0, queued - client_queued)
+            raise AdmissionRejected(self.retry_after(others_queued + client_queued - self.max_client_queue + 1),
+                                    f"you already have {client_queued} documents waiting")
+        if final:
+            self._count("admitted")
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["stage_seconds"] = {stage: round(seconds, 3) for stage, seconds in sorted(self._stage_seconds.items())}
+            stats["queue_seconds"] = round(self._queue_seconds, 3) if self._queue_seconds is not None else None
+        stats.update(
+            max_queue=self.max_queue,
+            max_client_queue=self.max_client_queue,
+            workers=self.workers,
+            job_seconds=round(self.job_seconds(), 3),
+        )
+        return stats
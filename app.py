@@ -2,21 +2,41 @@
 import os
 import uuid
 import re
+import time
 import logging
-from flask import Flask, request, render_template, send_file, jsonify, after_this_request
+import threading
+import tempfile
+import zipfile
+from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, render_template, send_file, jsonify
 from werkzeug.utils import secure_filename
+from werkzeug.http import parse_options_header
 import requests
 import json
 from docx import Document as DocxDocument
-from PyPDF2 import PdfReader
-from pptx import Presentation
-from pptx.util import Inches, Pt
-# Removed unused MSO_AUTO_SIZE
-from pptx.enum.text import MSO_ANCHOR, PP_PARAGRAPH_ALIGNMENT
 from pptx.dml.color import RGBColor
-from pptx.enum.shapes import MSO_SHAPE
-from io import BytesIO
 from dotenv import load_dotenv
+from jobs import JobManager, create_job_store, new_job_id, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED, FINISHED_STATES
+from cancellation import JobCancelled, CancelToken, JobCostModel, NULL_TOKEN, OUTLINE_SENT, OUTLINE_DONE, current_cancel_token
+from admission import AdmissionController, AdmissionRejected
+from cache import DiskCache, ExtractionCache, make_cache_key, file_digest
+from llm_client import LLMClient, CircuitOpenError
+from rate_limiter import LLMGovernor, RateLimitExceeded, create_governor_state
+from extraction import extract_pdf_text, extract_docx_text, extractor_version
+from chunking import split_document, build_chunk_summary_prompt, merge_summaries, summarize_chunks
+from slide_parser import SlideStreamParser, parse_slides, finalize_parsed_slides, split_slide_blocks, slide_block_title
+from deck_builder import DeckBuilder
+from metrics import PipelineMetrics, RequestTrace, NULL_TRACE, current_trace
+from merging import merge_documents
+from prompt_budget import PromptBudget, model_from_endpoint
+from prompt_templates import OUTLINE_PROMPT, SLIDE_REPAIR_PROMPT, OUTLINE_CONTINUATION_PROMPT, OUTLINE_SKELETON_PROMPT, SLIDE_NOTES_PROMPT
+from repair import needs_repair, repair_outline
+from two_phase import fill_notes
+from normalization import normalize_text, combine_stats as combine_normalization_stats
+from uploads import read_upload
+from batch import ZipStream, ZIP_READ_ERRORS, iter_zip_members, read_zip_member, unique_archive_name
 
 # Load environment variables from a .env file if it exists
 load_dotenv()
@@ -25,6 +45,8 @@ load_dotenv()
 UPLOAD_FOLDER = 'uploads'
 GENERATED_FOLDER = 'generated'
 ALLOWED_EXTENSIONS = {'docx', 'pdf'}
+# 'single' sends one prompt, 'chunked' summarizes chunks first (map-reduce), 'auto' chunks only oversized documents
+GENERATION_MODES = {'auto', 'single', 'chunked'}
 TEMPLATES = {
     'professional': {
         'title_color': RGBColor(0, 32, 96), 'accent_color': RGBColor(0, 112, 192), 'background_color': RGBColor(255, 255, 255), 'text_color': RGBColor(51, 51, 51), 'notes_suggestion_color': RGBColor(0, 100, 0)
@@ -45,9 +67,156 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['GENERATED_FOLDER'] = GENERATED_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024 # 32 MB max upload size
 app.config['DEFAULT_TEMPLATE'] = 'professional'
+# Background job settings: 'memory' keeps jobs in this process, 'sqlite' shares a local on-disk queue
+app.config['JOB_BACKEND'] = os.environ.get('JOB_BACKEND', 'memory')
+app.config['JOB_DB_PATH'] = os.environ.get('JOB_DB_PATH', 'jobs.db')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+# Processes whose job workers share the 'sqlite' queue (gunicorn.conf.py sets it to its worker count)
+app.config['JOB_PROCESSES'] = int(os.environ.get('JOB_PROCESSES', 1))
+app.config['JOB_TOTAL_WORKERS'] = app.config['JOB_WORKERS'] * (app.config['JOB_PROCESSES'] if app.config['JOB_BACKEND'] == 'sqlite' else 1)
+app.config['JOB_RESULT_TTL'] = int(os.environ.get('JOB_RESULT_TTL', 3600)) # Seconds a finished job stays downloadable
+app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 60)) # A running job not renewed this long lost its worker
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 2)) # Runs of a job whose worker keeps getting lost
+app.config['BATCH_MAX_DOCUMENTS'] = int(os.environ.get('BATCH_MAX_DOCUMENTS', 50)) # Documents queued per /batch request
+# Seconds a /batch/<id>/download response waits for unfinished jobs; it holds a server thread meanwhile
+app.config['BATCH_DOWNLOAD_WAIT_SECONDS'] = int(os.environ.get('BATCH_DOWNLOAD_WAIT_SECONDS', 5))
+# Admission control: submissions get 429 + Retry-After once this many jobs wait (overall / per client); 0 disables a limit
+app.config['ADMISSION_CONTROL'] = os.environ.get('ADMISSION_CONTROL', 'True').lower() in ['true', '1', 't']
+app.config['ADMISSION_MAX_QUEUE'] = int(os.environ.get('ADMISSION_MAX_QUEUE', 4 * app.config['JOB_TOTAL_WORKERS']))
+app.config['ADMISSION_MAX_CLIENT_QUEUE'] = int(os.environ.get('ADMISSION_MAX_CLIENT_QUEUE', 2 * app.config['JOB_TOTAL_WORKERS']))
+app.config['ADMISSION_CLIENT_HEADER'] = os.environ.get('ADMISSION_CLIENT_HEADER', '') # e.g. X-Forwarded-For behind a proxy; default: remote address
+app.config['ADMISSION_DEFAULT_JOB_SECONDS'] = float(os.environ.get('ADMISSION_DEFAULT_JOB_SECONDS', 30.0)) # Until a job has been timed
+# Merge mode: several documents combined into one deck
+app.config['MERGE_MAX_DOCUMENTS'] = int(os.environ.get('MERGE_MAX_DOCUMENTS', 20))
+app.config['MERGE_EXTRACTION_WORKERS'] = int(os.environ.get('MERGE_EXTRACTION_WORKERS', 4)) # Documents extracted concurrently per merge job
+# Stream the LLM response so slides are parsed (and reported to the browser) as they are generated
+app.config['LLM_STREAMING'] = os.environ.get('LLM_STREAMING', 'True').lower() in ['true', '1', 't']
+# Seconds a single /jobs/<id>/events connection stays open before the browser reconnects; each open
+# stream occupies a server thread (one of Waitress's WAITRESS_THREADS), so keep it short there
+app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 5))
+app.config['SSE_HEARTBEAT_SECONDS'] = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 5)) # Comment lines that reveal a closed connection while nothing changes
+# Cancellation: a job whose events stream closed and was not reopened within the grace period is stopped between stages
+app.config['CANCEL_ON_DISCONNECT'] = os.environ.get('CANCEL_ON_DISCONNECT', 'True').lower() in ['true', '1', 't']
+app.config['CANCEL_DISCONNECT_GRACE_SECONDS'] = int(os.environ.get('CANCEL_DISCONNECT_GRACE_SECONDS', 15)) # Covers EventSource reconnects and page reloads
+# Map-reduce generation for long documents
+app.config['DEFAULT_GENERATION_MODE'] = os.environ.get('DEFAULT_GENERATION_MODE', 'auto')
+app.config['CHUNK_SIZE_CHARS'] = int(os.environ.get('CHUNK_SIZE_CHARS', 60000))
+app.config['CHUNK_MAX_WORKERS'] = int(os.environ.get('CHUNK_MAX_WORKERS', 4)) # Concurrent summary calls per document
+app.config['CHUNK_SUMMARY_MAX_TOKENS'] = int(os.environ.get('CHUNK_SUMMARY_MAX_TOKENS', 2048))
+# Repair stage: regenerate slide blocks with missing fields and continue outlines cut off by the output limit
+app.config['SLIDE_REPAIR'] = os.environ.get('SLIDE_REPAIR', 'True').lower() in ['true', '1', 't']
+app.config['SLIDE_REPAIR_WORKERS'] = int(os.environ.get('SLIDE_REPAIR_WORKERS', 4)) # Concurrent repair calls per outline
+app.config['SLIDE_REPAIR_MAX_TOKENS'] = int(os.environ.get('SLIDE_REPAIR_MAX_TOKENS', 1536)) # Output limit for one slide block
+# Two-phase generation: a skeleton outline first, then each slide's notes fields in parallel; the 'two_phase' form field overrides it
+app.config['TWO_PHASE_GENERATION'] = os.environ.get('TWO_PHASE_GENERATION', 'False').lower() in ['true', '1', 't']
+app.config['TWO_PHASE_NOTES_WORKERS'] = int(os.environ.get('TWO_PHASE_NOTES_WORKERS', 8)) # Concurrent notes calls per outline
+app.config['TWO_PHASE_NOTES_MAX_TOKENS'] = int(os.environ.get('TWO_PHASE_NOTES_MAX_TOKENS', 768)) # Output limit for one slide's notes
+app.config['TWO_PHASE_NOTES_DOCUMENT_TOKENS'] = int(os.environ.get('TWO_PHASE_NOTES_DOCUMENT_TOKENS', 6000)) # Source text sent with each notes call
+# Shared LLM HTTP client: keep-alive pool, retries with backoff, circuit breaker
+app.config['LLM_POOL_SIZE'] = int(os.environ.get('LLM_POOL_SIZE', app.config['JOB_WORKERS'] * app.config['CHUNK_MAX_WORKERS']))
+app.config['LLM_MAX_RETRIES'] = int(os.environ.get('LLM_MAX_RETRIES', 3))
+app.config['LLM_TIMEOUT_SECONDS'] = int(os.environ.get('LLM_TIMEOUT_SECONDS', 300)) # Per request; gunicorn.conf.py derives its timeouts from it
+app.config['LLM_BACKOFF_BASE'] = float(os.environ.get('LLM_BACKOFF_BASE', 1.0)) # Seconds; doubles per attempt (with jitter)
+app.config['LLM_BACKOFF_MAX'] = float(os.environ.get('LLM_BACKOFF_MAX', 30.0))
+app.config['LLM_MAX_RETRY_AFTER'] = float(os.environ.get('LLM_MAX_RETRY_AFTER', 60.0)) # Give up instead of waiting longer than this
+app.config['LLM_CIRCUIT_FAILURES'] = int(os.environ.get('LLM_CIRCUIT_FAILURES', 5))
+app.config['LLM_CIRCUIT_RESET_SECONDS'] = float(os.environ.get('LLM_CIRCUIT_RESET_SECONDS', 30.0))
+# LLM governor: client-side TPM/RPM budget and concurrency cap (0 disables a limit)
+app.config['LLM_TPM_LIMIT'] = int(os.environ.get('LLM_TPM_LIMIT', 0))
+app.config['LLM_RPM_LIMIT'] = int(os.environ.get('LLM_RPM_LIMIT', 0))
+app.config['LLM_MAX_CONCURRENT'] = int(os.environ.get('LLM_MAX_CONCURRENT', 0))
+app.config['LLM_MAX_QUEUE_WAIT'] = float(os.environ.get('LLM_MAX_QUEUE_WAIT', 120.0)) # Shed calls that would wait longer
+app.config['GOVERNOR_BACKEND'] = os.environ.get('GOVERNOR_BACKEND', 'memory') # 'sqlite' shares budgets across processes
+app.config['GOVERNOR_DB_PATH'] = os.environ.get('GOVERNOR_DB_PATH', 'governor.db')
+# Prompt budgeting: the model's context window is split between output and prompt (0 = the model's known window)
+app.config['LLM_MODEL'] = os.environ.get('LLM_MODEL', '') or model_from_endpoint(AZURE_ENDPOINT)
+app.config['LLM_CONTEXT_TOKENS'] = int(os.environ.get('LLM_CONTEXT_TOKENS', 0))
+app.config['LLM_MAX_OUTPUT_TOKENS'] = int(os.environ.get('LLM_MAX_OUTPUT_TOKENS', 8192)) # Capped by the model's output limit
+app.config['LLM_PROMPT_SAFETY_TOKENS'] = int(os.environ.get('LLM_PROMPT_SAFETY_TOKENS', 512)) # Margin for token-count error and message framing
+# Record prompt and cached (prefix-cache hit) tokens from the API's usage; streamed requests then ask for usage via stream_options
+app.config['LLM_TRACK_CACHED_TOKENS'] = os.environ.get('LLM_TRACK_CACHED_TOKENS', 'False').lower() in ['true', '1', 't']
+# Text normalization (repeated headers/footers, page numbers, boilerplate, whitespace); the 'normalize' form field overrides it
+app.config['TEXT_NORMALIZATION'] = os.environ.get('TEXT_NORMALIZATION', 'True').lower() in ['true', '1', 't']
+# Text extraction limits
+app.config['EXTRACTION_MAX_CHARS'] = int(os.environ.get('EXTRACTION_MAX_CHARS', 4000000)) # Budget when chunked generation may be used
+app.config['DOCX_EXTRACTION_ENGINE'] = os.environ.get('DOCX_EXTRACTION_ENGINE', 'stream') # 'stream' (paragraphs and tables) or 'python-docx' (paragraphs only)
+app.config['PDF_EXTRACTION_TIME_LIMIT'] = float(os.environ.get('PDF_EXTRACTION_TIME_LIMIT', 120.0)) # Seconds per document
+app.config['PDF_PARALLEL_MIN_PAGES'] = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 64)) # Smaller PDFs are read in-process
+app.config['PDF_EXTRACTION_WORKERS'] = int(os.environ.get('PDF_EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+# In-memory pipeline: uploads and decks stay in (spooled) memory instead of uploads/ and generated/.
+# Only applies to the 'memory' job backend, since 'sqlite' workers may run in another process.
+app.config['PIPELINE_IN_MEMORY'] = os.environ.get('PIPELINE_IN_MEMORY', 'True').lower() in ['true', '1', 't']
+app.config['IN_MEMORY_SPILL_BYTES'] = int(os.environ.get('IN_MEMORY_SPILL_BYTES', 8 * 1024 * 1024)) # Larger files spill to disk
+app.config['UPLOAD_CHUNK_BYTES'] = int(os.environ.get('UPLOAD_CHUNK_BYTES', 64 * 1024)) # /upload bodies are read and stored in chunks of this size
+# Result cache: identical document + options reuse the stored LLM output and deck instead of regenerating
+app.config['RESULT_CACHE_ENABLED'] = os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() in ['true', '1', 't']
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', os.path.join('cache', 'results'))
+app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get('RESULT_CACHE_MAX_MB', 512))
+app.config['RESULT_CACHE_MAX_AGE'] = int(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600)) # Seconds
+# Extraction cache: re-uploads of the same file (any theme, audience or tone) skip text extraction
+app.config['EXTRACTION_CACHE_ENABLED'] = os.environ.get('EXTRACTION_CACHE_ENABLED', 'True').lower() in ['true', '1', 't']
+app.config['EXTRACTION_CACHE_DIR'] = os.environ.get('EXTRACTION_CACHE_DIR', os.path.join('cache', 'extraction'))
+app.config['EXTRACTION_CACHE_MAX_MB'] = int(os.environ.get('EXTRACTION_CACHE_MAX_MB', 256))
+app.config['EXTRACTION_CACHE_MAX_AGE'] = int(os.environ.get('EXTRACTION_CACHE_MAX_AGE', 30 * 24 * 3600)) # Seconds
+# Observability: per-stage histograms on /metrics, and optional per-request JSON traces
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'True').lower() in ['true', '1', 't']
+app.config['REQUEST_TRACE'] = os.environ.get('REQUEST_TRACE', 'False').lower() in ['true', '1', 't'] # Adds 'trace' to job status
+app.config['REQUEST_TRACE_PATH'] = os.environ.get('REQUEST_TRACE_PATH', '') # Also append traces to this JSON-lines file
 os.makedirs(UPLOAD_FOLDER, exist_ok=True); os.makedirs(GENERATED_FOLDER, exist_ok=True)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+llm_client = LLMClient(
+    pool_size=app.config['LLM_POOL_SIZE'],
+    max_retries=app.config['LLM_MAX_RETRIES'],
+    backoff_base=app.config['LLM_BACKOFF_BASE'],
+    backoff_max=app.config['LLM_BACKOFF_MAX'],
+    max_retry_after=app.config['LLM_MAX_RETRY_AFTER'],
+    failure_threshold=app.config['LLM_CIRCUIT_FAILURES'],
+    reset_timeout=app.config['LLM_CIRCUIT_RESET_SECONDS'],
+)
+
+llm_governor = LLMGovernor(
+    create_governor_state(app.config['GOVERNOR_BACKEND'], app.config['GOVERNOR_DB_PATH']),
+    tokens_per_minute=app.config['LLM_TPM_LIMIT'],
+    requests_per_minute=app.config['LLM_RPM_LIMIT'],
+    max_concurrent=app.config['LLM_MAX_CONCURRENT'],
+    max_wait=app.config['LLM_MAX_QUEUE_WAIT'],
+    lease_seconds=app.config['LLM_TIMEOUT_SECONDS'] + 60, # Renewed while a call runs; frees the slots of crashed workers
+)
+
+prompt_budget = PromptBudget(
+    model=app.config['LLM_MODEL'],
+    context_tokens=app.config['LLM_CONTEXT_TOKENS'],
+    max_output_tokens=app.config['LLM_MAX_OUTPUT_TOKENS'],
+    safety_tokens=app.config['LLM_PROMPT_SAFETY_TOKENS'],
+)
+logging.info(f"Prompt budget: {prompt_budget.stats()}")
+
+result_cache = DiskCache(
+    app.config['RESULT_CACHE_DIR'],
+    max_bytes=app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024,
+    max_age=app.config['RESULT_CACHE_MAX_AGE'],
+) if app.config['RESULT_CACHE_ENABLED'] else None
+
+extraction_cache = ExtractionCache(DiskCache(
+    app.config['EXTRACTION_CACHE_DIR'],
+    max_bytes=app.config['EXTRACTION_CACHE_MAX_MB'] * 1024 * 1024,
+    max_age=app.config['EXTRACTION_CACHE_MAX_AGE'],
+)) if app.config['EXTRACTION_CACHE_ENABLED'] else None
+
+deck_builder = DeckBuilder(TEMPLATES, default_template=app.config['DEFAULT_TEMPLATE'])
+
+pipeline_metrics = PipelineMetrics() if app.config['METRICS_ENABLED'] else None
+
+job_costs = JobCostModel() # Average job time and outline tokens, for the savings of cancelled jobs
+
+admission = AdmissionController(
+    max_queue=app.config['ADMISSION_MAX_QUEUE'],
+    max_client_queue=app.config['ADMISSION_MAX_CLIENT_QUEUE'],
+    workers=app.config['JOB_TOTAL_WORKERS'],
+    default_job_seconds=app.config['ADMISSION_DEFAULT_JOB_SECONDS'],
+) if app.config['ADMISSION_CONTROL'] else None
+
 # --- Helper Functions ---
 def allowed_file(filename):
     """Checks if the filename has an allowed extension."""
@@ -55,7 +224,7 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def extract_text_from_docx(filepath):
-    """Extracts text from a DOCX file."""
+    """Extracts paragraph text from a DOCX file (path or binary file object) through python-docx's object model."""
     try:
         doc = DocxDocument(filepath)
         full_text = [p.text for p in doc.paragraphs if p.text.strip()]
@@ -64,108 +233,185 @@ def extract_text_from_docx(filepath):
         logging.error(f"Error extracting text from DOCX '{filepath}': {e}", exc_info=True)
         raise ValueError(f"Could not process DOCX file: {e}")
 
-def extract_text_from_pdf(filepath):
-    """Extracts text from a PDF file."""
-    # NOTE: Requires Python 3.8+ for walrus operator :=
+def extract_text_from_docx_with_stats(filepath, char_budget=None):
+    """Extracts DOCX text with the configured engine and returns (text, stats)."""
+    if app.config['DOCX_EXTRACTION_ENGINE'] == 'python-docx':
+        started = time.perf_counter()
+        text = extract_text_from_docx(filepath)
+        return text, {"engine": "python-docx", "chars": len(text), "seconds": round(time.perf_counter() - started, 3)}
     try:
-        reader = PdfReader(filepath)
-        full_text = []
-        for page in reader.pages:
-            if (text := page.extract_text()) and text.strip():
-                full_text.append(text.strip())
-        return '\n'.join(full_text)
+        text, stats = extract_docx_text(filepath, char_budget)
+    except ValueError as e:
+        logging.error(f"Error extracting text from DOCX '{filepath}': {e}")
+        raise
+    logging.info(f"DOCX extraction: {stats['paragraphs']} paragraphs, {stats['table_rows']} table rows, {stats['chars']} chars "
+                 f"in {stats['seconds']}s{' (budget reached)' if stats['budget_reached'] else ''}.")
+    return text, stats
+
+def extract_text_from_pdf(filepath, char_budget=None):
+    """Extracts text from a PDF file (path or binary file object), stopping once `char_budget` characters have been read."""
+    return extract_text_from_pdf_with_stats(filepath, char_budget)[0]
+
+def extract_text_from_pdf_with_stats(filepath, char_budget=None):
+    """Extracts PDF text page by page (in parallel for large files) and returns (text, stats)."""
+    try:
+        text, stats = extract_pdf_text(
+            filepath,
+            char_budget=char_budget,
+            time_limit=app.config['PDF_EXTRACTION_TIME_LIMIT'],
+            parallel_min_pages=app.config['PDF_PARALLEL_MIN_PAGES'],
+            max_workers=app.config['PDF_EXTRACTION_WORKERS'],
+        )
     except Exception as e:
         logging.error(f"Error extracting text from PDF '{filepath}': {e}", exc_info=True)
         raise ValueError(f"Could not process PDF file: {e}")
+    logging.info(f"PDF extraction: {stats['pages_read']}/{stats['pages_total']} pages, {stats['chars']} chars in {stats['seconds']}s"
+                 f" ({'parallel' if stats['parallel'] else 'serial'}{', budget reached' if stats['budget_reached'] else ''}).")
+    return text, stats
+
+def extract_document(source, file_ext, filename, char_budget=None, digest=None):
+    """Extracts the text of one upload, stopping around `char_budget` characters. Returns (text, stats).
+
+    With the extraction cache enabled, text already extracted from the same bytes by the same
+    extractor is reused; stats['cache'] is then 'hit' (or 'miss' when it was extracted now).
+    `digest` is the upload's SHA-256 if it was computed while the upload was received.
+    """
+    if extraction_cache is None or file_ext not in ('.docx', '.pdf'):
+        return extract_uncached_document(source, file_ext, filename, char_budget)
+    started = time.perf_counter()
+    version = extractor_version(file_ext, app.config['DOCX_EXTRACTION_ENGINE'])
+    digest = digest or file_digest(source)
+    cached = extraction_cache.get(digest, version, char_budget)
+    if cached is not None:
+        text, stats = cached
+        lookup_seconds = round(time.perf_counter() - started, 3)
+        logging.info(f"Extraction cache hit for '{filename}': {len(text)} chars in {lookup_seconds}s "
+                     f"(extraction took {stats.get('seconds')}s).")
+        current_trace().set(extraction_cache='hit')
+        return text, dict(stats, cache='hit', lookup_seconds=lookup_seconds)
+    text, stats = extract_uncached_document(source, file_ext, filename, char_budget)
+    current_trace().set(extraction_cache='miss')
+    if not stats.get('timed_out'): # A partial read under time pressure may do better next time
+        extraction_cache.put(digest, version, char_budget, text, stats)
+    return text, dict(stats, cache='miss')
+
+def extract_uncached_document(source, file_ext, filename, char_budget=None):
+    """Runs the extractor for the upload's file type. Returns (text, stats)."""
+    if file_ext == '.docx':
+        return extract_text_from_docx_with_stats(source, char_budget)
+    if file_ext == '.pdf':
+        return extract_text_from_pdf_with_stats(source, char_budget)
+    # Should be caught by initial validation, but acts as a safeguard
+    raise ValueError(f"Unsupported file type '{file_ext}' encountered during processing.")
+
+def log_normalization(filename, stats):
+    logging.info(f"Normalized text of '{filename}': {stats['chars_before']} -> {stats['chars_after']} chars"
+                 f" (~{stats['estimated_tokens_before']} -> ~{stats['estimated_tokens_after']} tokens) in {stats['seconds']}s.")
+
+def extract_and_merge(sources, char_budget, normalize=False):
+    """Extracts several uploads in parallel and merges them into one source text (see merging.py).
+
+    `sources` is a list of (source, file_ext, filename, digest). Each document is extracted up to
+    EXTRACTION_MAX_CHARS, since duplicates are only known after extraction; the merged text is
+    then fitted into `char_budget`. With `normalize`, each document is normalized before the
+    merge and the combined normalization stats are included. Documents that cannot be read or
+    are empty are skipped and listed in the stats; ValueError is raised only if none are usable.
+    Returns (text, stats).
+    """
+    started = time.monotonic()
+
+    def extract(item):
+        source, file_ext, filename, digest = item
+        try:
+            text = extract_document(source, file_ext, filename, app.config['EXTRACTION_MAX_CHARS'], digest)[0]
+        except ValueError as e:
+            return None, None, str(e)
+        normalization_stats = None
+        if normalize and text:
+            text, normalization_stats = normalize_text(text, prompt_budget.count)
+        return text, normalization_stats, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(sources), app.config['MERGE_EXTRACTION_WORKERS']))) as pool:
+        results = list(pool.map(extract, sources))
+
+    documents = []
+    skipped = []
+    for (_, _, filename, _), (text, _, error) in zip(sources, results):
+        if error is None and (not text or len(text.strip()) < 50):
+            error = "Document appears to be empty or text could not be extracted properly."
+        if error is not None:
+            logging.warning(f"Merge: skipping '{filename}': {error}")
+            skipped.append({"filename": filename, "error": error})
+            continue
+        documents.append((filename, text))
+    if not documents:
+        raise ValueError("None of the documents contained extractable text. Please check the document contents.")
+
+    merged, stats = merge_documents(documents, char_budget)
+    stats.update(skipped=skipped, seconds=round(time.monotonic() - started, 3))
+    if normalize:
+        stats['normalization'] = combine_normalization_stats([result[1] for result in results if result[1] is not None])
+        log_normalization(f"{len(sources)} merged documents", stats['normalization'])
+    logging.info(f"Merged {len(documents)} documents: {stats['input_chars']} chars extracted, {stats['unique_chars']} unique"
+                 f" ({stats['duplicate_paragraphs']} duplicate paragraphs dropped), {stats['merged_chars']} sent.")
+    return merged, stats
 
 # *** build_llm_prompt FUNCTION ***
-def build_llm_prompt(document_text, template_name='professional', audience="", tone=""):
-    """Builds the detailed prompt for the LLM."""
-    max_chars = 400000 # Limit input text size (adjust as needed for token limits)
-    truncated_text = document_text[:max_chars]
-    if len(document_text) > max_chars:
-        logging.warning(f"Input document text truncated to {max_chars} characters for LLM prompt.")
+def prompt_versions(two_phase=False):
+    """Names and versions of the prompt templates a job's pipeline uses; part of the result cache key,
+    so changing any of them invalidates the cached outputs it produced."""
+    templates = [OUTLINE_SKELETON_PROMPT, SLIDE_NOTES_PROMPT] if two_phase else [OUTLINE_PROMPT]
+    if app.config['SLIDE_REPAIR']:
+        templates += [SLIDE_REPAIR_PROMPT, OUTLINE_CONTINUATION_PROMPT]
+    return ','.join(f"{template.name}-{template.version}" for template in templates)
+
+def build_llm_prompt(document_text, template_name='professional', audience="", tone="", template=OUTLINE_PROMPT, system_message=None):
+    """Builds the detailed prompt for the LLM, trimming the document to the prompt's token budget.
+
+    `template` is OUTLINE_PROMPT, or OUTLINE_SKELETON_PROMPT for the first call of two-phase generation;
+    `system_message` is the one the call is sent with (None: OUTLINE_SYSTEM_MESSAGE).
+    """
+    context_str = build_prompt_context(template_name, audience, tone)
+    document_tokens = outline_document_tokens(context_str, template, system_message)
+    prompt, used_tokens, truncated = fit_outline_prompt(document_text, context_str, template, document_tokens)
+    logging.info(f"Prompt allocation ({prompt_budget.model}, {prompt_budget.tokenizer}): {prompt_budget.context_tokens} context = "
+                 f"{prompt_budget.output_tokens} output + {prompt_budget.safety_tokens} margin + "
+                 f"{prompt_budget.input_tokens - document_tokens} instructions + {document_tokens} document ({used_tokens} used).")
+    current_trace().set(prompt_document_tokens=used_tokens, prompt_document_budget=document_tokens, prompt_truncated=truncated)
+    return prompt
 
+def fit_outline_prompt(document_text, context_str, template, document_tokens):
+    """Renders `template` with the document trimmed on a paragraph boundary to `document_tokens`. Returns (prompt, used tokens, truncated)."""
+    text = document_text.replace('\f', '\n') # Page breaks only matter to the chunker
+    fitted_text, used_tokens, truncated = prompt_budget.fit(text, document_tokens)
+    if truncated:
+        logging.warning(f"Input document text truncated on a paragraph boundary to {used_tokens} tokens "
+                        f"({len(fitted_text)} of {len(text)} characters) for LLM prompt.")
+    return template.render(context=context_str, document=fitted_text), used_tokens, truncated
+
+def build_prompt_context(template_name='professional', audience="", tone=""):
+    """The 'User-Provided Context' lines of the outline prompt."""
     context_lines = []
     if audience: context_lines.append(f"**Target Audience:** {audience}")
     if tone: context_lines.append(f"**Desired Tone:** {tone}")
     if template_name: context_lines.append(f"**Visual Style Hint:** '{template_name.capitalize()}' theme.")
-    context_str = "\n".join(context_lines)
-
-    # The detailed prompt structure remains the same
-    prompt = f"""
-You are an expert presentation designer AND coach creating a **robust and detailed first draft** PowerPoint outline (~10-15 slides) with speaker notes and suggestions. Structure information logically for the audience/tone. Ensure bullet points are informative (~10-15 words/short sentences).
-
-**User-Provided Context:**
-{context_str if context_lines else "**User Context:** None provided."}
-
-**CRITICAL INSTRUCTIONS:**
-1. Generate the entire response following the structure below for **EVERY** slide.
-2. **ALL fields listed (Slide Title, Content Type, Key Message, Bullets (at least one), Visual Suggestion, Design Note, Notes, Elaboration, Enhancement Suggestion, Best Practice Tip) ARE REQUIRED for each slide block.** Do not omit fields. Provide meaningful content or state 'None' or 'N/A' where appropriate but the field label MUST be present.
-3. Start each slide block *exactly* with `---` on its own line.
-4. Ensure bullets start with '- ' and contain substantial information, not just keywords.
-5. Elaboration MUST expand significantly on the bullets/key message for the speaker.
-6. Enhancement Suggestion and Best Practice Tip MUST be actionable and relevant.
-
-**Required Slide Block Format (Example Included):**
-
----
-Slide Title: [Concise Title in Title Case]
-Content Type: [Text Only / Text and Image / Text and Chart / etc.]
-Key Message: [**Single sentence essence** tailored for Audience/Tone.]
-- [Bullet 1: **Informative point** (~10-15 words/short sentence) directly from or synthesized from the source text.]
-- [Bullet 2: (Optional) ditto. Use 3-5 relevant bullets per slide.]
-- [...]
-Visual Suggestion: [Specific & actionable suggestion (e.g., 'Bar chart comparing Q1 vs Q2 sales', 'Icon representing collaboration') or "Text Focus".]
-Design Note: [Optional: Suggest specific emphasis, layout idea, or callout.]
-Notes: [Optional: Brief background context, source reference, or data point origin.]
-**Elaboration:** [REQUIRED: Expand significantly on the slide's points (2-4 detailed sentences). Provide context, nuance, or talking points for the speaker.]
-**Enhancement Suggestion:** [REQUIRED: Offer 1-2 concrete, actionable ideas for the user to improve this specific slide (e.g., 'Add a customer quote here', 'Break this into two slides if time permits').]
-**Best Practice Tip:** [REQUIRED: Provide one relevant presentation best practice tip for this type of slide content (e.g., 'Use high-contrast colors for accessibility', 'Limit text to 6 lines per slide').]
----
-
-**Example of ONE complete slide block:**
----
-Slide Title: Understanding the Core Problem
-Content Type: Text Only
-Key Message: Current manual processes lead to significant delays and potential errors in reporting, impacting timely decisions.
-- Manual data entry is time-consuming, taking approximately 4 hours per week per analyst involved in the process.
-- Lack of real-time validation mechanisms increases the risk of inaccurate financial statements being circulated.
-- Reporting delays directly impact the ability of executive leadership to make informed, timely strategic decisions.
-Visual Suggestion: Icon representing 'Time Wasted' or 'Error Symbol'. Consider a simple process flow showing the manual steps.
-Design Note: Use bold text or a distinct color for the time/delay figures mentioned in the elaboration.
-Notes: Data based on internal Q3 process review document and interviews with the finance team.
-**Elaboration:** The 4-hour figure represents an average across five analysts; peak times near month-end are higher. Errors identified later require significant rework, sometimes delaying the final month-end close by up to two business days. Leadership relies on these reports for the Wednesday morning strategy meeting, requiring accuracy by EOD Tuesday.
-**Enhancement Suggestion:** Quantify the potential financial cost of errors (e.g., average cost per correction, impact of delayed decisions) if possible. Consider adding a brief, anonymous quote from an analyst about the manual process friction.
-**Best Practice Tip:** When presenting a problem slide, clearly articulate the 'so what?' – the direct impact on key business objectives or stakeholders (like leadership decision-making).
----
-
-**(Continue generating ALL subsequent slide blocks using the EXACT format above, including ALL required fields)**
-
-**Presentation Flow Guidance (Adapt as needed based on content):**
-1. Title Slide, 2. Agenda/Overview, 3. Introduction/Problem Statement, 4. Section 1 (1-3 slides), 5. Section 2 (1-3 slides), 6. Section 3 (1-3 slides) [Adjust section count based on text length/complexity], 7. Key Findings/Analysis (if applicable), 8. Recommendations/Solutions, 9. Next Steps/Call to Action, 10. Conclusion/Summary, 11. Q&A/Contact Information
-
-**Content & Style Guidelines:**
-* Structure Comprehensively: Ensure a logical flow from start to finish.
-* Informative Bullets: ~10-15 words per bullet, focus on clarity and impact.
-* Prioritize Key Info: Extract the most important messages from the source text.
-* Tailor Tone/Audience: Reflect the specified audience and tone in language and focus.
-* Elaborate Meaningfully: Notes should add real value for the speaker.
-* Actionable Suggestions: Enhancements and Tips should be practical.
-* Data Storytelling: If data is present, weave it into a narrative.
-* Handle Missing Content Gracefully: If source text is sparse for a section, indicate this clearly (e.g., in Notes) but still attempt to generate a placeholder slide with suggestions.
-
-**Source Document Text:**
-\"\"\"
-{truncated_text}
-\"\"\"
-
-Generate the **complete** presentation outline now, following ALL instructions meticulously for **EVERY** slide. Ensure all required fields (Slide Title, Content Type, Key Message, Bullets, Visual Suggestion, Design Note, Notes, Elaboration, Enhancement Suggestion, Best Practice Tip) are present in each block starting with `---`.
-"""
-    return prompt
+    return "\n".join(context_lines) if context_lines else "**User Context:** None provided."
+
+def outline_document_tokens(context_str="", template=OUTLINE_PROMPT, system_message=None):
+    """Prompt tokens left for document text after the system message (None: OUTLINE_SYSTEM_MESSAGE) and `template`'s instructions."""
+    overhead = prompt_budget.count(system_message or OUTLINE_SYSTEM_MESSAGE) + prompt_budget.count(template.render(context=context_str, document=""))
+    return max(0, prompt_budget.input_tokens - overhead)
 
 # *** call_llm FUNCTION (WITH FIX INCORPORATED) ***
-def call_llm(prompt):
+LLM_MAX_OUTPUT_TOKENS = prompt_budget.output_tokens # LLM_MAX_OUTPUT_TOKENS setting, capped for the model
+LLM_TIMEOUT_SECONDS = app.config['LLM_TIMEOUT_SECONDS']
+OUTLINE_SYSTEM_MESSAGE = "You are an expert presentation designer/coach creating detailed PowerPoint outlines following strict formatting rules, including mandatory elaboration and suggestion fields."
+
+def build_llm_request(prompt, stream=False, system_message=None, max_tokens=None, extra_messages=None):
+    """Returns the (headers, payload) pair for a chat-completions request.
+
+    `extra_messages` (e.g. an assistant turn and a follow-up) are appended after the prompt.
+    """
     if not AZURE_ENDPOINT or not AZURE_API_KEY:
         raise ValueError("AI Service endpoint or API key not configured in environment variables.") # More specific error
 
@@ -173,30 +419,141 @@ def call_llm(prompt):
         "Content-Type": "application/json",
         "api-key": AZURE_API_KEY
     }
-    # Consider making these configurable or constants
-    max_output_tokens = 8192
-    timeout_seconds = 300
-
     payload = {
         "messages": [
             {
                 "role": "system",
-                "content": "You are an expert presentation designer/coach creating detailed PowerPoint outlines following strict formatting rules, including mandatory elaboration and suggestion fields."
+                "content": system_message or OUTLINE_SYSTEM_MESSAGE
             },
             {
                 "role": "user",
                 "content": prompt
             }
-        ],
-        "max_tokens": max_output_tokens,
+        ] + list(extra_messages or []),
+        "max_tokens": max_tokens or LLM_MAX_OUTPUT_TOKENS,
         "temperature": 0.5, # Adjust temperature as needed (0.5 is balanced)
         "top_p": 0.95
         # Consider adding other parameters like 'frequency_penalty', 'presence_penalty' if needed
     }
+    if stream:
+        payload["stream"] = True
+        if app.config['LLM_TRACK_CACHED_TOKENS']:
+            payload["stream_options"] = {"include_usage": True} # Usage arrives in a final chunk with no choices
+    return headers, payload
+
+def check_llm_output(llm_output, finish_reason, max_output_tokens, expect_slides=True):
+    """Logs warnings for truncated or structurally suspicious LLM output."""
+    if finish_reason == 'length':
+        logging.warning(f"LLM response may have been truncated because it reached the maximum token limit ({max_output_tokens} tokens).")
+    elif finish_reason != 'stop':
+         logging.warning(f"LLM response finished with reason: '{finish_reason}'. Expected 'stop'.")
+
+    # Basic sanity check on content structure
+    if expect_slides and (not llm_output or "---" not in llm_output or "Slide Title:" not in llm_output):
+        logging.warning(f"LLM output seems to lack the expected basic slide structure (--- and Slide Title:). Preview: {llm_output[:200]}...")
+        # Decide if this should be a hard error or just a warning based on requirements
+        # raise ValueError("AI response content lacks expected structure.")
+
+def raise_llm_request_error(e):
+    """Logs a failed API request and raises a user-facing ValueError for it."""
+    if isinstance(e, CircuitOpenError):
+        logging.error(f"LLM API request rejected without sending: {e}")
+        raise ValueError("The AI service is currently unavailable after repeated failures. Please try again in a minute.")
+
+    # --- FIX: Corrected try-except block for error details ---
+    status_code = e.response.status_code if e.response is not None else "N/A"
+    error_details_str = str(e) # Default error details to the exception string
+
+    if e.response is not None:
+        # Try to get more specific error details from the response body
+        try:
+            # Attempt to parse response body as JSON for detailed error messages
+            error_data = e.response.json()
+            # Look for common error structures (adapt based on Azure API specifics)
+            if isinstance(error_data, dict) and 'error' in error_data:
+                 error_details_str = json.dumps(error_data['error'])
+            else:
+                 error_details_str = json.dumps(error_data) # Convert full JSON details to string
+        except json.JSONDecodeError:
+            # If response is not JSON, use the raw text (limit length)
+            error_details_str = e.response.text[:500] + ('...' if len(e.response.text) > 500 else '')
+        except Exception as json_ex:
+             # Catch unexpected errors during JSON parsing/dumping
+             logging.warning(f"Could not parse error response body, using raw text. Error: {json_ex}")
+             error_details_str = e.response.text[:500] + ('...' if len(e.response.text) > 500 else '') # Fallback to raw text
+
+    logging.error(f"LLM API request failed: {e}. Status Code: {status_code}. Response Details: {error_details_str}", exc_info=False) # Log details, but maybe not full traceback unless debugging
+
+    # Provide more specific user-facing errors based on status code
+    if status_code == 401:
+        raise ValueError("AI service authentication failed. Please check your API key configuration.")
+    elif status_code == 404:
+         raise ValueError("AI service endpoint not found. Please check the AZURE_OPENAI_ENDPOINT URL.")
+    elif status_code == 429:
+        raise ValueError("AI service rate limit exceeded or quota reached. Please wait and try again later or check your service plan.")
+    elif status_code == 400:
+        # Include details if available, otherwise a generic message
+        detail_msg = f": {error_details_str}" if error_details_str != str(e) else ""
+        raise ValueError(f"AI service rejected the request due to invalid input (Bad Request){detail_msg}. Please check the generated prompt or input document.")
+    elif status_code != "N/A" and status_code >= 500:
+         raise ValueError(f"The AI service encountered an internal server error (Status: {status_code}). Please try again later.")
+    else:
+        # Generic error for other client/server issues
+        raise ValueError(f"API communication error occurred (Status Code: {status_code}). Check network connection and API status.")
+    # --- End Fix ---
+
+def record_llm_usage(usage, payload, lease=None, outline=False):
+    """Applies the token usage the API reported for one call (`usage` may be None); `outline` marks the outline call."""
+    usage = usage or {}
+    prompt_tokens = usage.get('prompt_tokens')
+    # Calibrate the characters-per-token estimate against the model's own count
+    prompt_budget.observe(sum(len(message["content"]) for message in payload["messages"]), prompt_tokens)
+    if lease is not None:
+        # Return the unused part of the reservation to the tokens-per-minute budget
+        lease.settle(usage.get('total_tokens'))
+    if app.config['LLM_TRACK_CACHED_TOKENS'] and prompt_tokens is not None:
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        llm_client.record_usage(prompt_tokens, cached_tokens, usage.get('completion_tokens') or 0)
+        if outline:
+            current_trace().set(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+    if outline and prompt_tokens is not None:
+        job_costs.observe_outline(prompt_tokens, usage.get('completion_tokens') or 0)
+
+@contextmanager
+def admit_llm_call(prompt, max_output_tokens):
+    """Holds the LLM governor's admission for one call, sized from the prompt plus the output budget."""
+    estimated_tokens = prompt_budget.count(prompt) + max_output_tokens
+    started = time.perf_counter()
+    try:
+        with llm_governor.acquire(estimated_tokens, current_cancel_token().check) as lease:
+            current_trace().record('llm_admission', time.perf_counter() - started)
+            yield lease
+    except RateLimitExceeded as e:
+        raise ValueError(f"The AI service is at capacity right now (estimated wait {e.wait_seconds:.0f}s). Please try again shortly.")
+
+def call_llm(prompt, system_message=None, max_tokens=None, extra_messages=None, outline=None):
+    """Sends one chat-completion request once the LLM governor admits it. Returns (output, finish_reason).
+
+    `outline` marks requests expected to return slide blocks; by default, those with the outline system message.
+    """
+    admitted_text = prompt + ''.join(message["content"] for message in extra_messages or [])
+    if outline is None:
+        outline = system_message is None
+    current_cancel_token().check() # Not worth sending for a cancelled job
+    with admit_llm_call(admitted_text, max_tokens or LLM_MAX_OUTPUT_TOKENS) as lease:
+        return _call_llm(prompt, system_message, max_tokens, lease, extra_messages, outline)
+
+def _call_llm(prompt, system_message=None, max_tokens=None, lease=None, extra_messages=None, outline=True):
+    headers, payload = build_llm_request(prompt, system_message=system_message, max_tokens=max_tokens, extra_messages=extra_messages)
+    max_output_tokens = payload["max_tokens"]
+    timeout_seconds = LLM_TIMEOUT_SECONDS
+    token = current_cancel_token()
+    if outline and token is not NULL_TOKEN:
+        token.outline = OUTLINE_DONE # A non-streamed call cannot be stopped once sent, so nothing is left to save
 
     try:
         logging.info(f"Calling Azure OpenAI API at {AZURE_ENDPOINT} (max_tokens: {max_output_tokens}, timeout: {timeout_seconds}s)...")
-        response = requests.post(AZURE_ENDPOINT, headers=headers, json=payload, timeout=timeout_seconds)
+        response = llm_client.post(AZURE_ENDPOINT, check=token.check, headers=headers, json=payload, timeout=timeout_seconds)
         response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
 
         result = response.json() # Parse JSON response
@@ -227,68 +584,25 @@ def call_llm(prompt):
 
         llm_output = llm_output.strip() # Strip leading/trailing whitespace
         finish_reason = first_choice.get('finish_reason', 'unknown')
+        if outline:
+            current_trace().set(finish_reason=finish_reason)
+        # Only outline requests are expected to contain slide blocks
+        check_llm_output(llm_output, finish_reason, max_output_tokens, expect_slides=outline)
 
-        if finish_reason == 'length':
-            logging.warning(f"LLM response may have been truncated because it reached the maximum token limit ({max_output_tokens} tokens).")
-        elif finish_reason != 'stop':
-             logging.warning(f"LLM response finished with reason: '{finish_reason}'. Expected 'stop'.")
-
-
-        # Basic sanity check on content structure
-        if not llm_output or "---" not in llm_output or "Slide Title:" not in llm_output:
-            logging.warning(f"LLM output seems to lack the expected basic slide structure (--- and Slide Title:). Preview: {llm_output[:200]}...")
-            # Decide if this should be a hard error or just a warning based on requirements
-            # raise ValueError("AI response content lacks expected structure.")
+        record_llm_usage(result.get('usage'), payload, lease, outline=outline)
 
         logging.info(f"LLM Response Received Successfully (finish_reason: {finish_reason}).")
-        return llm_output
+        return llm_output, finish_reason
 
     except requests.exceptions.Timeout:
         logging.error(f"LLM API call timed out after {timeout_seconds} seconds.")
         raise ValueError(f"Request timed out after {timeout_seconds}s waiting for AI service.") # More user-friendly timeout message
 
     except requests.exceptions.RequestException as e:
-        # --- FIX: Corrected try-except block for error details ---
-        status_code = e.response.status_code if e.response is not None else "N/A"
-        error_details_str = str(e) # Default error details to the exception string
+        raise_llm_request_error(e)
 
-        if e.response is not None:
-            # Try to get more specific error details from the response body
-            try:
-                # Attempt to parse response body as JSON for detailed error messages
-                error_data = e.response.json()
-                # Look for common error structures (adapt based on Azure API specifics)
-                if isinstance(error_data, dict) and 'error' in error_data:
-                     error_details_str = json.dumps(error_data['error'])
-                else:
-                     error_details_str = json.dumps(error_data) # Convert full JSON details to string
-            except json.JSONDecodeError:
-                # If response is not JSON, use the raw text (limit length)
-                error_details_str = e.response.text[:500] + ('...' if len(e.response.text) > 500 else '')
-            except Exception as json_ex:
-                 # Catch unexpected errors during JSON parsing/dumping
-                 logging.warning(f"Could not parse error response body, using raw text. Error: {json_ex}")
-                 error_details_str = e.response.text[:500] + ('...' if len(e.response.text) > 500 else '') # Fallback to raw text
-
-        logging.error(f"LLM API request failed: {e}. Status Code: {status_code}. Response Details: {error_details_str}", exc_info=False) # Log details, but maybe not full traceback unless debugging
-
-        # Provide more specific user-facing errors based on status code
-        if status_code == 401:
-            raise ValueError("AI service authentication failed. Please check your API key configuration.")
-        elif status_code == 404:
-             raise ValueError("AI service endpoint not found. Please check the AZURE_OPENAI_ENDPOINT URL.")
-        elif status_code == 429:
-            raise ValueError("AI service rate limit exceeded or quota reached. Please wait and try again later or check your service plan.")
-        elif status_code == 400:
-            # Include details if available, otherwise a generic message
-            detail_msg = f": {error_details_str}" if error_details_str != str(e) else ""
-            raise ValueError(f"AI service rejected the request due to invalid input (Bad Request){detail_msg}. Please check the generated prompt or input document.")
-        elif status_code >= 500:
-             raise ValueError(f"The AI service encountered an internal server error (Status: {status_code}). Please try again later.")
-        else:
-            # Generic error for other client/server issues
-            raise ValueError(f"API communication error occurred (Status Code: {status_code}). Check network connection and API status.")
-        # --- End Fix ---
+    except JobCancelled:
+        raise # Cancelled while backing off between retries; not an AI service error
 
     except json.JSONDecodeError as e:
          # Handle cases where the successful response (2xx) is not valid JSON
@@ -308,398 +622,96 @@ def call_llm(prompt):
         logging.error(f"An unexpected error occurred during the LLM call: {e}", exc_info=True)
         raise ValueError(f"An unexpected error occurred while communicating with the AI service.")
 
-# *** parse_llm_output FUNCTION ***
-def parse_llm_output(llm_text):
-    """Parses the structured text output from LLM into a list of slide dictionaries."""
-    slides = []
-    # Regex to split by '---' possibly surrounded by whitespace, ensuring it's on its own line
-    slide_blocks = re.split(r'\n\s*---\s*\n', llm_text.strip())
-
-    # Define all expected fields, including required and optional ones
-    core_required_fields = {'title', 'content_type', 'key_message'}
-    suggestion_fields = {'elaboration', 'enhancement_suggestion', 'best_practice_tip'}
-    optional_fields = {'visual', 'design_note', 'notes', 'bullets'} # Bullets are technically optional if content dictates
-    all_expected_fields = core_required_fields.union(suggestion_fields).union(optional_fields)
-
-    # Default text for required suggestion fields if LLM omits them (though prompt asks it not to)
-    default_suggestion = "Suggestion not provided by AI."
-
-    # Prefixes for easier parsing (lowercase for case-insensitivity)
-    # Ensure keys match the field names used in the dictionaries
-    prefixes = {
-        'slide title:': ('title', 12),
-        'content type:': ('content_type', 13),
-        'key message:': ('key_message', 12),
-        'visual suggestion:': ('visual', 18),
-        'design note:': ('design_note', 12),
-        'notes:': ('notes', 6),
-        'elaboration:': ('elaboration', 12),
-        'enhancement suggestion:': ('enhancement_suggestion', 23),
-        'best practice tip:': ('best_practice_tip', 18),
-    }
-
-    for block_idx, block in enumerate(slide_blocks):
-        block = block.strip()
-        if not block or block == '---': # Skip empty blocks or blocks just containing the separator
-            continue
-
-        current_slide = {field: '' for field in all_expected_fields} # Initialize with defaults
-        current_slide['bullets'] = [] # Initialize bullets as list
-        current_field_key = None # Tracks the field being processed for multi-line content
-
-        lines = block.split('\n')
-        field_buffer = {} # Temporary storage for field content during line processing
-
-        for line_num, line in enumerate(lines):
-            line_strip = line.strip()
-            line_lower = line.lower()
-            if not line_strip: continue # Skip empty lines
-
-            # --- Check for Bullets ---
-            if line.startswith('- '):
-                bullet_content = line[2:].strip()
-                if bullet_content: # Only add non-empty bullets
-                    field_buffer.setdefault('bullets', []).append(bullet_content)
-                current_field_key = 'bullets' # Set context
-                continue # Move to next line
-
-            # --- Check for Field Prefixes ---
-            matched_prefix = False
-            for prefix, (field_key, prefix_len) in prefixes.items():
-                if line_lower.startswith(prefix):
-                    # Found a field prefix, store its content
-                    field_content = line[prefix_len:].strip()
-                    field_buffer[field_key] = field_content
-                    current_field_key = field_key # Update context to the new field
-                    matched_prefix = True
-                    break # Stop checking prefixes for this line
-
-            # --- Handle Multi-line Content ---
-            if not matched_prefix and current_field_key and current_field_key in field_buffer:
-                # If no prefix matched, and we know the current field context, append the line
-                # This handles multi-line descriptions for fields like Elaboration, Notes, etc.
-                # Exclude appending to 'bullets' field here, as bullets are handled separately
-                if current_field_key != 'bullets':
-                     field_buffer[current_field_key] += f"\n{line_strip}"
-
-        # --- Finalize Slide Data after processing all lines in the block ---
-        current_slide.update(field_buffer) # Update slide dict with buffered content
-
-        # Validate Core Fields: Ensure they exist and are not empty after stripping
-        core_fields_present_and_filled = all(
-            f in current_slide and current_slide[f].strip() for f in core_required_fields
-        )
-
-        if core_fields_present_and_filled:
-            # Apply defaults for suggestion fields if they are missing or empty
-            for f in suggestion_fields:
-                if not current_slide.get(f, '').strip():
-                    current_slide[f] = default_suggestion
+# *** call_llm_stream FUNCTION ***
+def call_llm_stream(prompt, on_delta=None, system_message=None):
+    """Streaming variant of call_llm: reads server-sent chunks and passes each text delta to `on_delta`.
+
+    Returns the complete (stripped) output and the finish_reason once the stream ends, like call_llm.
+    If the job is cancelled meanwhile, the stream is closed (ending the generation) and JobCancelled raised.
+    """
+    current_cancel_token().check()
+    with admit_llm_call(prompt, LLM_MAX_OUTPUT_TOKENS) as lease:
+        return _call_llm_stream(prompt, on_delta, lease, system_message)
+
+def _call_llm_stream(prompt, on_delta=None, lease=None, system_message=None):
+    headers, payload = build_llm_request(prompt, stream=True, system_message=system_message)
+    timeout_seconds = LLM_TIMEOUT_SECONDS
+    deadline = time.monotonic() + timeout_seconds
+    output_parts = []
+    finish_reason = 'unknown'
+    usage = None
+    token = current_cancel_token()
+    if token is not NULL_TOKEN:
+        token.outline = OUTLINE_SENT
 
-            # Ensure bullet list exists even if empty
-            current_slide.setdefault('bullets', [])
+    try:
+        logging.info(f"Calling Azure OpenAI API (streaming) at {AZURE_ENDPOINT} (max_tokens: {LLM_MAX_OUTPUT_TOKENS}, timeout: {timeout_seconds}s)...")
+        with llm_client.post(AZURE_ENDPOINT, check=token.check, headers=headers, json=payload, timeout=timeout_seconds,
+                             stream=True) as response:
+            response.raise_for_status()
+            for raw_line in response.iter_lines(decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise requests.exceptions.Timeout()
+                token.check() # Leaving the with block closes the connection
+                if not raw_line or not raw_line.startswith('data:'):
+                    continue # Blank keep-alive lines and SSE comments
+                data = raw_line[5:].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    usage = chunk['usage']
+                # Azure sends an initial chunk with prompt filter results and no choices
+                for choice in chunk.get('choices') or []:
+                    delta_text = (choice.get('delta') or {}).get('content')
+                    if delta_text:
+                        output_parts.append(delta_text)
+                        token.streamed_chars += len(delta_text)
+                        if on_delta:
+                            on_delta(delta_text)
+                    if choice.get('finish_reason'):
+                        finish_reason = choice['finish_reason']
 
-            slides.append(current_slide)
-        else:
-            # Log skipped blocks more informatively
-            missing_or_empty_core = [f for f in core_required_fields if not current_slide.get(f, '').strip()]
-            title_preview = current_slide.get('title', 'N/A')
-            logging.warning(
-                f"Skipping Block {block_idx+1}. Missing/Empty Core Fields: {missing_or_empty_core}. "
-                f"Title='{title_preview}'. Block Preview: '{block[:150]}...'"
-            )
+    except requests.exceptions.Timeout:
+        logging.error(f"LLM API call timed out after {timeout_seconds} seconds.")
+        raise ValueError(f"Request timed out after {timeout_seconds}s waiting for AI service.")
 
-    if not slides:
-        # Critical if no slides could be parsed
-        logging.error(f"Failed to parse ANY valid slide blocks from the LLM output. Output Preview: {llm_text[:500]}...")
-        raise ValueError("AI response parsing failed. Could not find any slides with the required structure (Title, Content Type, Key Message). Please check the AI's output format.")
+    except requests.exceptions.RequestException as e:
+        raise_llm_request_error(e)
 
-    logging.info(f"Successfully parsed {len(slides)} slides from LLM output.")
-    return slides
+    except json.JSONDecodeError as e:
+        logging.error(f"Failed to decode streamed chunk from LLM API: {e}", exc_info=True)
+        raise ValueError("Received an invalid or malformed JSON response from the AI service.")
+
+    llm_output = ''.join(output_parts).strip()
+    if token is not NULL_TOKEN:
+        token.outline = OUTLINE_DONE
+    current_trace().set(finish_reason=finish_reason)
+    record_llm_usage(usage, payload, lease, outline=True)
+    check_llm_output(llm_output, finish_reason, LLM_MAX_OUTPUT_TOKENS)
+    logging.info(f"LLM Stream Completed Successfully (finish_reason: {finish_reason}).")
+    return llm_output, finish_reason
 
+# *** parse_llm_output FUNCTION ***
+def parse_llm_output(llm_text):
+    """Parses the structured text output from LLM into a list of slide dictionaries."""
+    return finalize_parsed_slides(parse_slides(llm_text), llm_text)
 
 # *** create_presentation FUNCTION ***
 def create_presentation(slides_data, output_path, template_name='professional'):
-    """Creates a PowerPoint presentation from the parsed slide data."""
-    template = TEMPLATES.get(template_name, TEMPLATES['professional']) # Fallback to default template
-    prs = Presentation()
-    # Set slide size to 16:9 aspect ratio (Widescreen)
-    prs.slide_width = Inches(13.333)
-    prs.slide_height = Inches(7.5)
-
-    # --- Title Slide ---
-    if slides_data:
-        try:
-            slide = prs.slides.add_slide(prs.slide_layouts[0]) # Layout 0 is typically Title Slide
-            title = slide.shapes.title # Get the title placeholder shape
-
-            # Find the subtitle placeholder (often index 1, but check)
-            subtitle = next((s for s in slide.placeholders if s.placeholder_format.idx == 1 and s != title), None)
-            if subtitle is None and len(slide.placeholders) > 1:
-                subtitle = slide.placeholders[1] # Fallback: Assume index 1 if specific check fails
-
-            # Set Title Text
-            title_text = slides_data[0].get('title', 'Presentation') # Default title
-            if title and title.has_text_frame:
-                tf = title.text_frame; tf.clear()
-                p = tf.paragraphs[0] if tf.paragraphs else tf.add_paragraph()
-                run = p.add_run(); run.text = title_text
-                run.font.color.rgb = template['title_color']
-                run.font.size = Pt(44); run.font.bold = True
-                tf.vertical_anchor = MSO_ANCHOR.MIDDLE # Center vertically
-                p.alignment = PP_PARAGRAPH_ALIGNMENT.CENTER # Center horizontally
-            elif title: # Fallback if title shape exists but no text frame
-                title.text = title_text
-
-            # Set Subtitle Text (Using Key Message)
-            if subtitle and subtitle.has_text_frame:
-                tf = subtitle.text_frame; tf.clear()
-                subtitle_text = slides_data[0].get('key_message', '').strip()
-                if subtitle_text:
-                    p = tf.paragraphs[0] if tf.paragraphs else tf.add_paragraph()
-                    run = p.add_run(); run.text = subtitle_text
-                    run.font.color.rgb = template['accent_color']
-                    run.font.size = Pt(24)
-                    tf.vertical_anchor = MSO_ANCHOR.TOP # Align subtitle towards top
-                    p.alignment = PP_PARAGRAPH_ALIGNMENT.CENTER
-                else:
-                    tf.text = "" # Ensure empty if no text provided
-            elif subtitle: # Fallback if subtitle shape exists but no text frame
-                 try: subtitle.text = slides_data[0].get('key_message', '').strip()
-                 except AttributeError: logging.warning("Subtitle placeholder on title slide lacks text frame and direct text setting failed.")
-
-            # Add notes for the title slide
-            notes_tf = slide.notes_slide.notes_text_frame; notes_tf.clear()
-            add_formatted_notes(notes_tf, slides_data[0], template)
-
-        except Exception as e:
-            logging.error(f"Critical Error creating Title Slide: {e}", exc_info=True)
-            # Consider adding a generic title slide if the first one fails critically
-            try:
-                 slide = prs.slides.add_slide(prs.slide_layouts[0])
-                 title = slide.shapes.title
-                 if title: title.text = "Presentation (Title Generation Error)"
-            except Exception as fallback_e:
-                 logging.error(f"Failed to add fallback title slide: {fallback_e}")
-
-    # --- Content Slides ---
-    # Use Layout 1 (Title and Content) as default for content slides
-    content_slide_layout = prs.slide_layouts[1]
-
-    for idx, slide_data in enumerate(slides_data[1:]): # Iterate starting from the second item
-        slide_num_for_logging = idx + 2 # User-facing slide number (starts from 2)
-        slide_title_for_error = slide_data.get('title', f'Untitled Slide {slide_num_for_logging}')
-
-        try:
-            slide = prs.slides.add_slide(content_slide_layout)
-            title_shape = slide.shapes.title
-            # Find the main content placeholder (often idx 1, but find largest if not title)
-            content_placeholder = next((s for s in slide.placeholders if s.placeholder_format.idx == 1 and s != title_shape), None)
-            if content_placeholder is None: # Fallback: find largest placeholder that isn't the title
-                 non_title_placeholders = [p for p in slide.placeholders if p != title_shape]
-                 if non_title_placeholders:
-                     content_placeholder = max(non_title_placeholders, key=lambda x: x.width * x.height)
-
-            # Set Slide Title
-            if title_shape and title_shape.has_text_frame:
-                title_text = slide_data.get('title', f'Slide {slide_num_for_logging}')
-                tf = title_shape.text_frame; tf.clear()
-                p = tf.paragraphs[0] if tf.paragraphs else tf.add_paragraph()
-                run = p.add_run(); run.text = title_text
-                run.font.color.rgb = template['title_color']
-                run.font.size = Pt(32); run.font.bold = True
-            elif title_shape:
-                title_shape.text = slide_data.get('title', f'Slide {slide_num_for_logging}')
-
-            # Populate Content Placeholder
-            if content_placeholder and content_placeholder.has_text_frame:
-                tf = content_placeholder.text_frame; tf.clear()
-                tf.word_wrap = True; tf.vertical_anchor = MSO_ANCHOR.TOP
-
-                # Add Key Message (Formatted differently, optional)
-                key_message = slide_data.get('key_message', '').strip()
-                if key_message:
-                    p_key = tf.add_paragraph()
-                    run_key = p_key.add_run(); run_key.text = key_message
-                    run_key.font.bold = True; run_key.font.italic = True
-                    run_key.font.color.rgb = template['accent_color']
-                    run_key.font.size = Pt(20)
-                    p_key.space_after = Pt(10) # Add space after key message
-
-                # Add Bullets
-                bullets = slide_data.get('bullets', [])
-                for bullet_text in bullets:
-                    bullet_text = bullet_text.strip()
-                    if not bullet_text: continue
-                    p_bullet = tf.add_paragraph(); p_bullet.text = bullet_text; p_bullet.level = 0
-                    if p_bullet.runs: # Safely access the first run
-                        run_bullet = p_bullet.runs[0]
-                        run_bullet.font.size = Pt(18); run_bullet.font.color.rgb = template['text_color']
-                    else:
-                        logging.warning(f"Paragraph created without run for bullet: '{bullet_text}' on slide {slide_num_for_logging} ('{slide_title_for_error}')")
-
-                # Add Visual Placeholder if suggested
-                visual_suggestion = slide_data.get('visual', '').strip()
-                # Check against common "no visual" phrases
-                if visual_suggestion and visual_suggestion.lower() not in ["none", "none needed", "text focus", "n/a", "text only", "no visual needed", ""]:
-                    # Define default position/size (e.g., right side) - adjust as needed
-                    placeholder_left = Inches(7.0); placeholder_top = Inches(1.8)
-                    placeholder_width = Inches(5.5); placeholder_height = Inches(4.5)
-                    add_visual_placeholder(slide, visual_suggestion, template, placeholder_left, placeholder_top, placeholder_width, placeholder_height)
-
-            elif content_placeholder:
-                logging.warning(f"Content placeholder found on slide {slide_num_for_logging} ('{slide_title_for_error}') but it lacks a text frame.")
-            else:
-                logging.warning(f"No suitable content placeholder found on slide {slide_num_for_logging} ('{slide_title_for_error}'). Content may be missing.")
-
-            # Add formatted notes to the notes slide page
-            notes_tf = slide.notes_slide.notes_text_frame; notes_tf.clear()
-            add_formatted_notes(notes_tf, slide_data, template)
-
-        except Exception as e:
-             # Log the error with specific slide context
-             logging.error(f"Error processing content slide {slide_num_for_logging} ('{slide_title_for_error}'): {e}", exc_info=True)
-             # Attempt to add an error placeholder slide to the presentation
-             try:
-                 # Use a blank or title-only layout for error slide
-                 error_slide = prs.slides.add_slide(prs.slide_layouts[5]) # Layout 5 is often Title Only or Blank
-                 title_shape = error_slide.shapes.title
-                 if title_shape: title_shape.text = f"Error Generating Slide {slide_num_for_logging}"
-
-                 # Add a textbox explaining the error
-                 left, top, width, height = Inches(1), Inches(1.5), Inches(11), Inches(5)
-                 txBox = error_slide.shapes.add_textbox(left, top, width, height)
-                 tf_err = txBox.text_frame; tf_err.word_wrap = True
-                 tf_err.text = f"Failed to generate content for slide:\n'{slide_title_for_error}'\n\nError Details:\n{str(e)[:500]}{'...' if len(str(e)) > 500 else ''}"
-                 # Basic formatting for error text
-                 if tf_err.paragraphs:
-                     for p in tf_err.paragraphs:
-                         if p.runs: p.runs[0].font.size = Pt(14)
-
-                 logging.info(f"Added error placeholder slide for failed slide {slide_num_for_logging}")
-
-             except Exception as inner_e:
-                 logging.critical(f"CRITICAL FAILURE: Could not add error placeholder slide for slide {slide_num_for_logging}. Inner Exception: {inner_e}")
-             continue # Important: Skip to the next slide data item
+    """Creates a PowerPoint presentation from the parsed slide data.
 
+    `output_path` may be a file path or a writable binary buffer (e.g. BytesIO).
+    """
+    prs = deck_builder.build(slides_data, template_name)
     try:
         prs.save(output_path)
-        logging.info(f"Presentation saved successfully: {output_path}")
+        logging.info(f"Presentation saved successfully: {output_path if isinstance(output_path, str) else 'in-memory buffer'}")
     except Exception as e:
         logging.error(f"Failed to save the final presentation file '{output_path}': {e}", exc_info=True)
         # Raise an IOError to signal failure in saving, handled in the route
         raise IOError(f"Could not save the PowerPoint file: {e}")
 
-
-# *** HELPER FUNCTION for Formatted Notes ***
-def add_formatted_notes(notes_text_frame, slide_data, template):
-    """Adds structured and formatted notes to the notes slide page."""
-    notes_tf = notes_text_frame; notes_tf.clear()
-    default_suggestion_text = "Suggestion not provided by AI."
-    suggestion_color = template.get('notes_suggestion_color', RGBColor(80, 80, 80)) # Default gray if not in template
-    missing_color = RGBColor(128, 128, 128) # Color for "(Suggestion not generated...)" text
-
-    def add_section(title, content_key, is_suggestion=False):
-        content = slide_data.get(content_key, '').strip()
-        if not content and not is_suggestion: return # Skip empty non-suggestion sections
-
-        is_missing_suggestion = is_suggestion and (not content or content == default_suggestion_text)
-        final_content = content if not is_missing_suggestion else "(Suggestion not generated by AI)"
-
-        # Add Section Title
-        p_title = notes_tf.add_paragraph()
-        run_title = p_title.add_run(); run_title.text = title
-        run_title.font.bold = True; run_title.font.size = Pt(11)
-        if is_suggestion: run_title.font.color.rgb = suggestion_color
-        p_title.space_after = Pt(2)
-
-        # Add Content Paragraph
-        p_content = notes_tf.add_paragraph()
-        run_content = p_content.add_run(); run_content.text = final_content
-        run_content.font.size = Pt(10)
-        if is_suggestion:
-            run_content.font.italic = True
-            # Use specific colors for provided vs. missing suggestions
-            run_content.font.color.rgb = missing_color if is_missing_suggestion else suggestion_color
-        p_content.level = 1 # Indent content slightly
-        p_content.space_after = Pt(6) # Space after content before next section/separator
-
-    # Define the order and titles for notes sections
-    notes_sections = [
-        {"title": "Speaker Notes:", "key": "notes", "is_suggestion": False},
-        {"title": "Elaboration / Talking Points:", "key": "elaboration", "is_suggestion": False}, # Treat elaboration as core content
-        {"title": "💡 Enhancement Suggestion:", "key": "enhancement_suggestion", "is_suggestion": True},
-        {"title": "⭐ Best Practice Tip:", "key": "best_practice_tip", "is_suggestion": True},
-    ]
-
-    for section in notes_sections:
-        add_section(section["title"], section["key"], section["is_suggestion"])
-
-    # Optional: Add a final separator if needed, but space_after might be sufficient
-    # p_sep = notes_tf.add_paragraph(); run_sep = p_sep.add_run(); run_sep.text = "---"
-    # run_sep.font.size = Pt(8); run_sep.font.color.rgb = RGBColor(180, 180, 180)
-
-
-# *** add_visual_placeholder FUNCTION ***
-def add_visual_placeholder(slide, visual_desc, template, left, top, width, height):
-    """Adds a styled placeholder shape with the visual suggestion text."""
-    try:
-        shape = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, width, height)
-
-        # Style the placeholder shape
-        shape.fill.solid()
-        shape.fill.fore_color.rgb = RGBColor(240, 240, 240) # Light gray background
-        shape.line.color.rgb = template.get('accent_color', RGBColor(128, 128, 128)) # Border uses accent color
-        shape.line.width = Pt(1.5)
-        shape.shadow.inherit = False # Disable default shadow
-
-        # Configure text frame properties
-        tf = shape.text_frame
-        tf.margin_bottom = Inches(0.1); tf.margin_left = Inches(0.1)
-        tf.margin_right = Inches(0.1); tf.margin_top = Inches(0.1)
-        tf.vertical_anchor = MSO_ANCHOR.MIDDLE # Center text vertically
-        tf.word_wrap = True
-        tf.clear()
-
-        # Add "Suggested Visual:" title
-        p_title = tf.add_paragraph()
-        run_title = p_title.add_run(); run_title.text = "Suggested Visual:"
-        run_title.font.bold = True
-        run_title.font.color.rgb = template.get('accent_color', RGBColor(0, 0, 0)) # Use accent color for title
-        run_title.font.size = Pt(14)
-        p_title.alignment = PP_PARAGRAPH_ALIGNMENT.CENTER
-        p_title.space_after = Pt(6) # Space between title and description
-
-        # Add the actual visual description
-        p_desc = tf.add_paragraph()
-        run_desc = p_desc.add_run()
-        # Truncate long descriptions to fit reasonably
-        run_desc.text = visual_desc[:250] + ('...' if len(visual_desc) > 250 else '') if visual_desc else "N/A"
-        run_desc.font.size = Pt(12)
-        run_desc.font.color.rgb = template.get('text_color', RGBColor(51, 51, 51)) # Use standard text color
-        p_desc.alignment = PP_PARAGRAPH_ALIGNMENT.CENTER
-
-    except Exception as e:
-        logging.error(f"Failed to create styled visual placeholder: {e}", exc_info=True)
-        # Fallback: Add a simple text box if shape fails
-        try:
-            # Slightly inset fallback box
-            fb_left, fb_top = left + Inches(0.1), top + Inches(0.1)
-            fb_width, fb_height = width - Inches(0.2), height - Inches(0.2)
-            txBox = slide.shapes.add_textbox(fb_left, fb_top, fb_width, fb_height)
-            tf_fb = txBox.text_frame; tf_fb.word_wrap = True; tf_fb.vertical_anchor = MSO_ANCHOR.MIDDLE
-
-            p_fb = tf_fb.add_paragraph()
-            # Combine title and description in fallback
-            fb_text = f"Visual Suggestion:\n{visual_desc[:250]}{'...' if len(visual_desc) > 250 else ''}"
-            p_fb.text = fb_text
-            p_fb.font.size = Pt(11)
-            p_fb.font.color.rgb = template.get('text_color', RGBColor(51, 51, 51))
-            p_fb.alignment = PP_PARAGRAPH_ALIGNMENT.CENTER
-            logging.warning("Added fallback text box for visual suggestion due to shape error.")
-        except Exception as fallback_e:
-            logging.critical(f"CRITICAL: Failed even to add fallback text box for visual: {fallback_e}")
-
 # --- Flask Routes ---
 @app.route('/')
 def index():
@@ -707,34 +719,558 @@ def index():
     api_key_configured = bool(AZURE_ENDPOINT and AZURE_API_KEY)
     return render_template('index.html', api_key_configured=api_key_configured)
 
-@app.route('/upload', methods=['POST'])
-def upload_and_process_file():
-    """Handles file upload, processing, and presentation generation."""
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part in the request."}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No file selected for upload."}), 400
-
-    # --- File Validation ---
-    filename = file.filename
-    file_ext = os.path.splitext(filename)[1].lower()
-    if not allowed_file(filename):
-        allowed_str = ", ".join(ALLOWED_EXTENSIONS)
-        logging.warning(f"Upload rejected: Invalid file type '{file_ext}' for file '{filename}'. Allowed: {allowed_str}")
-        return jsonify({"error": f"Invalid file type '{file_ext}'. Allowed types are: {allowed_str}"}), 400
+# *** summarize_document FUNCTION (map step of chunked generation) ***
+CHUNK_SUMMARY_SYSTEM_MESSAGE = "You are an expert analyst condensing long documents into dense, faithful, well-structured notes for a presentation designer."
+
+def resolve_generation_mode(generation_mode, document_text, document_tokens=None):
+    """Turns 'auto' into 'single' or 'chunked' depending on whether the text fits the prompt's `document_tokens`
+    (default: the outline prompt's)."""
+    if generation_mode == 'auto':
+        if document_tokens is None:
+            document_tokens = outline_document_tokens()
+        return 'chunked' if prompt_budget.exceeds(document_text, document_tokens) else 'single'
+    return generation_mode
+
+def bind_job_context(fn):
+    """Wraps `fn` so that it runs with this thread's cancel token and trace active, e.g. in a thread pool's threads.
+
+    Both live in thread-locals, so without this the LLM calls made by pool workers would neither
+    see a cancellation nor record their admission wait and token usage in the job's trace.
+    """
+    trace = current_trace()
+    bound = current_cancel_token().bind(fn)
+    def traced(*args, **kwargs):
+        with trace.activate():
+            return bound(*args, **kwargs)
+    return traced
+
+def summarize_document(document_text, target_audience="", desired_tone=""):
+    """Splits the document, summarizes chunks in parallel and returns (merged summaries, chunking stats)."""
+    chunk_chars = app.config['CHUNK_SIZE_CHARS']
+    fan_out = app.config['CHUNK_MAX_WORKERS']
+    chunks = split_document(document_text, chunk_chars)
+    logging.info(f"Chunked generation: {len(document_text)} chars split into {len(chunks)} chunks of <= {chunk_chars} chars (fan-out {fan_out}).")
+
+    def summarize(chunk, index, total):
+        prompt = build_chunk_summary_prompt(chunk, index, total, target_audience, desired_tone)
+        return call_llm(prompt, system_message=CHUNK_SUMMARY_SYSTEM_MESSAGE, max_tokens=app.config['CHUNK_SUMMARY_MAX_TOKENS'])[0]
+
+    started = time.monotonic()
+    summaries, chunk_stats = summarize_chunks(chunks, bind_job_context(summarize), fan_out)
+    merged = merge_summaries(summaries)
+    stats = {
+        "chunk_size_chars": chunk_chars,
+        "fan_out": fan_out,
+        "chunk_count": len(chunks),
+        "summary_chars": len(merged),
+        "seconds": round(time.monotonic() - started, 3),
+        "chunks": chunk_stats,
+    }
+    logging.info(f"Chunk summaries merged: {len(document_text)} -> {len(merged)} chars in {stats['seconds']}s.")
+    return merged, stats
+
+# *** repair_llm_output FUNCTION (repair stage) ***
+SLIDE_REPAIR_SYSTEM_MESSAGE = "You are an expert presentation designer completing individual slides of a PowerPoint outline, following its strict block format exactly."
+
+def repair_llm_output(llm_response, finish_reason, prompt, source_text, template_name='professional', audience="", tone=""):
+    """Regenerates damaged slide blocks (and continues a truncated outline) concurrently. Returns (repaired output, stats).
+
+    `prompt` is the outline prompt built from `source_text`; the continuation reuses it when it
+    leaves room for the output, and otherwise rebuilds it with less of the document.
+    """
+    context_str = build_prompt_context(template_name, audience, tone)
+
+    def regenerate_block(block, position, total, previous_title, next_title, missing):
+        repair_prompt = SLIDE_REPAIR_PROMPT.render(
+            context=context_str, position=str(position), total=str(total), previous_title=previous_title,
+            next_title=next_title, missing=', '.join(missing) or 'the last field was cut off', block=block)
+        return call_llm(repair_prompt, system_message=SLIDE_REPAIR_SYSTEM_MESSAGE, max_tokens=app.config['SLIDE_REPAIR_MAX_TOKENS'])[0]
+
+    def continue_outline(complete_text, cut_title):
+        cut_note = f" while writing the slide '{cut_title}'; write that slide again in full, then the slides after it" if cut_title else ""
+        extra_messages = [{"role": "assistant", "content": complete_text}] if complete_text else []
+        extra_messages.append({"role": "user", "content": OUTLINE_CONTINUATION_PROMPT.render(cut_note=cut_note)})
+        continuation_prompt, max_tokens = fit_continuation(prompt, source_text, context_str, extra_messages)
+        # Same system message and (if it fits) prompt as the original call, so the provider can serve the prefix from its cache
+        return call_llm(continuation_prompt, system_message=OUTLINE_SYSTEM_MESSAGE, max_tokens=max_tokens,
+                        extra_messages=extra_messages)[0]
+
+    return repair_outline(llm_response, finish_reason == 'length', bind_job_context(regenerate_block), bind_job_context(continue_outline),
+                          max_workers=app.config['SLIDE_REPAIR_WORKERS'])
+
+def fit_continuation(prompt, source_text, context_str, extra_messages):
+    """Sizes an outline continuation to the context window. Returns (prompt, max_tokens).
+
+    The original prompt plus the outline written so far can leave little or no room for more
+    output. Output is allowed down to half of LLM_MAX_OUTPUT_TOKENS; below that the document
+    in the prompt is trimmed to make room. Raises ValueError if even an empty document leaves
+    too little.
+    """
+    fixed_tokens = prompt_budget.count(OUTLINE_SYSTEM_MESSAGE) + sum(prompt_budget.count(m["content"]) for m in extra_messages)
+    available = prompt_budget.context_tokens - prompt_budget.safety_tokens - fixed_tokens
+    min_output_tokens = LLM_MAX_OUTPUT_TOKENS // 2
+    room = available - prompt_budget.count(prompt)
+    if room < min_output_tokens:
+        document_tokens = outline_document_tokens(context_str) - (min_output_tokens - room)
+        if document_tokens < 0:
+            raise ValueError(f"The outline written so far leaves no room to continue it within the model's "
+                             f"{prompt_budget.context_tokens}-token context window.")
+        prompt, used_tokens, _ = fit_outline_prompt(source_text, context_str, OUTLINE_PROMPT, document_tokens)
+        room = available - prompt_budget.count(prompt)
+        logging.warning(f"Outline continuation: document trimmed to {used_tokens} tokens to leave {room} tokens for output.")
+    return prompt, max(1, min(LLM_MAX_OUTPUT_TOKENS, room))
+
+# *** generate_slide_notes FUNCTION (second phase of two-phase generation) ***
+SKELETON_SYSTEM_MESSAGE = "You are an expert presentation designer creating the slide content of PowerPoint outlines following strict formatting rules; speaker notes are written separately."
+SLIDE_NOTES_SYSTEM_MESSAGE = "You are an expert presentation coach writing speaker notes, elaborations and suggestions for individual slides, following a strict field format exactly."
+
+def generate_slide_notes(skeleton, source_text, template_name='professional', audience="", tone=""):
+    """Writes the notes fields of every skeleton slide concurrently. Returns (complete outline, stats).
+
+    Every notes prompt shares the instructions, document excerpt and outline, and differs only in
+    the slide at its end, so the calls after the first can be served largely from the prefix cache.
+    """
+    context_str = build_prompt_context(template_name, audience, tone)
+    document_text, _, _ = prompt_budget.fit(source_text.replace('\f', '\n'), app.config['TWO_PHASE_NOTES_DOCUMENT_TOKENS'])
+    blocks = split_slide_blocks(skeleton)
+    outline_titles = '\n'.join(f"{i}. {slide_block_title(block)}" for i, block in enumerate(blocks, start=1) if slide_block_title(block))
+
+    def generate_notes(block, position, total):
+        notes_prompt = SLIDE_NOTES_PROMPT.render(context=context_str, document=document_text, outline=outline_titles,
+                                                 position=str(position), total=str(total), block=block.strip())
+        return call_llm(notes_prompt, system_message=SLIDE_NOTES_SYSTEM_MESSAGE,
+                        max_tokens=app.config['TWO_PHASE_NOTES_MAX_TOKENS'])[0]
+
+    return fill_notes(blocks, bind_job_context(generate_notes), app.config['TWO_PHASE_NOTES_WORKERS'])
+
+# --- Background Pipeline ---
+def process_document(sources, output, template_name, target_audience, desired_tone,
+                     generation_mode='single', normalize=False, two_phase=False, progress=None, trace=NULL_TRACE):
+    """Runs extraction, LLM generation, parsing and deck building for one deck.
+
+    `sources` is a list of (source, file_ext, filename, digest), where source is the upload's path
+    or a binary file object and digest its SHA-256 if already known (else None). Several sources are merged into one outline (see extract_and_merge).
+    The deck is written to `output` (a path or a writable buffer).
+    `generation_mode` is 'single', 'chunked' or 'auto' (see GENERATION_MODES).
+    `normalize` strips page furniture, boilerplate and extra whitespace from the extracted text.
+    `two_phase` generates a skeleton outline first and then each slide's notes in parallel (see two_phase.py).
+    `progress(**fields)` is called as the pipeline moves between stages and as slides are parsed.
+    `trace` (a metrics.RequestTrace) receives stage timings and request attributes.
+    Returns the result cache outcome ('pptx', 'llm', 'miss', or None when caching is disabled).
+    """
+    progress = progress or (lambda **fields: None)
+
+    # 1. Extract Text. A single-shot prompt only holds the document token budget, so extraction stops at
+    #    twice its estimated size; build_llm_prompt makes the exact cut on a paragraph boundary
+    progress(stage='extracting')
+    outline_template, system_message = (OUTLINE_SKELETON_PROMPT, SKELETON_SYSTEM_MESSAGE) if two_phase else (OUTLINE_PROMPT, None)
+    document_tokens = outline_document_tokens("", outline_template, system_message)
+    document_chars = prompt_budget.chars_for(document_tokens)
+    char_budget = 2 * document_chars if generation_mode == 'single' else app.config['EXTRACTION_MAX_CHARS']
+    if len(sources) == 1:
+        source, file_ext, filename, digest = sources[0]
+        logging.info(f"Extracting text from '{filename}'...")
+        with trace.stage('extract'):
+            extracted_text, extraction_stats = extract_document(source, file_ext, filename, char_budget, digest)
+        if extraction_stats is not None:
+            progress(extraction=extraction_stats)
+        trace.set(extracted_chars=len(extracted_text or ''))
+        if normalize and extracted_text:
+            with trace.stage('normalize'):
+                extracted_text, normalization_stats = normalize_text(extracted_text, prompt_budget.count)
+            log_normalization(filename, normalization_stats)
+            progress(normalization=normalization_stats)
+            trace.set(normalized_chars=len(extracted_text))
+    else:
+        # Merged documents share the document budget, proportionally to their unique text
+        filename = f"{len(sources)} merged documents"
+        merge_budget = document_chars if generation_mode == 'single' else char_budget
+        logging.info(f"Extracting and merging text from {filename}...")
+        with trace.stage('extract'):
+            extracted_text, merge_stats = extract_and_merge(sources, merge_budget, normalize)
+        progress(merge=merge_stats)
+        if normalize:
+            progress(normalization=merge_stats['normalization'])
+        trace.set(source_count=len(sources), extracted_chars=merge_stats['input_chars'], normalized_chars=len(extracted_text))
+
+    if not extracted_text or len(extracted_text.strip()) < 50: # Slightly higher threshold for content check
+        logging.warning(f"Extracted text from '{filename}' seems very short ({len(extracted_text)} chars). May indicate an empty document or extraction issue.")
+        raise ValueError("Document appears to be empty or text could not be extracted properly. Please check the document content.")
+    logging.info(f"Text extracted successfully from '{filename}' ({len(extracted_text)} characters).")
+    generation_mode = resolve_generation_mode(generation_mode, extracted_text, document_tokens)
+    progress(generation_mode=generation_mode)
+    trace.set(generation_mode=generation_mode)
+    # Chunked output depends on the chunk size and all output on the token budgets, so they are part of the cache identity
+    mode_key = f"chunked:{app.config['CHUNK_SIZE_CHARS']}" if generation_mode == 'chunked' else 'single'
+    mode_key += f":{prompt_budget.input_tokens}:{prompt_budget.output_tokens}"
+    if two_phase:
+        mode_key += ':two-phase'
+    trace.set(two_phase=two_phase)
+
+    # 2. Check the Result Cache
+    llm_response = None
+    cache_key = None
+    cache_status = None # 'pptx' / 'llm' on a hit, 'miss' otherwise; None when caching is disabled
+    if result_cache is not None:
+        with trace.stage('cache_lookup'):
+            cache_key = make_cache_key(prompt_versions(two_phase), AZURE_ENDPOINT or '', template_name, target_audience, desired_tone, mode_key, extracted_text)
+            cached_pptx = result_cache.get(cache_key, 'pptx')
+            cached_output = result_cache.get(cache_key, 'llm.txt') if cached_pptx is None else None
+        if cached_pptx is not None:
+            logging.info(f"Result cache hit for '{filename}': reusing stored presentation.")
+            write_output(output, cached_pptx)
+            trace.set(cache='pptx')
+            return 'pptx'
+        if cached_output is not None:
+            logging.info(f"Result cache hit for '{filename}': reusing stored LLM output.")
+            llm_response = cached_output.decode('utf-8')
+            cache_status = 'llm'
+        else:
+            cache_status = 'miss'
+    trace.set(cache=cache_status)
+
+    slides_data = None
+    if llm_response is None:
+        # 3. Build LLM Prompt (from chunk summaries in chunked mode)
+        source_text = extracted_text
+        if generation_mode == 'chunked':
+            progress(stage='summarizing')
+            with trace.stage('summarize'):
+                source_text, chunking_stats = summarize_document(extracted_text, target_audience, desired_tone)
+            progress(chunking=chunking_stats)
+        with trace.stage('prompt'):
+            prompt = build_llm_prompt(source_text, template_name, target_audience, desired_tone, outline_template, system_message)
+        trace.set(prompt_chars=len(prompt))
+
+        # 4. Call LLM Service (streaming parses slides as their terminators arrive; in two-phase mode the
+        #    streamed titles are the skeleton's, shown while the notes are still to be written)
+        progress(stage='generating')
+        if app.config['LLM_STREAMING']:
+            parser = SlideStreamParser()
+            parse_seconds = 0.0
+            def on_delta(text):
+                nonlocal parse_seconds
+                started = time.perf_counter()
+                completed = parser.feed(text)
+                parse_seconds += time.perf_counter() - started
+                if completed:
+                    progress(slide_titles=[slide['title'] for slide in parser.slides])
+            with trace.stage('llm'):
+                llm_response, finish_reason = call_llm_stream(prompt, on_delta=on_delta, system_message=system_message)
+            trace.record('parse_streamed', parse_seconds) # Parsing interleaved with (and included in) the 'llm' stage
+        else:
+            with trace.stage('llm'):
+                llm_response, finish_reason = call_llm(prompt, system_message=system_message, outline=True)
+
+        # 4a. Two-phase: write every slide's notes fields concurrently and append them to the skeleton
+        if two_phase:
+            skeleton_slides = parse_slides(llm_response)
+            progress(stage='detailing', slide_titles=[slide['title'] for slide in skeleton_slides])
+            with trace.stage('notes'):
+                llm_response, two_phase_stats = generate_slide_notes(llm_response, source_text, template_name, target_audience, desired_tone)
+            two_phase_stats["skeleton_finish_reason"] = finish_reason
+            progress(notes=two_phase_stats)
+            trace.set(notes_filled=two_phase_stats['filled'], notes_failed=two_phase_stats['failed'])
+            # A cut-off skeleton is not continued: the outline prompt's continuation would restart with notes
+            finish_reason = 'stop'
+
+        # 4b. Regenerate slide blocks that were dropped or cut off, rather than the whole outline
+        if app.config['SLIDE_REPAIR'] and needs_repair(llm_response, finish_reason == 'length'):
+            progress(stage='repairing')
+            with trace.stage('repair'):
+                llm_response, repair_stats = repair_llm_output(llm_response, finish_reason, prompt, source_text, template_name, target_audience, desired_tone)
+            progress(repair=repair_stats)
+            trace.set(repaired_slides=repair_stats['repaired'], continued_slides=repair_stats['continued_slides'])
+            if 'continuation_error' in repair_stats:
+                trace.set(continuation_error=repair_stats['continuation_error'])
+        elif app.config['LLM_STREAMING'] and not two_phase:
+            with trace.stage('parse'):
+                slides_data = parser.close()
+
+    # 5. Parse LLM Output
+    if slides_data is None:
+        logging.info("Parsing LLM response...")
+        with trace.stage('parse'):
+            slides_data = parse_llm_output(llm_response)
+    trace.set(slide_count=len(slides_data))
+    progress(stage='building', slide_titles=[slide['title'] for slide in slides_data])
+
+    # 6. Create PowerPoint Presentation
+    logging.info(f"Creating presentation for '{filename}' using template '{template_name}'...")
+    with trace.stage('build'):
+        create_presentation(slides_data, output, template_name) # This function raises IOError on save failure
+
+    if cache_key is not None:
+        # Only outputs that parsed and rendered successfully are worth caching
+        with trace.stage('cache_store'):
+            if cache_status == 'miss':
+                result_cache.put(cache_key, 'llm.txt', llm_response.encode('utf-8'))
+            result_cache.put(cache_key, 'pptx', read_output(output))
+    return cache_status
+
+def write_output(output, data):
+    """Writes deck bytes to a path or buffer."""
+    if isinstance(output, str):
+        with open(output, 'wb') as f:
+            f.write(data)
+    else:
+        output.write(data)
+
+def read_output(output):
+    """Reads the deck bytes back from a path or BytesIO."""
+    if isinstance(output, str):
+        with open(output, 'rb') as f:
+            return f.read()
+    return output.getvalue()
+
+def run_presentation_job(job):
+    """Job handler: generates the deck for a queued upload and releases the upload afterwards.
+
+    In-memory jobs keep the finished deck as bytes on the job unless it exceeds
+    IN_MEMORY_SPILL_BYTES, in which case it is written to the job's pptx_path.
+    """
+    uploads = job_uploads(job)
+    in_memory = uploads[0]['upload_buffer'] is not None
+    sources = [(upload['upload_buffer'] if in_memory else upload['upload_path'], upload['file_ext'], upload['filename'],
+                upload.get('sha256')) for upload in uploads]
+    output = BytesIO() if in_memory else job['pptx_path']
+    trace = new_request_trace(job)
+    token = CancelToken(lambda: job_cancel_trigger(job['id']))
+
+    def progress(**fields):
+        token.check() # Stage changes are where a cancelled job stops
+        if 'stage' in fields:
+            token.stage = fields['stage']
+        get_job_manager().update(job['id'], **fields)
+
+    try:
+        with trace.activate(), token.activate():
+            cache_status = process_document(sources, output,
+                                            job['template_name'], job['audience'], job['tone'],
+                                            generation_mode=job.get('generation_mode', 'single'),
+                                            normalize=job.get('normalize', app.config['TEXT_NORMALIZATION']),
+                                            two_phase=job.get('two_phase', app.config['TWO_PHASE_GENERATION']),
+                                            progress=progress,
+                                            trace=trace)
+    except JobCancelled as e:
+        saved_seconds, saved_tokens = job_costs.savings(token, prompt_budget.chars_per_token)
+        e.details.update(stage=token.stage, saved_seconds=saved_seconds, saved_tokens=saved_tokens)
+        trace.set(cancelled=e.trigger)
+        trace_payload = trace.finish('cancelled')
+        if pipeline_metrics is not None:
+            pipeline_metrics.record_cancellation(e.details)
+        if app.config['REQUEST_TRACE']:
+            get_job_manager().update(job['id'], trace=trace_payload)
+        raise
+    except Exception:
+        trace_payload = trace.finish('failed')
+        if app.config['REQUEST_TRACE']:
+            get_job_manager().update(job['id'], trace=trace_payload)
+        raise
+    finally:
+        for upload in uploads:
+            release_upload(upload['upload_path'], upload['upload_buffer'])
+        if job.get('batch_id'):
+            get_job_manager().update(job['batch_id']) # Keeps the batch record alive as long as its newest result
+    result = {'cache': cache_status, 'upload_buffer': None}
+    if job.get('sources'):
+        result['sources'] = [dict(upload, upload_buffer=None) for upload in uploads]
+    trace_payload = trace.finish('done')
+    job_costs.observe_job(time.monotonic() - token.started)
+    if admission is not None:
+        admission.observe(trace.stages)
+    if app.config['REQUEST_TRACE']:
+        result['trace'] = trace_payload
+    if in_memory:
+        deck_bytes = output.getvalue()
+        if len(deck_bytes) <= app.config['IN_MEMORY_SPILL_BYTES']:
+            result['result_bytes'] = deck_bytes
+        else:
+            write_output(job['pptx_path'], deck_bytes)
+    return result
+
+def job_cancel_trigger(job_id):
+    """Why a running job should stop ('request' or 'disconnect'), or None; polled by its CancelToken."""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return None
+    if job.get('cancel_requested'):
+        return job['cancel_requested']
+    detached_at = job.get('detached_at')
+    if app.config['CANCEL_ON_DISCONNECT'] and detached_at is not None and \
+            time.time() - detached_at >= app.config['CANCEL_DISCONNECT_GRACE_SECONDS']:
+        return 'disconnect'
+    return None
+
+def new_request_trace(job):
+    """Starts the metrics/trace record for a job, or returns NULL_TRACE when nothing uses its timings."""
+    if pipeline_metrics is None and not app.config['REQUEST_TRACE'] and admission is None:
+        return NULL_TRACE
+    trace = RequestTrace(job['id'], pipeline_metrics, app.config['REQUEST_TRACE_PATH'] if app.config['REQUEST_TRACE'] else None)
+    trace.record('queue', max(0.0, time.time() - job['created_at']))
+    file_size = 0
+    for upload in job_uploads(job):
+        upload_buffer = upload['upload_buffer']
+        if upload_buffer is not None:
+            file_size += upload_buffer.seek(0, os.SEEK_END)
+            upload_buffer.seek(0)
+        elif upload['upload_path'] and os.path.exists(upload['upload_path']):
+            file_size += os.path.getsize(upload['upload_path'])
+        else:
+            file_size = None
+            break
+    trace.set(filename=job.get('filename'), file_size=file_size, template=job.get('template_name'))
+    return trace
+
+def job_uploads(job):
+    """The uploads a job reads: its `sources` for merge jobs, otherwise the single upload on the job itself."""
+    if job.get('sources'):
+        return job['sources']
+    return [{'filename': job['filename'], 'file_ext': job['file_ext'], 'sha256': job.get('upload_sha256'),
+             'upload_path': job.get('upload_path'), 'upload_buffer': job.get('upload_buffer')}]
+
+def describe_job_error(e):
+    """Maps pipeline exceptions to the same user-facing messages the synchronous route used to return."""
+    if isinstance(e, ValueError):
+        # User-facing errors (validation, empty doc, config issues, parsing, LLM errors)
+        return str(e)
+    if isinstance(e, IOError):
+        logging.error(f"File saving error during presentation creation: {e}", exc_info=True)
+        return f"Failed to save the presentation file on the server: {e}"
+    logging.error("An unexpected critical error occurred during file processing.", exc_info=e)
+    return "An internal server error occurred. Please try again later or contact support."
 
-    # --- Get Form Data ---
-    template_name = request.form.get('template', app.config['DEFAULT_TEMPLATE'])
+def remove_file_quietly(f_path):
+    """Deletes a temporary file, logging instead of raising on failure."""
+    try:
+        if f_path and os.path.exists(f_path):
+            os.remove(f_path)
+            logging.info(f"Cleaned up temporary file: {f_path}")
+    except OSError as e:
+        logging.error(f"Error removing temporary file {f_path}: {e}", exc_info=True)
+
+def cleanup_expired_job(job):
+    """Removes any files or buffers left behind by a job that has aged out of the store."""
+    for upload in job.get('sources') or [job]:
+        release_upload(upload.get('upload_path'), upload.get('upload_buffer'))
+    remove_file_quietly(job.get('pptx_path'))
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+def get_job_manager():
+    """Returns this process's job manager, creating it (and its worker threads) on first use."""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            store = create_job_store(app.config['JOB_BACKEND'], app.config['JOB_DB_PATH'])
+            _job_manager = JobManager(
+                store, run_presentation_job,
+                max_workers=app.config['JOB_WORKERS'],
+                result_ttl=app.config['JOB_RESULT_TTL'],
+                error_formatter=describe_job_error,
+                on_expire=cleanup_expired_job,
+                lease_seconds=app.config['JOB_LEASE_SECONDS'],
+                max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+            )
+            _job_manager.start()
+        return _job_manager
+
+def stop_job_manager(timeout=None):
+    """Stops this process's job worker threads for good, letting running jobs finish for up to `timeout` seconds.
+
+    Jobs submitted afterwards are still stored; with the 'sqlite' backend another process runs them.
+    """
+    with _job_manager_lock:
+        manager = _job_manager
+    if manager is not None:
+        manager.stop(timeout)
+
+def warm_up():
+    """Does the one-off work of the first request ahead of time: the deck builder's base template and the tokenizer.
+
+    Under gunicorn with preload_app this runs once in the master, so the forked workers share
+    the result (copy-on-write) instead of each building it on its first job.
+    """
+    started = time.perf_counter()
+    deck_builder.new_presentation()
+    prompt_budget.count(OUTLINE_PROMPT.render(context="", document=""))
+    logging.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s.")
+
+def job_status_payload(job):
+    """Public view of a job for the status endpoint."""
+    payload = {
+        "job_id": job['id'],
+        "status": job['status'],
+        "filename": job.get('filename'),
+        "created_at": job.get('created_at'),
+        "updated_at": job.get('updated_at'),
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+        "stage": job.get('stage'),
+        "slide_titles": job.get('slide_titles', []),
+        "generation_mode": job.get('generation_mode'),
+    }
+    if job.get('extraction'):
+        payload["extraction"] = job['extraction']
+    if job.get('chunking'):
+        payload["chunking"] = job['chunking']
+    if job.get('merge'):
+        payload["merge"] = job['merge']
+    if job.get('normalization'):
+        payload["normalization"] = job['normalization']
+    if job.get('repair'):
+        payload["repair"] = job['repair']
+    if job.get('notes'):
+        payload["notes"] = job['notes']
+    if job.get('trace'):
+        payload["trace"] = job['trace']
+    if job['status'] == JOB_DONE:
+        payload["download_url"] = f"/jobs/{job['id']}/download"
+        payload["download_name"] = job.get('download_name')
+        payload["cache"] = job.get('cache')
+    if job['status'] in (JOB_FAILED, JOB_CANCELLED):
+        payload["error"] = job.get('error')
+    if job.get('cancellation'):
+        payload["cancellation"] = job['cancellation']
+    elif job.get('cancel_requested') and job['status'] == JOB_RUNNING:
+        payload["cancellation"] = {"trigger": job['cancel_requested'], "pending": True}
+    return payload
+
+def read_generation_options(form):
+    """Reads the theme, audience, tone, generation mode and the normalization and two-phase toggles shared by the upload routes.
+
+    An unknown theme falls back to the default; an unknown generation mode raises ValueError.
+    """
+    template_name = form.get('template', app.config['DEFAULT_TEMPLATE'])
     if template_name not in TEMPLATES:
         logging.warning(f"Invalid template name '{template_name}' received. Falling back to default '{app.config['DEFAULT_TEMPLATE']}'.")
         template_name = app.config['DEFAULT_TEMPLATE']
-    target_audience = request.form.get('audience', '').strip()
-    desired_tone = request.form.get('tone', '').strip()
+    generation_mode = form.get('generation_mode', '').strip().lower() or app.config['DEFAULT_GENERATION_MODE']
+    if generation_mode not in GENERATION_MODES:
+        raise ValueError(f"Invalid generation mode '{generation_mode}'. Allowed modes are: {', '.join(sorted(GENERATION_MODES))}")
+    normalize = form.get('normalize', '').strip().lower()
+    two_phase = form.get('two_phase', '').strip().lower()
+    return {
+        'template_name': template_name,
+        'audience': form.get('audience', '').strip(),
+        'tone': form.get('tone', '').strip(),
+        'generation_mode': generation_mode,
+        'normalize': normalize in ['true', '1', 't', 'on'] if normalize else app.config['TEXT_NORMALIZATION'],
+        'two_phase': two_phase in ['true', '1', 't', 'on'] if two_phase else app.config['TWO_PHASE_GENERATION'],
+    }
 
-    logging.info(f"Processing request for '{filename}' - Template: '{template_name}', Audience: '{target_audience or 'Default'}', Tone: '{desired_tone or 'Default'}'")
+def validate_upload_filename(filename):
+    """Returns the lower-case extension of an acceptable upload, raising ValueError otherwise."""
+    file_ext = os.path.splitext(filename)[1].lower()
+    if not allowed_file(filename):
+        allowed_str = ", ".join(ALLOWED_EXTENSIONS)
+        logging.warning(f"Upload rejected: Invalid file type '{file_ext}' for file '{filename}'. Allowed: {allowed_str}")
+        raise ValueError(f"Invalid file type '{file_ext}'. Allowed types are: {allowed_str}")
+    return file_ext
 
-    # --- Prepare Filenames and Paths ---
+def output_paths(filename):
+    """Returns (pptx_path, download_name) for the deck generated from `filename`."""
     unique_id = uuid.uuid4().hex[:8]
     # Sanitize original filename for use in output (more robust)
     safe_base_name = re.sub(r'[^\w\-.]+', '_', os.path.splitext(filename)[0]) # Allow letters, numbers, underscore, hyphen, dot
@@ -742,148 +1278,654 @@ def upload_and_process_file():
     safe_base_name = safe_base_name or "document" # Default if sanitization removes everything
     safe_base_name = safe_base_name[:60] # Limit length
 
-    upload_filename = f"{unique_id}_{secure_filename(filename)}" # Secure version for storage
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], upload_filename)
     pptx_filename = f"{unique_id}_{safe_base_name}_presentation.pptx" # Internal name
     pptx_path = os.path.join(app.config['GENERATED_FOLDER'], pptx_filename)
     # User-friendly download name (without unique ID)
-    output_download_name = f"{safe_base_name}_presentation.pptx"
+    return pptx_path, f"{safe_base_name}_presentation.pptx"
 
-    files_to_cleanup = [] # Keep track of files to delete after request
+def uploads_in_memory():
+    """In-memory jobs hand the upload buffer straight to the worker; other backends need a shared file."""
+    return app.config['PIPELINE_IN_MEMORY'] and app.config['JOB_BACKEND'] == 'memory'
 
-    @after_this_request
-    def cleanup(response):
-        """Cleans up temporary files after the request is finished."""
-        # Add the generated PPTX path for cleanup *if* it exists
-        # This prevents errors if generation failed before saving
-        if os.path.exists(pptx_path):
-            files_to_cleanup.append(pptx_path)
+def new_upload_path(filename):
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex[:8]}_{secure_filename(filename)}")
 
-        for f_path in files_to_cleanup:
-            try:
-                if os.path.exists(f_path): # Double-check existence before removing
-                    os.remove(f_path)
-                    logging.info(f"Cleaned up temporary file: {f_path}")
-            except OSError as e:
-                logging.error(f"Error removing temporary file {f_path}: {e}", exc_info=True)
-            except Exception as e:
-                 logging.error(f"Unexpected error during cleanup of {f_path}: {e}", exc_info=True)
-        return response
+def store_upload(filename, save):
+    """Stores an upload for a worker and returns (upload_path, upload_buffer); one of them is None.
 
+    `save(target)` writes the upload to a path or a binary buffer (e.g. FileStorage.save).
+    """
+    if uploads_in_memory():
+        upload_buffer = tempfile.SpooledTemporaryFile(max_size=app.config['IN_MEMORY_SPILL_BYTES'])
+        try:
+            save(upload_buffer)
+        except Exception:
+            upload_buffer.close()
+            raise
+        upload_buffer.seek(0)
+        return None, upload_buffer
+    # Save the upload so a worker (possibly in another process) can pick it up
+    upload_path = new_upload_path(filename)
     try:
-        # 1. Save Uploaded File
-        file.save(upload_path)
-        files_to_cleanup.append(upload_path) # Ensure upload is always added for cleanup
-        logging.info(f"Uploaded file saved temporarily to: {upload_path}")
+        save(upload_path)
+    except Exception:
+        remove_file_quietly(upload_path)
+        raise
+    logging.info(f"Uploaded file saved temporarily to: {upload_path}")
+    return upload_path, None
+
+def release_upload(upload_path, upload_buffer):
+    """Frees a stored upload once its job no longer needs it."""
+    if upload_buffer is not None:
+        upload_buffer.close() # Also removes the temp file if the upload spilled to disk
+    remove_file_quietly(upload_path)
+
+def request_client_id():
+    """Identifies who submitted a request, for per-client queue limits and fair scheduling.
+
+    Uses ADMISSION_CLIENT_HEADER when set and present (its first comma-separated value, as in
+    X-Forwarded-For), otherwise the remote address.
+    """
+    header = app.config['ADMISSION_CLIENT_HEADER']
+    value = request.headers.get(header, '') if header else ''
+    return value.split(',')[0].strip() or request.remote_addr or 'unknown'
+
+def admission_message(e):
+    """User-facing text for an AdmissionRejected."""
+    return f"The server is busy: {e.reason}. Please try again in about {e.retry_after} seconds."
+
+def admission_rejected_response(client, e):
+    """The 429 response, with Retry-After, for a shed submission."""
+    logging.warning(f"Submission from {client} shed: {e}")
+    response = jsonify({"error": admission_message(e), "retry_after": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+def admission_response(client):
+    """Returns a 429 response if the admission controller would shed a submission now, else None.
+
+    Runs before the request body is read, so a shed upload costs no parsing or storage. The
+    binding check is the one each job gets as it is queued (see job_admission).
+    """
+    if admission is None:
+        return None
+    manager = get_job_manager()
+    try:
+        admission.check(manager.count(JOB_QUEUED), manager.count(JOB_QUEUED, client), final=False)
+    except AdmissionRejected as e:
+        return admission_rejected_response(client, e)
+    return None
+
+def job_admission():
+    """The `admit` check JobManager.submit runs atomically with each insert, or None when admission control is off."""
+    return admission.check if admission is not None else None
+
+def receive_upload():
+    """Streams the current request's single-document upload into storage (see uploads.py).
+
+    Returns (form, upload): the request's text fields, and a dict with the file's filename,
+    file_ext, size, sha256 and its upload_path/upload_buffer (one of them None). Raises
+    ValueError for uploads to reject, after releasing anything already stored.
+    """
+    mimetype, content_options = parse_options_header(request.content_type or '')
+    if mimetype != 'multipart/form-data' or not content_options.get('boundary'):
+        raise ValueError("No file part in the request.")
+    stored = {'upload_path': None, 'upload_buffer': None, 'file': None}
+
+    def open_storage(filename):
+        if uploads_in_memory():
+            stored['upload_buffer'] = stored['file'] = tempfile.SpooledTemporaryFile(max_size=app.config['IN_MEMORY_SPILL_BYTES'])
+        else:
+            stored['upload_path'] = new_upload_path(filename)
+            stored['file'] = open(stored['upload_path'], 'wb')
+        return stored['file']
 
-        # 2. Extract Text
-        logging.info(f"Extracting text from '{filename}'...")
-        if file_ext == '.docx':
-            extracted_text = extract_text_from_docx(upload_path)
-        elif file_ext == '.pdf':
-            extracted_text = extract_text_from_pdf(upload_path)
+    try:
+        form, upload = read_upload(request.stream, content_options['boundary'].encode('latin-1'), validate_upload_filename,
+                                   open_storage, chunk_size=app.config['UPLOAD_CHUNK_BYTES'],
+                                   max_field_bytes=request.max_form_memory_size)
+        if stored['upload_path']:
+            stored['file'].close()
         else:
-             # Should be caught by initial validation, but acts as a safeguard
-             raise ValueError(f"Unsupported file type '{file_ext}' encountered during processing.")
+            stored['upload_buffer'].seek(0)
+    except BaseException:
+        if stored['upload_path'] and stored['file']:
+            stored['file'].close()
+        release_upload(stored['upload_path'], stored['upload_buffer'])
+        raise
+    logging.info(f"Received '{upload['filename']}' ({upload['size']} bytes, sha256 {upload['sha256'][:12]}) in {upload['seconds']}s"
+                 f"{' to ' + stored['upload_path'] if stored['upload_path'] else ''}.")
+    upload.update(upload_path=stored['upload_path'], upload_buffer=stored['upload_buffer'])
+    return form, upload
+
+def submit_document(filename, file_ext, upload_path, upload_buffer, options, **extra_fields):
+    """Queues the presentation job for one stored upload. Returns the job id.
+
+    `options` comes from read_generation_options(); `extra_fields` are recorded on the job.
+    Raises AdmissionRejected when the queue is full. The upload is released again if queueing fails.
+    """
+    logging.info(f"Queueing request for '{filename}' - Template: '{options['template_name']}', Audience: '{options['audience'] or 'Default'}', Tone: '{options['tone'] or 'Default'}', Mode: '{options['generation_mode']}'")
+    pptx_path, download_name = output_paths(filename)
+    try:
+        return get_job_manager().submit(
+            admit=job_admission(),
+            filename=filename, file_ext=file_ext, upload_path=upload_path, upload_buffer=upload_buffer, pptx_path=pptx_path,
+            download_name=download_name, **options, **extra_fields,
+        )
+    except Exception:
+        release_upload(upload_path, upload_buffer)
+        raise
 
-        if not extracted_text or len(extracted_text.strip()) < 50: # Slightly higher threshold for content check
-            logging.warning(f"Extracted text from '{filename}' seems very short ({len(extracted_text)} chars). May indicate an empty document or extraction issue.")
-            raise ValueError("Document appears to be empty or text could not be extracted properly. Please check the document content.")
-        logging.info(f"Text extracted successfully from '{filename}' ({len(extracted_text)} characters).")
+def queue_document(filename, file_ext, save, options, **extra_fields):
+    """Stores one validated upload with `save(target)` and queues its presentation job (see submit_document)."""
+    upload_path, upload_buffer = store_upload(filename, save)
+    return submit_document(filename, file_ext, upload_path, upload_buffer, options, **extra_fields)
+
+@app.route('/upload', methods=['POST'])
+def upload_and_process_file():
+    """Streams the upload into storage, then queues presentation generation and returns the job id.
+
+    The body is read as it arrives, so an upload with the wrong extension or contents is
+    rejected after its first kilobyte rather than after the whole body was buffered. When the
+    job queue is full, the request is answered with 429 before its body is read.
+    """
+    client = request_client_id()
+    shed = admission_response(client)
+    if shed is not None:
+        return shed
+    try:
+        form, upload = receive_upload()
+    except ValueError as e:
+        logging.info(f"Upload rejected: {e}")
+        return jsonify({"error": str(e)}), 400
+    try:
+        options = read_generation_options(form)
+    except ValueError as e:
+        release_upload(upload['upload_path'], upload['upload_buffer'])
+        return jsonify({"error": str(e)}), 400
 
-        # 3. Build LLM Prompt
-        prompt = build_llm_prompt(extracted_text, template_name, target_audience, desired_tone)
+    try:
+        job_id = submit_document(upload['filename'], upload['file_ext'], upload['upload_path'], upload['upload_buffer'],
+                                 options, upload_sha256=upload['sha256'], client=client)
+    except AdmissionRejected as e: # The queue filled up while the body was read
+        return admission_rejected_response(client, e)
+    except Exception:
+        logging.exception("An unexpected error occurred while queueing the upload.")
+        return jsonify({"error": "An internal server error occurred. Please try again later or contact support."}), 500
 
-        # 4. Call LLM Service
-        llm_response = call_llm(prompt)
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "download_url": f"/jobs/{job_id}/download",
+    }), 202
+
+def save_bytes(data):
+    """Returns a save(target) callable, like FileStorage.save, for bytes read from an archive."""
+    def save(target):
+        write_output(target, data)
+    return save
+
+def iter_uploaded_documents(files):
+    """Yields (filename, read, error) for each uploaded file and each file inside uploaded zip archives.
+
+    `read()` returns a save(target) callable for the document and raises ValueError if it cannot
+    be read; call it before requesting the next item, since archives are closed as iteration
+    moves on. `error` is set (and `read` is None) for archives that could not be opened.
+    """
+    max_bytes = app.config['MAX_CONTENT_LENGTH']
+    for file in files:
+        if os.path.splitext(file.filename)[1].lower() != '.zip':
+            yield file.filename, (lambda file=file: file.save), None
+            continue
+        try:
+            archive = zipfile.ZipFile(file.stream)
+        except ZIP_READ_ERRORS as e:
+            logging.warning(f"Could not read archive '{file.filename}': {e}")
+            yield file.filename, None, f"Could not read the zip archive: {e}"
+            continue
 
-        # 5. Parse LLM Output
-        logging.info("Parsing LLM response...")
-        slides_data = parse_llm_output(llm_response)
+        def read(info):
+            try:
+                return save_bytes(read_zip_member(archive, info, max_bytes))
+            except ZIP_READ_ERRORS as e:
+                raise ValueError(f"Could not read this file from the zip archive: {e}")
+
+        with archive:
+            for info in iter_zip_members(archive):
+                yield os.path.basename(info.filename), (lambda info=info: read(info)), None
+
+@app.route('/batch', methods=['POST'])
+def upload_batch():
+    """Queues one job per document for several uploaded files and/or zip archives of documents.
+
+    Documents that cannot be queued (wrong type, unreadable archive member, over the batch
+    limit) are reported per document instead of failing the whole batch; the request only
+    fails if nothing could be queued.
+
+    Each document is admitted like a separate upload. Once the queue (or the client's share of
+    it) is full, the remaining documents are rejected unread, with the retry_after of the
+    first refusal; if that leaves nothing queued, the request is answered with 429.
+    """
+    client = request_client_id()
+    shed = admission_response(client)
+    if shed is not None:
+        return shed
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({"error": "No files selected for upload."}), 400
+    try:
+        options = read_generation_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    batch_id = new_job_id()
+    max_documents = app.config['BATCH_MAX_DOCUMENTS']
+    documents = [] # In upload order: {'filename', 'job_id'} or {'filename', 'error'}
+    queued = 0
+    shed = None # The AdmissionRejected that stopped the batch
+
+    def add_document(filename, read_data):
+        nonlocal queued, shed
+        if shed is not None:
+            documents.append({"filename": filename, "error": admission_message(shed)})
+            return
+        try:
+            if queued >= max_documents:
+                raise ValueError(f"Batch limit of {max_documents} documents reached.")
+            file_ext = validate_upload_filename(filename)
+            save = read_data()
+        except ValueError as e:
+            documents.append({"filename": filename, "error": str(e)})
+            return
+        try:
+            job_id = queue_document(filename, file_ext, save, options, batch_id=batch_id, client=client)
+        except AdmissionRejected as e:
+            shed = e
+            documents.append({"filename": filename, "error": admission_message(e)})
+            return
+        except Exception:
+            logging.exception(f"An unexpected error occurred while queueing '{filename}' for batch {batch_id}.")
+            documents.append({"filename": filename, "error": "An internal server error occurred while queueing this document."})
+            return
+        documents.append({"filename": filename, "job_id": job_id})
+        queued += 1
+
+    for filename, read_data, error in iter_uploaded_documents(files):
+        if error is not None:
+            documents.append({"filename": filename, "error": error})
+        else:
+            add_document(filename, read_data)
+
+    if not queued and shed is not None:
+        return admission_rejected_response(client, shed)
+    if not queued:
+        return jsonify({"error": "None of the uploaded documents could be queued.", "documents": documents}), 400
+
+    get_job_manager().add_record(batch_id, kind='batch', documents=documents, **options)
+    logging.info(f"Batch {batch_id}: {queued} of {len(documents)} documents queued.")
+    return jsonify({
+        "batch_id": batch_id,
+        "status": "queued",
+        "queued": queued,
+        "rejected": [doc for doc in documents if 'error' in doc],
+        "retry_after": shed.retry_after if shed is not None else None,
+        "status_url": f"/batch/{batch_id}",
+        "download_url": f"/batch/{batch_id}/download",
+    }), 202
+
+@app.route('/merge', methods=['POST'])
+def upload_merge():
+    """Queues one job that builds a single deck from several uploaded documents (files and/or zips).
+
+    Documents that cannot be accepted are listed under 'rejected'; the request only fails if
+    none can. Documents that turn out to be empty while the job runs are reported in its
+    'merge' stats.
+    """
+    client = request_client_id()
+    shed = admission_response(client)
+    if shed is not None:
+        return shed
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({"error": "No files selected for upload."}), 400
+    try:
+        options = read_generation_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # 6. Create PowerPoint Presentation
-        logging.info(f"Creating presentation '{output_download_name}' using template '{template_name}'...")
-        create_presentation(slides_data, pptx_path, template_name) # This function now raises IOError on save failure
+    max_documents = app.config['MERGE_MAX_DOCUMENTS']
+    sources = []
+    rejected = []
+    try:
+        for filename, read_data, error in iter_uploaded_documents(files):
+            try:
+                if error is not None:
+                    raise ValueError(error)
+                if len(sources) >= max_documents:
+                    raise ValueError(f"Merge limit of {max_documents} documents reached.")
+                file_ext = validate_upload_filename(filename)
+                save = read_data()
+            except ValueError as e:
+                rejected.append({"filename": filename, "error": str(e)})
+                continue
+            upload_path, upload_buffer = store_upload(filename, save)
+            sources.append({'filename': filename, 'file_ext': file_ext, 'upload_path': upload_path, 'upload_buffer': upload_buffer})
+
+        if not sources:
+            return jsonify({"error": "None of the uploaded documents could be used.", "rejected": rejected}), 400
+
+        display_name = sources[0]['filename'] if len(sources) == 1 else f"{sources[0]['filename']} + {len(sources) - 1} more"
+        pptx_path, download_name = output_paths(f"{os.path.splitext(sources[0]['filename'])[0]}_merged")
+        logging.info(f"Queueing merge of {len(sources)} documents - Template: '{options['template_name']}', Audience: '{options['audience'] or 'Default'}', Tone: '{options['tone'] or 'Default'}', Mode: '{options['generation_mode']}'")
+        job_id = get_job_manager().submit(
+            admit=job_admission(),
+            filename=display_name, file_ext=None, upload_path=None, upload_buffer=None, sources=sources,
+            pptx_path=pptx_path, download_name=download_name, client=client, **options,
+        )
+    except AdmissionRejected as e:
+        for source in sources:
+            release_upload(source['upload_path'], source['upload_buffer'])
+        return admission_rejected_response(client, e)
+    except Exception:
+        logging.exception("An unexpected error occurred while queueing the merge.")
+        for source in sources:
+            release_upload(source['upload_path'], source['upload_buffer'])
+        return jsonify({"error": "An internal server error occurred. Please try again later or contact support."}), 500
 
-        # 7. Send File to User for Download
-        logging.info(f"Presentation created. Preparing '{output_download_name}' for download.")
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "document_count": len(sources),
+        "rejected": rejected,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "download_url": f"/jobs/{job_id}/download",
+    }), 202
+
+def get_batch(batch_id):
+    """Returns the batch record, or None if it does not exist or has expired."""
+    record = get_job_manager().get(batch_id)
+    return record if record is not None and record.get('kind') == 'batch' else None
+
+def get_job(job_id):
+    """Returns a presentation job, or None (batch records share the job store but are not jobs)."""
+    job = get_job_manager().get(job_id)
+    return job if job is not None and job.get('kind') != 'batch' else None
+
+def batch_document_status(document, job):
+    """Status of one batch document: the job's status payload, or the reason it has none."""
+    if 'error' in document:
+        return {"filename": document['filename'], "status": "rejected", "error": document['error']}
+    if job is None:
+        return {"filename": document['filename'], "job_id": document['job_id'], "status": JOB_FAILED,
+                "error": "Job not found. It may have expired."}
+    return job_status_payload(job)
+
+def batch_status_payload(batch):
+    """Public view of a batch: overall state, per-status counts and per-document status."""
+    manager = get_job_manager()
+    documents = [batch_document_status(doc, manager.get(doc['job_id']) if 'job_id' in doc else None)
+                 for doc in batch['documents']]
+    counts = {status: 0 for status in ('queued', 'running', JOB_DONE, JOB_FAILED, JOB_CANCELLED, 'rejected')}
+    for doc in documents:
+        counts[doc['status']] = counts.get(doc['status'], 0) + 1
+    finished = counts['queued'] == 0 and counts['running'] == 0
+    return {
+        "batch_id": batch['id'],
+        "status": JOB_DONE if finished else 'running',
+        "created_at": batch.get('created_at'),
+        "counts": counts,
+        "documents": documents,
+        "status_url": f"/batch/{batch['id']}",
+        "download_url": f"/batch/{batch['id']}/download",
+    }
 
-        # Use BytesIO for efficient memory handling and sending the file
-        file_buffer = BytesIO()
+def read_job_deck(job):
+    """Returns a finished job's deck bytes, or None if the file has gone missing."""
+    if job.get('result_bytes') is not None:
+        return job['result_bytes']
+    if job.get('pptx_path') and os.path.exists(job['pptx_path']):
+        return read_output(job['pptx_path'])
+    return None
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """Reports the state of every document in a batch."""
+    batch = get_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found. It may have expired."}), 404
+    return jsonify(batch_status_payload(batch))
+
+@app.route('/batch/<batch_id>/download', methods=['GET'])
+def batch_download(batch_id):
+    """Streams a zip of the batch's decks, adding each one as soon as its job finishes.
+
+    The archive ends with manifest.json, which lists every document with its status, the
+    deck's name in the archive, or the reason it failed or was rejected. Like the events stream,
+    the response holds a server thread, so it waits at most BATCH_DOWNLOAD_WAIT_SECONDS for
+    unfinished jobs; those are listed as queued or running (and the manifest's status is
+    'running'), and a later download includes them.
+    """
+    batch = get_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found. It may have expired."}), 404
+    manager = get_job_manager()
+
+    def generate():
+        deadline = time.monotonic() + app.config['BATCH_DOWNLOAD_WAIT_SECONDS']
+        archive = ZipStream()
+        used_names = set()
+        archive_names = {} # job id -> deck name in the archive
+        pending = [doc['job_id'] for doc in batch['documents'] if 'job_id' in doc]
+        while pending:
+            still_pending = []
+            for job_id in pending:
+                job = manager.get(job_id)
+                if job is None or job['status'] in (JOB_FAILED, JOB_CANCELLED):
+                    continue
+                if job['status'] != JOB_DONE:
+                    still_pending.append(job_id)
+                    continue
+                deck_bytes = read_job_deck(job)
+                if deck_bytes is None:
+                    logging.error(f"Batch {batch_id}: deck for job {job_id} is missing.")
+                    continue
+                archive_names[job_id] = unique_archive_name(job['download_name'], used_names)
+                yield archive.add(archive_names[job_id], deck_bytes)
+            pending = still_pending
+            if pending:
+                if time.monotonic() >= deadline:
+                    break # The manifest reports these as unfinished
+                time.sleep(0.5)
+
+        manifest = batch_status_payload(get_batch(batch_id) or batch)
+        for doc in manifest['documents']:
+            if doc.get('job_id') in archive_names:
+                doc['archive_name'] = archive_names[doc['job_id']]
+            elif doc['status'] == JOB_DONE:
+                doc.update(status=JOB_FAILED, error="The generated presentation could not be read.")
+        yield archive.add('manifest.json', json.dumps(manifest, indent=2).encode('utf-8'), compress=True)
+        yield archive.close()
+
+    return app.response_class(generate(), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="batch_{batch_id}_presentations.zip"',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Reports result and extraction cache hit/miss counters for this process."""
+    payload = {"enabled": result_cache is not None}
+    if result_cache is not None:
+        payload["results"] = result_cache.stats()
+    if extraction_cache is not None:
+        payload["extraction"] = extraction_cache.stats()
+    return jsonify(payload)
+
+@app.route('/llm/stats', methods=['GET'])
+def llm_stats():
+    """Reports LLM client retry, circuit breaker and connection reuse counters for this process."""
+    return jsonify(llm_client.stats())
+
+@app.route('/llm/governor', methods=['GET'])
+def llm_governor_stats():
+    """Reports LLM governor admissions, sheds and waits for this process, plus the current wait estimate."""
+    stats = llm_governor.stats()
+    if llm_governor.enabled:
+        stats['estimated_wait_seconds'] = round(llm_governor.estimate_wait(LLM_MAX_OUTPUT_TOKENS), 1)
+    return jsonify(stats)
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """Reports admitted and shed submissions, the queue, and the stage latencies behind Retry-After for this process."""
+    if admission is None:
+        return jsonify({"enabled": False})
+    manager = get_job_manager()
+    return jsonify(dict(admission.stats(), enabled=True, queued=manager.count(JOB_QUEUED), running=manager.count(JOB_RUNNING)))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format histograms of pipeline stage timings and request sizes for this process."""
+    if pipeline_metrics is None:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=false)."}), 404
+    return app.response_class(pipeline_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Reports the state of a queued presentation job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    return jsonify(job_status_payload(job))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events stream of a job's progress (stage changes and newly parsed slides).
+
+    The stream occupies a server thread while it is open, so each connection is capped at
+    SSE_MAX_STREAM_SECONDS (a few seconds by default; Waitress has only WAITRESS_THREADS threads
+    for every request). EventSource reconnects automatically and receives a fresh snapshot. The stream ends with a 'done', 'failed' or 'cancelled' event carrying the status payload.
+
+    When a stream closes before its job has finished, the job is marked detached; a browser that
+    is still there reconnects and clears the mark, otherwise the job is cancelled once
+    CANCEL_DISCONNECT_GRACE_SECONDS have passed (see job_cancel_trigger). Heartbeat comments
+    let the server notice a closed connection while the job makes no progress.
+    """
+    manager = get_job_manager()
+    if get_job(job_id) is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    max_seconds = app.config['SSE_MAX_STREAM_SECONDS']
+    heartbeat_seconds = app.config['SSE_HEARTBEAT_SECONDS']
+    track_detach = app.config['CANCEL_ON_DISCONNECT']
+
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        deadline = time.monotonic() + max_seconds
+        last_snapshot = None
+        last_sent = time.monotonic()
+        finished = False
         try:
-            with open(pptx_path, 'rb') as f:
-                file_buffer.write(f.read())
-            file_buffer.seek(0) # Rewind buffer to the beginning for sending
-        except FileNotFoundError:
-            logging.error(f"Generated presentation file not found at expected path: {pptx_path}")
-            return jsonify({"error": "Internal server error: Failed to read generated presentation file."}), 500
-        except Exception as e:
-             logging.error(f"Error reading generated presentation file '{pptx_path}': {e}", exc_info=True)
-             return jsonify({"error": "Internal server error: Could not read generated file for download."}), 500
-
-        # Note: Cleanup of pptx_path is handled by the @after_this_request decorator
-
+            yield "retry: 1000\n\n"
+            while True:
+                job = manager.get(job_id)
+                if job is None:
+                    finished = True
+                    yield sse('failed', {"error": "Job not found. It may have expired."})
+                    return
+                if track_detach and job.get('detached_at') is not None:
+                    manager.update(job_id, detached_at=None) # Someone is still watching
+                payload = job_status_payload(job)
+                if job['status'] in FINISHED_STATES:
+                    finished = True
+                    yield sse(job['status'], payload)
+                    return
+                snapshot = (payload['status'], payload['stage'], len(payload['slide_titles']))
+                if snapshot != last_snapshot:
+                    last_snapshot = snapshot
+                    last_sent = time.monotonic()
+                    yield sse('progress', payload)
+                elif time.monotonic() - last_sent >= heartbeat_seconds:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n" # Writing to a closed connection ends this generator
+                if time.monotonic() >= deadline:
+                    return # Client reconnects after the retry interval
+                time.sleep(0.5)
+        finally:
+            # Runs on a normal end and when the server closes the stream after a failed write
+            if track_detach and not finished:
+                manager.update(job_id, detached_at=time.time())
+
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancels a presentation job.
+
+    A queued job is cancelled at once (200) and its upload released. A running job is asked to
+    stop (202) and does so at its next check: a stage change, a line of a streamed LLM response,
+    or the next LLM call. Finished jobs cannot be cancelled (409).
+    """
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    manager = get_job_manager()
+    saved_seconds, saved_tokens = job_costs.savings(None, prompt_budget.chars_per_token)
+    details = {"trigger": 'request', "stage": 'queued', "saved_seconds": saved_seconds, "saved_tokens": saved_tokens}
+    status = manager.cancel(job_id, 'request', cancellation=details)
+    if status == JOB_QUEUED:
+        for upload in job_uploads(job):
+            release_upload(upload['upload_path'], upload['upload_buffer'])
+        if pipeline_metrics is not None:
+            pipeline_metrics.record_cancellation(details)
+        return jsonify(job_status_payload(manager.get(job_id) or job))
+    if status == JOB_RUNNING:
+        return jsonify(job_status_payload(manager.get(job_id) or job)), 202
+    if status is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    return jsonify({"error": f"The job has already finished (status: {status})."}), 409
+
+@app.route('/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    """Sends the generated presentation for a finished job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found. It may have expired."}), 404
+    if job['status'] in (JOB_FAILED, JOB_CANCELLED):
+        return jsonify({"error": job.get('error') or "Presentation generation failed."}), 400
+    if job['status'] != JOB_DONE:
+        return jsonify({"error": f"Presentation is not ready yet (status: {job['status']})."}), 409
+
+    if job.get('result_bytes') is not None:
+        logging.info(f"Sending in-memory '{job['download_name']}' for job {job_id}.")
         return send_file(
-            file_buffer,
+            BytesIO(job['result_bytes']), # Shares the bytes object; no copy is made
             as_attachment=True,
-            download_name=output_download_name,
+            download_name=job['download_name'],
             mimetype='application/vnd.openxmlformats-officedocument.presentationml.presentation'
         )
 
-    except ValueError as e:
-        # Handle user-facing errors (validation, empty doc, config issues, parsing, LLM errors)
-        logging.warning(f"Processing failed due to ValueError: {e}")
-        return jsonify({"error": str(e)}), 400 # Bad Request
-    except IOError as e:
-        # Handle errors specifically related to file saving (create_presentation)
-        logging.error(f"File saving error during presentation creation: {e}", exc_info=True)
-        return jsonify({"error": f"Failed to save the presentation file on the server: {e}"}), 500 # Internal Server Error
-    except Exception as e:
-        # Catch-all for any other unexpected errors during the process
-        logging.exception("An unexpected critical error occurred during file processing.") # Log full traceback
-        return jsonify({"error": "An internal server error occurred. Please try again later or contact support."}), 500
+    pptx_path = job['pptx_path']
+    if not os.path.exists(pptx_path):
+        logging.error(f"Generated presentation file not found at expected path: {pptx_path}")
+        return jsonify({"error": "Internal server error: Failed to read generated presentation file."}), 500
+
+    logging.info(f"Sending '{job['download_name']}' for job {job_id}.")
+    return send_file(
+        os.path.abspath(pptx_path), # Flask resolves relative paths against the app's directory, not the working directory
+        as_attachment=True,
+        download_name=job['download_name'],
+        mimetype='application/vnd.openxmlformats-officedocument.presentationml.presentation'
+    )
 
 # --- Main Execution Block ---
 if __name__ == '__main__':
-    # Check for essential Azure configuration at startup and print warning if missing
-    if not AZURE_ENDPOINT or not AZURE_API_KEY:
-        print("\n" + "="*75)
-        print("!!! WARNING: Azure OpenAI Credentials (Endpoint or API Key) Missing !!!")
-        print("!!! The application will run, but PowerPoint generation will fail.  !!!")
-        print("!!! Please set AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY      !!!")
-        print("!!! environment variables or ensure they are in a '.env' file.    !!!")
-        print("="*75 + "\n")
-
-    # Determine run mode (Debug vs. Production/Waitress)
-    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() in ['true', '1', 't']
-
-    host = os.environ.get('HOST', '0.0.0.0') # Listen on all interfaces by default
-    port = int(os.environ.get('PORT', 5000)) # Default port 5000
-
-    if not debug_mode:
-        try:
-            from waitress import serve
-            threads = int(os.environ.get('WAITRESS_THREADS', 8)) # Default to 8 threads
-            print(f"--- Starting Waitress Production Server ---")
-            print(f"--- Listening on: http://{host}:{port}")
-            print(f"--- Worker Threads: {threads}")
-            print(f"--- Azure Endpoint Configured: {'YES' if AZURE_ENDPOINT else 'NO (!)'}")
-            print(f"--- Azure API Key Configured:  {'YES' if AZURE_API_KEY else 'NO (!)'}")
-            print("--- Press Ctrl+C to quit ---")
-            serve(app, host=host, port=port, threads=threads)
-        except ImportError:
-            print("\n--- Waitress Package Not Found ---")
-            print("--- Falling back to Flask Development Server (NOT FOR PRODUCTION) ---")
-            print(f"--- Listening on: http://{host}:{port}")
-            print(f"--- Azure Endpoint Configured: {'YES' if AZURE_ENDPOINT else 'NO (!)'}")
-            print(f"--- Azure API Key Configured:  {'YES' if AZURE_API_KEY else 'NO (!)'}")
-            print("--- Debug Mode: True ---")
-            app.run(host=host, port=port, debug=True)
-    else:
-        print("--- Starting Flask Development Server ---")
-        print(f"--- Listening on: http://{host}:{port}")
-        print(f"--- Azure Endpoint Configured: {'YES' if AZURE_ENDPOINT else 'NO (!)'}")
-        print(f"--- Azure API Key Configured:  {'YES' if AZURE_API_KEY else 'NO (!)'}")
-        print("--- Debug Mode: True (Reloads on code changes) ---")
-        print("--- Press Ctrl+C to quit ---")
-        app.run(host=host, port=port, debug=True)
\ No newline at end of file
+    # run.py is the launcher; register this module as 'app' so it is not imported a second time
+    import sys
+    sys.modules.setdefault('app', sys.modules[__name__])
+    from run import main
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Archive helpers for batch uploads.
+
+A batch arrives as several files or as a zip of documents; each document becomes an ordinary
+job, so batches share the job workers (and the LLM governor) with single uploads. The decks
+are sent back as a zip that is written incrementally: ZipStream emits each entry's bytes as
+soon as that deck is added, so the client receives finished decks while the rest of the batch
+is still running and the server never holds more than one deck in memory for the response.
+"""
+import os
+import zipfile
+
+ZIP_METADATA_PREFIXES = ('__MACOSX/',)
+# Raised for corrupt archives or members (BadZipFile), encrypted members (RuntimeError) and
+# unsupported compression methods (NotImplementedError)
+ZIP_READ_ERRORS = (zipfile.BadZipFile, zipfile.LargeZipFile, RuntimeError, NotImplementedError)
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def iter_zip_members(archive):
+    """Yields the ZipInfo of each regular file, skipping directories and OS metadata entries."""
+    for info in archive.infolist():
+        if info.is_dir() or info.filename.startswith(ZIP_METADATA_PREFIXES):
+            continue
+        if os.path.basename(info.filename).startswith('.'):
+            continue # .DS_Store, ._resource forks and other hidden files
+        yield info
+
+
+def read_zip_member(archive, info, max_bytes):
+    """Returns a member's bytes, raising ValueError once it inflates past `max_bytes`.
+
+    The size declared in the archive is not trusted; the limit is enforced while reading.
+    """
+    if info.file_size > max_bytes:
+        raise ValueError(f"File is larger than the {max_bytes // (1024 * 1024)} MB upload limit.")
+    chunks = []
+    total = 0
+    with archive.open(info) as member:
+        while True:
+            chunk = member.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise ValueError(f"File is larger than the {max_bytes // (1024 * 1024)} MB upload limit.")
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def unique_archive_name(name, used):
+    """Returns `name`, or `name` with a ' (2)', ' (3)', ... suffix if it is already in `used`; records the result."""
+    candidate = name
+    base, ext = os.path.splitext(name)
+    counter = 2
+    while candidate in used:
+        candidate = f"{base} ({counter}){ext}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that collects what ZipFile writes."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """Builds a zip archive entry by entry for a streamed response.
+
+    `add()` returns the bytes for that entry (local header, data and data descriptor) and
+    `close()` returns the central directory. Decks are stored uncompressed since .pptx files
+    are already zip-compressed.
+    """
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._archive = zipfile.ZipFile(self._sink, 'w', compression=zipfile.ZIP_STORED)
+
+    def add(self, name, data, compress=False):
+        self._archive.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        return self._sink.drain()
+
+    def close(self):
+        self._archive.close()
+        return self._sink.drain()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark: per-slide deck build time for the built-in themes.
+
+Builds decks of synthetic slides with the DeckBuilder for each template in app.TEMPLATES and
+reports the per-deck setup cost (opening the cached base presentation vs. a fresh
+Presentation()) and the per-slide build and save times.
+
+    python benchmarks/bench_deck_builder.py [--slides N] [--repeat N]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pptx import Presentation # noqa: E402
+from app import TEMPLATES # noqa: E402
+from deck_builder import DeckBuilder # noqa: E402
+
+
+def make_slides(count):
+    return [{
+        'title': f"Quarterly Review Topic {i}",
+        'content_type': "Text and Chart",
+        'key_message': f"Topic {i} shows steady progress against the plan with two open risks.",
+        'bullets': [f"Revenue grew {i % 9 + 1}% quarter over quarter", "Customer churn held below target",
+                    "Hiring is behind plan in two regions"],
+        'visual': f"Bar chart comparing plan vs. actual for topic {i}." if i % 3 else "Text Focus",
+        'design_note': "Highlight the two risks in the accent color.",
+        'notes': f"Figures from the Q3 finance pack, page {i}.",
+        'elaboration': "Walk through the plan vs. actual numbers, then the two risks and their owners.",
+        'enhancement_suggestion': "Add a customer quote that illustrates the churn trend.",
+        'best_practice_tip': "Lead with the conclusion, then show the supporting data.",
+    } for i in range(1, count + 1)]
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--slides', type=int, default=50, help="slides per deck")
+    parser.add_argument('--repeat', type=int, default=5, help="timing runs (best is reported)")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    builder = DeckBuilder(TEMPLATES)
+    builder.new_presentation() # Build the per-process base outside the timings
+    fresh, _ = best_of(args.repeat, Presentation)
+    cloned, _ = best_of(args.repeat, builder.new_presentation)
+    print(f"deck setup: Presentation() {fresh * 1000:.1f} ms, cached base {cloned * 1000:.1f} ms")
+
+    slides = make_slides(args.slides)
+    print(f"{'theme':>12} {'build ms/slide':>15} {'save ms/slide':>14}")
+    for name in TEMPLATES:
+        build, prs = best_of(args.repeat, lambda: builder.build(slides, name))
+        save, _ = best_of(args.repeat, lambda: prs.save(BytesIO()))
+        print(f"{name:>12} {build * 1000 / args.slides:>15.2f} {save * 1000 / args.slides:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
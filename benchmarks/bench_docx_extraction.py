@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Benchmark: streaming DOCX extraction against python-docx on large synthetic documents.
+
+Builds .docx files with a table after every page and extracts each one with python-docx
+(paragraphs only, the previous path) and with the streaming reader (paragraphs and table rows).
+Prints the best-of-N time, peak Python memory (tracemalloc, including the extracted text) and
+characters extracted, plus the streaming reader's figures when it stops at a character budget.
+
+    python benchmarks/bench_docx_extraction.py [--pages 20,200,1000] [--table-rows 10] [--budget 200000] [--repeat N]
+"""
+import os
+import sys
+import timeit
+import argparse
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from docx import Document as DocxDocument # noqa: E402
+
+from corpus import make_docx # noqa: E402
+from extraction import extract_docx_text # noqa: E402
+
+
+def python_docx_text(data):
+    document = DocxDocument(BytesIO(data))
+    return '\n'.join(p.text for p in document.paragraphs if p.text.strip())
+
+
+def stream_text(data, char_budget=None):
+    return extract_docx_text(BytesIO(data), char_budget)[0]
+
+
+def measure(extract, repeat):
+    """(best seconds, peak traced bytes, extracted characters) for one extraction function."""
+    best = min(timeit.repeat(extract, number=1, repeat=repeat))
+    tracemalloc.start()
+    text = extract()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', default='20,200,1000', help="comma-separated document sizes in pages")
+    parser.add_argument('--table-rows', type=int, default=10, help="rows of the table after each page")
+    parser.add_argument('--budget', type=int, default=200000, help="character budget for the early-exit run")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'size':>9} {'engine':<14} {'time':>9} {'peak mem':>10} {'chars':>11}")
+    for pages in (int(p) for p in args.pages.split(',')):
+        data = make_docx(pages, seed=pages, table_rows=args.table_rows)
+        size = f"{len(data) // 1024:,}KB"
+        for engine, extract in (('python-docx', lambda: python_docx_text(data)),
+                                ('stream', lambda: stream_text(data)),
+                                ('stream+budget', lambda: stream_text(data, args.budget))):
+            seconds, peak, chars = measure(extract, args.repeat)
+            print(f"{pages:>6} {size:>9} {engine:<14} {seconds * 1000:>7.1f}ms {peak / (1024 * 1024):>8.1f}MB {chars:>11,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Benchmark: text normalization savings and cost on synthetic PDFs.
+
+Extracts the synthetic corpus PDFs (running header and page-number footer on every page),
+normalizes the text and prints characters and estimated tokens before and after, with the
+best-of-N normalization time.
+
+    python benchmarks/bench_normalization.py [--pages 2,20,200] [--repeat N]
+"""
+import os
+import sys
+import timeit
+import logging
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import make_pdf # noqa: E402
+from extraction import extract_pdf_text # noqa: E402
+from normalization import normalize_text # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', default='2,20,200', help="comma-separated document sizes in pages")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'pages':>6} {'chars before':>13} {'chars after':>12} {'tokens before':>14} {'tokens after':>13} {'saved':>7} {'time':>9}")
+    for pages in (int(p) for p in args.pages.split(',')):
+        text, _ = extract_pdf_text(BytesIO(make_pdf(pages, seed=pages)))
+        normalized, stats = normalize_text(text)
+        best = min(timeit.repeat(lambda: normalize_text(text), number=1, repeat=args.repeat))
+        saved = 1 - stats['estimated_tokens_after'] / stats['estimated_tokens_before']
+        print(f"{pages:>6} {stats['chars_before']:>13,} {stats['chars_after']:>12,} {stats['estimated_tokens_before']:>14,} "
+              f"{stats['estimated_tokens_after']:>13,} {saved:>7.1%} {best * 1000:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
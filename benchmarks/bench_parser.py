@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Benchmark: slide_parser engine vs. the previous parse_llm_output implementation.
+
+Parses synthetic LLM outputs of 15, 100 and 1000 slides with both implementations, checks
+that they produce identical slides and prints the best-of-N timings.
+
+The baseline carries the two deliberate output-contract changes made with the repair stage,
+so both parsers read the same format: field labels may be wrapped in '**' (as the prompt asks
+for Elaboration, Enhancement Suggestion and Best Practice Tip), and a final '---' separator
+is not part of the last slide's last field.
+
+    python benchmarks/bench_parser.py [--repeat N] [--elaboration-lines N]
+"""
+import os
+import re
+import sys
+import timeit
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slide_parser import parse_slides # noqa: E402
+
+SLIDE_COUNTS = (15, 100, 1000)
+
+
+def legacy_parse_llm_output(llm_text):
+    """parse_llm_output as it was before the slide_parser engine, plus the contract changes noted above."""
+    slides = []
+    # Regex to split by '---' possibly surrounded by whitespace, ensuring it's on its own line
+    slide_blocks = re.split(r'\n\s*---\s*\n', llm_text.strip())
+
+    # Define all expected fields, including required and optional ones
+    core_required_fields = {'title', 'content_type', 'key_message'}
+    suggestion_fields = {'elaboration', 'enhancement_suggestion', 'best_practice_tip'}
+    optional_fields = {'visual', 'design_note', 'notes', 'bullets'} # Bullets are technically optional if content dictates
+    all_expected_fields = core_required_fields.union(suggestion_fields).union(optional_fields)
+
+    # Default text for required suggestion fields if LLM omits them (though prompt asks it not to)
+    default_suggestion = "Suggestion not provided by AI."
+
+    # Prefixes for easier parsing (lowercase for case-insensitivity)
+    # Ensure keys match the field names used in the dictionaries
+    prefixes = {
+        'slide title:': ('title', 12),
+        'content type:': ('content_type', 13),
+        'key message:': ('key_message', 12),
+        'visual suggestion:': ('visual', 18),
+        'design note:': ('design_note', 12),
+        'notes:': ('notes', 6),
+        'elaboration:': ('elaboration', 12),
+        'enhancement suggestion:': ('enhancement_suggestion', 23),
+        'best practice tip:': ('best_practice_tip', 18),
+    }
+
+    for block_idx, block in enumerate(slide_blocks):
+        block = block.strip()
+        if block.endswith('---') and block[:-3].endswith('\n'):
+            block = block[:-3].strip() # Contract change: a final separator ends the block
+        if not block or block == '---': # Skip empty blocks or blocks just containing the separator
+            continue
+
+        current_slide = {field: '' for field in all_expected_fields} # Initialize with defaults
+        current_slide['bullets'] = [] # Initialize bullets as list
+        current_field_key = None # Tracks the field being processed for multi-line content
+
+        lines = block.split('\n')
+        field_buffer = {} # Temporary storage for field content during line processing
+
+        for line_num, line in enumerate(lines):
+            line_strip = line.strip()
+            line_lower = line.lower()
+            bold_len = 2 if line_lower.startswith('**') else 0 # Contract change: '**'-wrapped labels
+            if not line_strip: continue # Skip empty lines
+
+            # --- Check for Bullets ---
+            if line.startswith('- '):
+                bullet_content = line[2:].strip()
+                if bullet_content: # Only add non-empty bullets
+                    field_buffer.setdefault('bullets', []).append(bullet_content)
+                current_field_key = 'bullets' # Set context
+                continue # Move to next line
+
+            # --- Check for Field Prefixes ---
+            matched_prefix = False
+            for prefix, (field_key, prefix_len) in prefixes.items():
+                if line_lower.startswith(prefix, bold_len):
+                    # Found a field prefix, store its content
+                    field_content = line[bold_len + prefix_len:]
+                    if field_content.startswith('**'):
+                        field_content = field_content[2:]
+                    field_content = field_content.strip()
+                    field_buffer[field_key] = field_content
+                    current_field_key = field_key # Update context to the new field
+                    matched_prefix = True
+                    break # Stop checking prefixes for this line
+
+            # --- Handle Multi-line Content ---
+            if not matched_prefix and current_field_key and current_field_key in field_buffer:
+                # If no prefix matched, and we know the current field context, append the line
+                # This handles multi-line descriptions for fields like Elaboration, Notes, etc.
+                # Exclude appending to 'bullets' field here, as bullets are handled separately
+                if current_field_key != 'bullets':
+                     field_buffer[current_field_key] += f"\n{line_strip}"
+
+        # --- Finalize Slide Data after processing all lines in the block ---
+        current_slide.update(field_buffer) # Update slide dict with buffered content
+
+        # Validate Core Fields: Ensure they exist and are not empty after stripping
+        core_fields_present_and_filled = all(
+            f in current_slide and current_slide[f].strip() for f in core_required_fields
+        )
+
+        if core_fields_present_and_filled:
+            # Apply defaults for suggestion fields if they are missing or empty
+            for f in suggestion_fields:
+                if not current_slide.get(f, '').strip():
+                    current_slide[f] = default_suggestion
+
+            # Ensure bullet list exists even if empty
+            current_slide.setdefault('bullets', [])
+
+            slides.append(current_slide)
+        else:
+            # Log skipped blocks more informatively
+            missing_or_empty_core = [f for f in core_required_fields if not current_slide.get(f, '').strip()]
+            title_preview = current_slide.get('title', 'N/A')
+            logging.warning(
+                f"Skipping Block {block_idx+1}. Missing/Empty Core Fields: {missing_or_empty_core}. "
+                f"Title='{title_preview}'. Block Preview: '{block[:150]}...'"
+            )
+
+    if not slides:
+        # Critical if no slides could be parsed
+        logging.error(f"Failed to parse ANY valid slide blocks from the LLM output. Output Preview: {llm_text[:500]}...")
+        raise ValueError("AI response parsing failed. Could not find any slides with the required structure (Title, Content Type, Key Message). Please check the AI's output format.")
+
+    logging.info(f"Successfully parsed {len(slides)} slides from LLM output.")
+    return slides
+
+
+def make_llm_output(slide_count, elaboration_lines=6):
+    """Builds output in the format requested by build_llm_prompt, with multi-line speaker text."""
+    blocks = []
+    for i in range(1, slide_count + 1):
+        elaboration = "\n".join(f"Talking point {j} for slide {i}: context, nuance and supporting figures for the speaker."
+                                for j in range(elaboration_lines))
+        blocks.append(f"""---
+Slide Title: Quarterly Review Topic {i}
+Content Type: Text and Chart
+Key Message: Topic {i} shows steady progress against the plan with two open risks.
+- Revenue grew {i % 9 + 1}% quarter over quarter
+- Customer churn held below target
+- Hiring is behind plan in two regions
+Visual Suggestion: Bar chart comparing plan vs. actual for topic {i}.
+Design Note: Highlight the two risks in the accent color.
+Notes: Figures from the Q3 finance pack, page {i}.
+**Elaboration:** Topic {i} summary for the presenter.
+{elaboration}
+**Enhancement Suggestion:** Add a customer quote that illustrates the churn trend.
+**Best Practice Tip:** Lead with the conclusion, then show the supporting data.""")
+    return "\n".join(blocks) + "\n---\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="timing runs per size (best is reported)")
+    parser.add_argument('--elaboration-lines', type=int, default=6, help="continuation lines per slide")
+    args = parser.parse_args()
+    logging.disable(logging.INFO) # Parse logging would dominate the timings
+
+    print(f"{'slides':>7} {'legacy ms':>10} {'engine ms':>10} {'speedup':>8}")
+    for count in SLIDE_COUNTS:
+        text = make_llm_output(count, args.elaboration_lines)
+        if legacy_parse_llm_output(text) != parse_slides(text):
+            sys.exit(f"Parsers disagree on the {count}-slide output.")
+        number = max(1, 1000 // count)
+        legacy = min(timeit.repeat(lambda: legacy_parse_llm_output(text), number=number, repeat=args.repeat)) / number
+        engine = min(timeit.repeat(lambda: parse_slides(text), number=number, repeat=args.repeat)) / number
+        print(f"{count:>7} {legacy * 1000:>10.2f} {engine * 1000:>10.2f} {legacy / engine:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Synthetic .docx and .pdf documents for load tests.
+
+Documents are built from repeated business-report paragraphs with section headings, so
+their size is controlled by the page count. PDFs are written directly (one Helvetica text
+stream per page) and need no PDF library; like real reports, their pages carry a running
+header and a "Page N of M" footer.
+
+    python benchmarks/corpus.py --out bench-corpus --pages 2,20,200
+"""
+import os
+import random
+import argparse
+from io import BytesIO
+
+from docx import Document as DocxDocument
+
+LINES_PER_PAGE = 40
+TOPICS = ("revenue", "operating costs", "customer retention", "hiring", "supply chain", "product roadmap",
+          "regional performance", "pricing", "compliance", "infrastructure")
+
+
+def _page_lines(page_no, rng):
+    lines = [f"Section {page_no + 1}: {rng.choice(TOPICS).title()} Review"]
+    for line_no in range(LINES_PER_PAGE - 1):
+        topic = rng.choice(TOPICS)
+        lines.append(f"In period {page_no + 1}.{line_no}, {topic} changed by {rng.randint(-15, 40)}% against plan, "
+                     f"driven by {rng.choice(TOPICS)} and {rng.choice(TOPICS)}.")
+    return lines
+
+
+def make_docx(pages, seed=0, table_rows=0):
+    """Returns .docx bytes with roughly `pages` pages of text, each followed by a `table_rows`-row table if set."""
+    rng = random.Random(seed)
+    document = DocxDocument()
+    for page_no in range(pages):
+        heading, *lines = _page_lines(page_no, rng)
+        document.add_heading(heading, level=1)
+        for line in lines:
+            document.add_paragraph(line)
+        if table_rows:
+            table = document.add_table(rows=table_rows + 1, cols=4)
+            for cell, label in zip(table.rows[0].cells, ("Metric", "Plan", "Actual", "Variance")):
+                cell.text = label
+            for row in table.rows[1:]:
+                plan, actual = rng.randint(100, 999), rng.randint(100, 999)
+                for cell, value in zip(row.cells, (rng.choice(TOPICS).title(), plan, actual, f"{actual - plan:+d}")):
+                    cell.text = str(value)
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+RUNNING_HEADER = "Synthetic Holdings Ltd. | Quarterly Business Review | Internal"
+
+
+def make_pdf(pages, seed=0, furniture=True):
+    """Returns PDF bytes with `pages` pages of text (with a running header and footer unless `furniture` is False)."""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(pages))}] /Count {pages} >>",
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for page_no in range(pages):
+        lines = _page_lines(page_no, rng)
+        if furniture:
+            lines = [RUNNING_HEADER] + lines + [f"Page {page_no + 1} of {pages}"]
+        text_ops = " ".join(f"({_pdf_escape(line)}) '" for line in lines)
+        content = f"BT /F1 9 Tf 40 800 Td 12 TL {text_ops} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * page_no} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode('latin-1')
+    return bytes(out)
+
+
+def build_corpus(page_counts, kinds=('docx', 'pdf')):
+    """Returns [(filename, bytes)] with one document per kind and page count."""
+    makers = {'docx': make_docx, 'pdf': make_pdf}
+    return [(f"synthetic_{pages}p.{kind}", makers[kind](pages, seed=pages)) for pages in page_counts for kind in kinds]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default='bench-corpus', help="output directory")
+    parser.add_argument('--pages', default='2,20,200', help="comma-separated page counts")
+    parser.add_argument('--kinds', default='docx,pdf')
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    for filename, data in build_corpus([int(p) for p in args.pages.split(',')], args.kinds.split(',')):
+        with open(os.path.join(args.out, filename), 'wb') as f:
+            f.write(data)
+        print(f"{filename}: {len(data):,} bytes")
+
+
+if __name__ == '__main__':
+    main()
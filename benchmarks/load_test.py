@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""Offline load test: drives /upload against a local server backed by the mock LLM.
+
+Starts benchmarks/mock_llm.py in-process, then for each selected server (`run.py` under
+Waitress, `run.py` with SERVER=gunicorn, and the Flask development server) launches the app in
+a scratch directory, uploads the synthetic corpus at the given concurrency and waits for every
+job to finish. For each document size it reports throughput, p50/p95/p99 end-to-end latency,
+p50/p95/p99 per pipeline stage (from the job traces) and the peak memory of the server and its
+worker processes: RSS, and PSS (which counts pages shared after a preloading fork only once).
+Memory is also reported per stage: the traces give each stage's time window, and the peak RSS
+sampled within it is attributed to the stage (p50 and max over the jobs). The samples cover
+the whole server, so with concurrency above 1 a stage's figure includes whatever other jobs
+were doing at the time; use --concurrency 1 to isolate the stages.
+The result cache is disabled so every upload runs the full pipeline. Uploads shed by admission
+control (429) are retried after their Retry-After and counted.
+
+    python benchmarks/load_test.py --servers waitress,gunicorn,flask --concurrency 8 --requests 24 --pages 2,20,200
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import build_corpus # noqa: E402
+from mock_llm import add_mock_arguments, config_from_args, start_mock_llm # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _read_proc_kb(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def read_rss_bytes(pid):
+    """Current resident set size of `pid` (Linux /proc), or None where unavailable."""
+    return _read_proc_kb(f"/proc/{pid}/status", 'VmRSS:')
+
+
+def read_pss_bytes(pid):
+    """Current proportional set size of `pid` (shared pages split between their users), or None."""
+    return _read_proc_kb(f"/proc/{pid}/smaps_rollup", 'Pss:')
+
+
+def child_pids(pid):
+    """Direct children of `pid` (e.g. gunicorn workers), from /proc."""
+    children = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the parent pid is the 2nd field after it
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+class RSSSampler:
+    """Polls the RSS and PSS of a process and its children in the background.
+
+    Keeps the peaks and the timestamped RSS samples since the last reset.
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.peak_pss = 0
+        self.samples = [] # (epoch seconds, RSS bytes)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        ticks = 0
+        pids = [self.pid]
+        while not self._stop.wait(self.interval):
+            if ticks % 20 == 0: # Worker processes come and go (max-requests recycling)
+                pids = [self.pid] + child_pids(self.pid)
+            ticks += 1
+            rss = sum(read_rss_bytes(pid) or 0 for pid in pids)
+            pss = sum(read_pss_bytes(pid) or 0 for pid in pids)
+            self.peak = max(self.peak, rss)
+            self.peak_pss = max(self.peak_pss, pss)
+            self.samples.append((time.time(), rss))
+
+    def reset(self):
+        """Returns (peak RSS, peak PSS, samples) and starts a new measurement."""
+        measurement = (self.peak, self.peak_pss, self.samples)
+        self.peak, self.peak_pss, self.samples = 0, 0, []
+        return measurement
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def peak_rss_between(samples, started, ended, interval):
+    """Highest RSS sampled from `started` to `ended`; a window shorter than the sampling
+    interval gets the first sample after it starts. None without samples."""
+    rss = [value for at, value in samples if started <= at <= max(ended, started + interval)]
+    return max(rss) if rss else None
+
+
+class AppServer:
+    """The app running in a subprocess from a scratch working directory."""
+
+    def __init__(self, kind, llm_url, extra_env, threads):
+        self.kind = kind
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workdir = tempfile.mkdtemp(prefix=f"pptx-bench-{kind}-")
+        env = dict(os.environ,
+                   AZURE_OPENAI_ENDPOINT=llm_url, AZURE_OPENAI_API_KEY='mock-key',
+                   HOST='127.0.0.1', PORT=str(self.port), WAITRESS_THREADS=str(threads),
+                   RESULT_CACHE_ENABLED='false', REQUEST_TRACE='true', LLM_TRACK_CACHED_TOKENS='true',
+                   PYTHONUNBUFFERED='1')
+        env.update(extra_env)
+        if kind == 'waitress':
+            command = [sys.executable, os.path.join(REPO_ROOT, 'run.py')]
+        elif kind == 'gunicorn':
+            command = [sys.executable, os.path.join(REPO_ROOT, 'run.py')]
+            env['SERVER'] = 'gunicorn'
+            env.setdefault('GUNICORN_THREADS', str(threads))
+        elif kind == 'flask':
+            command = [sys.executable, '-m', 'flask', '--app', os.path.join(REPO_ROOT, 'app.py'), 'run',
+                       '--host', '127.0.0.1', '--port', str(self.port), '--no-reload', '--with-threads']
+        else:
+            raise ValueError(f"Unknown server '{kind}'. Expected 'waitress', 'gunicorn' or 'flask'.")
+        self.log_path = os.path.join(self.workdir, 'server.log')
+        self._log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.kind} server exited with code {self.process.returncode}; see {self.log_path}")
+            try:
+                if requests.get(self.base_url + '/', timeout=1).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{self.kind} server did not become ready within {timeout:.0f}s; see {self.log_path}")
+
+    def stop(self, keep_workdir=False):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+        if not keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_one(session, base_url, filename, data, timeout, poll_interval):
+    """Uploads one document and waits for its deck. Returns a result dict."""
+    started = time.perf_counter()
+    result = {"filename": filename, "status": "error", "stages": {}, "stage_windows": [], "rejections": 0}
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            response = session.post(base_url + '/upload', files={'file': (filename, data)},
+                                    data={'template': 'professional'}, timeout=timeout)
+            if response.status_code != 429 or time.monotonic() > deadline:
+                break
+            # Shed by admission control: wait as told, like a well-behaved client
+            result["rejections"] += 1
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        if response.status_code != 202:
+            result["error"] = f"upload returned {response.status_code}"
+            return result
+        job = response.json()
+        while True:
+            status = session.get(base_url + job['status_url'], timeout=timeout).json()
+            if status['status'] in ('done', 'failed') or time.monotonic() > deadline:
+                break
+            time.sleep(poll_interval)
+        result["status"] = status['status']
+        if status['status'] == 'done':
+            deck = session.get(base_url + status['download_url'], timeout=timeout)
+            result["deck_bytes"] = len(deck.content)
+        else:
+            result["error"] = status.get('error') or f"timed out in status '{status['status']}'"
+        for stage in (status.get('trace') or {}).get('stages', []):
+            result["stages"][stage['stage']] = result["stages"].get(stage['stage'], 0.0) + stage['seconds']
+            if stage.get('ended_at') is not None:
+                result["stage_windows"].append((stage['stage'], stage['ended_at'] - stage['seconds'], stage['ended_at']))
+    except requests.exceptions.RequestException as e:
+        result["error"] = str(e)
+    finally:
+        result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def run_phase(base_url, documents, total_requests, concurrency, timeout, poll_interval):
+    local = threading.local()
+
+    def task(index):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            # A recycled gunicorn worker closes its idle keep-alive connections; retry GETs like a browser would
+            local.session.mount('http://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1, allowed_methods=['GET'])))
+        filename, data = documents[index % len(documents)]
+        return run_one(local.session, base_url, filename, data, timeout, poll_interval)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(task, range(total_requests)))
+    return results, time.perf_counter() - started
+
+
+def stage_peak_rss(results, samples, interval):
+    """Per stage, the peak RSS sampled during each job's run of it."""
+    peaks = {}
+    for result in results:
+        job_peaks = {}
+        for stage, started, ended in result['stage_windows']:
+            rss = peak_rss_between(samples, started, ended, interval)
+            if rss is not None:
+                job_peaks[stage] = max(job_peaks.get(stage, 0), rss)
+        for stage, rss in job_peaks.items():
+            peaks.setdefault(stage, []).append(rss)
+    return peaks
+
+
+def summarize_phase(results, elapsed, memory, interval):
+    peak_rss, peak_pss, samples = memory
+    done = [r for r in results if r['status'] == 'done']
+    latencies = [r['seconds'] for r in done]
+    stage_names = sorted({stage for r in done for stage in r['stages']})
+    summary = {
+        "requests": len(results),
+        "succeeded": len(done),
+        "failed": len(results) - len(done),
+        "rejections_429": sum(r['rejections'] for r in results),
+        "errors": sorted({r.get('error') for r in results if r.get('error')})[:5],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(done) / elapsed, 3) if elapsed else 0.0,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss else None,
+        "peak_pss_mb": round(peak_pss / (1024 * 1024), 1) if peak_pss else None,
+        "latency": {},
+        "stages": {},
+        "stage_memory": {},
+    }
+    if latencies:
+        summary["latency"] = {f"p{p}": round(percentile(latencies, p), 3) for p in (50, 95, 99)}
+    for stage in stage_names:
+        values = [r['stages'][stage] for r in done if stage in r['stages']]
+        summary["stages"][stage] = {f"p{p}": round(percentile(values, p), 4) for p in (50, 95, 99)}
+    for stage, values in stage_peak_rss(done, samples, interval).items():
+        summary["stage_memory"][stage] = {"p50_peak_rss_mb": round(percentile(values, 50) / (1024 * 1024), 1),
+                                          "max_peak_rss_mb": round(max(values) / (1024 * 1024), 1)}
+    return summary
+
+
+def print_phase(server, pages, summary):
+    latency = summary["latency"] or {"p50": float('nan'), "p95": float('nan'), "p99": float('nan')}
+    rss = f"{summary['peak_rss_mb']:.1f} MB" if summary['peak_rss_mb'] is not None else "n/a"
+    pss = f"{summary['peak_pss_mb']:.1f} MB" if summary['peak_pss_mb'] is not None else "n/a"
+    print(f"\n[{server}] {pages}-page documents: {summary['succeeded']}/{summary['requests']} ok, "
+          f"{summary['throughput_rps']:.2f} req/s, {summary['rejections_429']} 429s, peak RSS {rss}, peak PSS {pss}")
+    print(f"  {'end-to-end':<16} p50 {latency['p50']:8.3f}s  p95 {latency['p95']:8.3f}s  p99 {latency['p99']:8.3f}s")
+    for stage, values in summary["stages"].items():
+        memory = summary["stage_memory"].get(stage)
+        rss = f"  peak RSS p50 {memory['p50_peak_rss_mb']:7.1f} MB  max {memory['max_peak_rss_mb']:7.1f} MB" if memory else ""
+        print(f"  {stage:<16} p50 {values['p50']:8.3f}s  p95 {values['p95']:8.3f}s  p99 {values['p99']:8.3f}s{rss}")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', default='waitress,flask', help="comma-separated: waitress, gunicorn, flask")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=24, help="uploads per document size")
+    parser.add_argument('--pages', default='2,20,200', help="comma-separated document sizes in pages")
+    parser.add_argument('--kinds', default='docx,pdf', help="document types to upload")
+    parser.add_argument('--threads', type=int, default=8, help="Waitress worker threads (gunicorn: threads per worker process)")
+    parser.add_argument('--timeout', type=float, default=600.0, help="seconds to wait for one job")
+    parser.add_argument('--poll-interval', type=float, default=0.1, help="job status polling interval")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="extra app setting (repeatable)")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--keep-workdir', action='store_true', help="keep the server's scratch directory and log")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    mock_config = config_from_args(args)
+    mock_server, llm_url = start_mock_llm(mock_config)
+    print(f"Mock LLM at {llm_url}: latency {args.latency}s, {args.tokens_per_second} tokens/s, "
+          f"429 {args.throttle_rate:.0%}, 5xx {args.error_rate:.0%}, truncated {args.truncate_rate:.0%}")
+
+    page_counts = [int(p) for p in args.pages.split(',')]
+    kinds = args.kinds.split(',')
+    report = {"settings": vars(args), "results": {}}
+    for kind in args.servers.split(','):
+        server = AppServer(kind, llm_url, extra_env, args.threads)
+        try:
+            server.wait_ready()
+            sampler = RSSSampler(server.process.pid)
+            report["results"][kind] = {}
+            for pages in page_counts:
+                documents = build_corpus([pages], kinds)
+                sampler.reset()
+                results, elapsed = run_phase(server.base_url, documents, args.requests, args.concurrency,
+                                             args.timeout, args.poll_interval)
+                summary = summarize_phase(results, elapsed, sampler.reset(), sampler.interval)
+                report["results"][kind][str(pages)] = summary
+                print_phase(kind, pages, summary)
+            sampler.stop()
+        finally:
+            server.stop(keep_workdir=args.keep_workdir)
+
+    mock_server.shutdown()
+    report["mock_llm"] = mock_config.counts
+    print(f"\nMock LLM requests: {mock_config.counts}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
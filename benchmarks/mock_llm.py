@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Azure OpenAI chat-completions endpoint.
+
+Answers outline prompts with a synthetic slide outline (continuing after the slides of an
+assistant turn, if the request has one), skeleton prompts with the outline's slide fields only,
+slide notes prompts with the four notes fields, slide repair prompts with one slide block and
+chunk-summary prompts with a short bullet summary, streamed or not, with configurable first-token latency, output token rate and
+injected failures (429 with Retry-After, 5xx, and truncated `finish_reason: length` output).
+Usage includes `prompt_tokens_details.cached_tokens` from a simulated prompt prefix cache:
+prefixes seen before are counted in 128-token blocks once at least 1,024 tokens match.
+
+    python benchmarks/mock_llm.py --port 8901 --latency 0.5 --tokens-per-second 150 --error-rate 0.05
+
+Point the app at it with AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8901/chat and any API key.
+"""
+import re
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_TOKENS = 4
+PREFIX_CACHE_BLOCK_TOKENS = 128
+PREFIX_CACHE_MIN_TOKENS = 1024
+
+
+NOTES_FIELDS = """Notes: Figures from the synthetic benchmark corpus.
+**Elaboration:** Walk through plan vs. actual, then the open risks and their owners.
+**Enhancement Suggestion:** Add a customer quote that illustrates the trend.
+**Best Practice Tip:** Lead with the conclusion, then show the supporting data."""
+
+
+def make_outline(slide_count, seed=0, first=1, notes=True):
+    """Slide outline in the format requested by build_llm_prompt, numbering slides from `first`.
+
+    Without `notes` the blocks stop after the Design Note, like a two-phase skeleton.
+    """
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(first, first + slide_count):
+        block = f"""---
+Slide Title: Benchmark Topic {i}
+Content Type: Text and Chart
+Key Message: Topic {i} moved {rng.randint(1, 30)}% against plan this quarter.
+- Revenue grew {rng.randint(1, 9)}% quarter over quarter
+- Customer churn held below target
+- Hiring is behind plan in {rng.randint(1, 4)} regions
+Visual Suggestion: Bar chart comparing plan vs. actual for topic {i}.
+Design Note: Highlight the risks in the accent color."""
+        blocks.append(f"{block}\n{NOTES_FIELDS}" if notes else block)
+    return "\n".join(blocks) + "\n---\n"
+
+
+def make_summary(prompt):
+    lines = [line.strip() for line in prompt.splitlines() if len(line.strip()) > 40][:20]
+    return "\n".join(f"- {line[:160]}" for line in lines) or "- (empty part)"
+
+
+class MockLLMConfig:
+    """Behaviour knobs; rates are probabilities per request."""
+
+    def __init__(self, latency=0.5, tokens_per_second=150.0, slides=12, error_rate=0.0, throttle_rate=0.0,
+                 truncate_rate=0.0, retry_after=1.0, seed=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.slides = slides
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.truncate_rate = truncate_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'throttled': 0, 'errors': 0, 'truncated': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+        self.prefixes = set()
+
+    def draw(self):
+        """Picks this request's outcome: 'throttle', 'error', 'truncate' or 'ok'."""
+        with self.lock:
+            self.counts['requests'] += 1
+            roll = self.random.random()
+            for outcome, rate, counter in (('throttle', self.throttle_rate, 'throttled'),
+                                           ('error', self.error_rate, 'errors'),
+                                           ('truncate', self.truncate_rate, 'truncated')):
+                if roll < rate:
+                    self.counts[counter] += 1
+                    return outcome
+                roll -= rate
+            return 'ok'
+
+    def cached_tokens(self, text):
+        """Tokens at the start of `text` that an earlier request also started with, counted like a provider prefix cache."""
+        block_chars = PREFIX_CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN
+        digest = hashlib.blake2b(digest_size=16)
+        keys = []
+        for end in range(block_chars, len(text) + 1, block_chars):
+            digest.update(text[end - block_chars:end].encode('utf-8'))
+            keys.append(digest.digest())
+        with self.lock:
+            blocks = 0
+            for key in keys:
+                if key not in self.prefixes:
+                    break
+                blocks += 1
+            self.prefixes.update(keys)
+        tokens = blocks * PREFIX_CACHE_BLOCK_TOKENS
+        return tokens if tokens >= PREFIX_CACHE_MIN_TOKENS else 0
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None # Set on the subclass created by start_mock_llm
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        config = self.config
+        outcome = config.draw()
+        if outcome == 'throttle':
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit reached (mock)."}},
+                            {'Retry-After': str(config.retry_after)})
+            return
+        if outcome == 'error':
+            self._send_json(config.random.choice((500, 502, 503)), {"error": {"message": "Injected server error (mock)."}})
+            return
+
+        messages = request.get('messages', [])
+        prompt = "\n".join(m.get('content', '') for m in messages if m.get('role') == 'user')
+        if 'You are completing ONE slide' in prompt:
+            position = re.search(r'Slide (\d+) of', prompt)
+            text = make_outline(1, first=int(position.group(1)) if position else 1)
+        elif 'writing the speaker notes for ONE slide' in prompt:
+            text = NOTES_FIELDS
+        elif 'creating the **skeleton**' in prompt:
+            text = make_outline(config.slides, notes=False)
+        elif 'Slide Title:' in prompt:
+            # A continuation carries the slides written so far as an assistant turn
+            written = sum(m.get('content', '').count('Slide Title:') for m in messages if m.get('role') == 'assistant')
+            text = make_outline(config.slides - written if written else config.slides, first=written + 1)
+        else:
+            text = make_summary(prompt)
+        finish_reason = 'stop'
+        if outcome == 'truncate':
+            text = text[:len(text) * 2 // 3]
+            finish_reason = 'length'
+        full_prompt = "\n".join(m.get('content', '') for m in request.get('messages', []))
+        usage = {"prompt_tokens": len(full_prompt) // CHARS_PER_TOKEN + 1, "completion_tokens": len(text) // CHARS_PER_TOKEN + 1,
+                 "prompt_tokens_details": {"cached_tokens": config.cached_tokens(full_prompt)}}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        with config.lock:
+            config.counts['prompt_tokens'] += usage["prompt_tokens"]
+            config.counts['cached_tokens'] += usage["prompt_tokens_details"]["cached_tokens"]
+
+        time.sleep(config.latency)
+        if not request.get('stream'):
+            time.sleep(usage["completion_tokens"] / config.tokens_per_second)
+            self._send_json(200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                               "finish_reason": finish_reason}], "usage": usage})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        step = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+        try:
+            self.wfile.write(b'data: {"choices":[],"prompt_filter_results":[]}\n\n')
+            for i in range(0, len(text), step):
+                chunk = {"choices": [{"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(STREAM_CHUNK_TOKENS / config.tokens_per_second)
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass # Client gave up (timeout or cancellation)
+        self.close_connection = True
+
+
+def start_mock_llm(config, host='127.0.0.1', port=0):
+    """Serves the mock endpoint on a daemon thread. Returns (server, endpoint URL)."""
+    handler = type('ConfiguredMockLLMHandler', (MockLLMHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/chat"
+
+
+def add_mock_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=150.0, help="output token rate")
+    parser.add_argument('--slides', type=int, default=12, help="slides per generated outline")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with a 5xx")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help="fraction of responses cut short with finish_reason 'length'")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_args(args):
+    return MockLLMConfig(args.latency, args.tokens_per_second, args.slides, args.error_rate, args.throttle_rate,
+                         args.truncate_rate, args.retry_after, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    config = config_from_args(args)
+    server, url = start_mock_llm(config, args.host, args.port)
+    print(f"Mock chat-completions endpoint: {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"Requests served: {config.counts}")
+
+
+if __name__ == '__main__':
+    main()
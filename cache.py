@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed on-disk cache with size- and age-bounded LRU eviction."""
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+
+DIGEST_CHUNK_BYTES = 1024 * 1024
+
+
+def make_cache_key(*parts):
+    """Hashes the given parts (str or bytes) into a stable hex key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big')) # Length prefix keeps ('ab', 'c') distinct from ('a', 'bc')
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def file_digest(source):
+    """SHA-256 hex digest of a path or a seekable binary file object (which is rewound afterwards)."""
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK_BYTES), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(DIGEST_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Stores byte blobs as `<key>.<kind>` files under `directory`.
+
+    A file's mtime doubles as its last-access time: reads touch it, and eviction removes
+    entries older than `max_age` seconds first, then least recently used ones until the
+    directory fits in `max_bytes`. Hit/miss counters are kept per kind for this process.
+    """
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._stats = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, kind):
+        return os.path.join(self.directory, f"{key}.{kind}")
+
+    def _count(self, kind, outcome):
+        with self._lock:
+            counters = self._stats.setdefault(kind, {'hits': 0, 'misses': 0})
+            counters[outcome] += 1
+
+    def get(self, key, kind):
+        """Returns the cached bytes, or None on a miss or expired entry."""
+        path = self._path(key, kind)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                self._remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            self._count(kind, 'misses')
+            return None
+        except OSError as e:
+            logging.warning(f"Cache read failed for '{path}': {e}")
+            self._count(kind, 'misses')
+            return None
+        self._count(kind, 'hits')
+        return data
+
+    def put(self, key, kind, data):
+        """Atomically writes an entry, then evicts to stay within the configured bounds."""
+        path = self._path(key, kind)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Cache write failed for '{path}': {e}")
+            if tmp_path is not None:
+                self._remove(tmp_path) # A failed write or rename would otherwise leave it behind for good
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries, then the least recently used until under `max_bytes`."""
+        entries = []
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue # Removed concurrently
+                if now - st.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            self._remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Cache eviction failed for '{path}': {e}")
+
+    def stats(self):
+        """Returns per-kind hit/miss counters for this process."""
+        with self._lock:
+            return {kind: dict(counters) for kind, counters in self._stats.items()}
+
+
+class ExtractionCache:
+    """Extracted document text on a DiskCache, keyed by the upload's SHA-256 and the extractor version.
+
+    Entries are zlib-compressed JSON holding the text and its extraction stats. Extraction can
+    stop at a character budget, so an entry only serves requests whose budget it covers: either
+    the whole document was read, or it was read up to a budget at least as large.
+    """
+    KIND = 'text.z'
+
+    def __init__(self, disk_cache):
+        self.disk_cache = disk_cache
+        self._lock = threading.Lock()
+        self._short = 0
+
+    @staticmethod
+    def _key(digest, extractor_version):
+        return make_cache_key('extraction', extractor_version, digest)
+
+    def get(self, digest, extractor_version, char_budget=None):
+        """Returns (text, stats) for the document, or None if there is no entry covering `char_budget`."""
+        data = self.disk_cache.get(self._key(digest, extractor_version), self.KIND)
+        if data is None:
+            return None
+        try:
+            entry = json.loads(zlib.decompress(data).decode('utf-8'))
+        except (zlib.error, ValueError) as e:
+            logging.warning(f"Discarding unreadable extraction cache entry for {digest}: {e}")
+            return None
+        stats = entry['stats']
+        if stats.get('budget_reached') and (not char_budget or entry['char_budget'] < char_budget):
+            with self._lock:
+                self._short += 1 # Stored text stops short of what this request may need
+            return None
+        return entry['text'], stats
+
+    def put(self, digest, extractor_version, char_budget, text, stats):
+        entry = {"char_budget": char_budget or 0, "text": text, "stats": stats}
+        self.disk_cache.put(self._key(digest, extractor_version), self.KIND, zlib.compress(json.dumps(entry).encode('utf-8'), 6))
+
+    def stats(self):
+        """Hit/miss counters for this process; entries read up to a smaller budget count as misses (`too_short`)."""
+        counters = self.disk_cache.stats().get(self.KIND, {'hits': 0, 'misses': 0})
+        with self._lock:
+            short = self._short
+        return {'hits': counters['hits'] - short, 'misses': counters['misses'] + short, 'too_short': short}
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Cooperative cancellation of presentation jobs.
+
+A job is cancelled explicitly (DELETE /jobs/<id>), or when the browser following it goes
+away: its events stream broke off and was not reopened within a grace period. Either way
+the request is recorded on the job, so with the SQLite store any process can cancel a job
+that another process is running.
+
+The worker running a job holds a CancelToken, which reads that record at most every
+`interval` seconds. The pipeline checks the token at every stage change and on every line
+of a streamed LLM response, and LLM calls check it before they are sent and while they wait
+for the LLM governor's capacity; a check that finds the job cancelled raises JobCancelled.
+Leaving a streamed response early closes its connection, which stops the generation at the
+provider. A non-streamed call that is already
+in flight cannot be interrupted; the job stops at the first check after it returns.
+
+JobCostModel estimates what a cancellation saved: the rest of an average job's run time,
+and the outline call's tokens that were never sent or never generated.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+CANCEL_MESSAGES = {
+    'request': "The job was cancelled.",
+    'disconnect': "The job was cancelled because the browser following it disconnected.",
+}
+COST_WEIGHT = 0.2 # Weight of each finished job in the cost moving averages
+
+# Outline call states recorded on a token, for estimating the tokens a cancellation saves
+OUTLINE_PENDING = 'pending'
+OUTLINE_SENT = 'sent'
+OUTLINE_DONE = 'done'
+
+
+class JobCancelled(Exception):
+    """Raised in a job's pipeline once the job has been cancelled; `trigger` is 'request' or 'disconnect'.
+
+    `details` (stage reached, estimated savings) is recorded on the job as its 'cancellation'.
+    """
+
+    def __init__(self, trigger):
+        super().__init__(CANCEL_MESSAGES.get(trigger, CANCEL_MESSAGES['request']))
+        self.trigger = trigger
+        self.details = {"trigger": trigger}
+
+
+_local = threading.local()
+
+
+class CancelToken:
+    """Whether a job has been cancelled, asking `poll()` at most every `interval` seconds.
+
+    `poll()` returns the trigger once the job is cancelled and None otherwise. The token also
+    records how far the job got (stage, outline call state, streamed characters) so the
+    savings of a cancellation can be estimated.
+    """
+
+    def __init__(self, poll, interval=0.5):
+        self._poll = poll
+        self.interval = interval
+        self.trigger = None
+        self.stage = 'queued'
+        self.outline = OUTLINE_PENDING
+        self.streamed_chars = 0
+        self.started = time.monotonic()
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def cancelled(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.trigger is None and (self._checked_at is None or now - self._checked_at >= self.interval):
+                self._checked_at = now
+                self.trigger = self._poll()
+            return self.trigger is not None
+
+    def check(self):
+        """Raises JobCancelled if the job has been cancelled."""
+        if self.cancelled():
+            raise JobCancelled(self.trigger)
+
+    @contextmanager
+    def activate(self):
+        """Makes this the token returned by current_cancel_token() in this thread."""
+        previous = getattr(_local, 'token', None)
+        _local.token = self
+        try:
+            yield self
+        finally:
+            _local.token = previous
+
+    def bind(self, fn):
+        """Wraps `fn` so that it runs with this token active, e.g. in a thread pool's threads."""
+        def bound(*args, **kwargs):
+            with self.activate():
+                return fn(*args, **kwargs)
+        return bound
+
+
+NULL_TOKEN = CancelToken(lambda: None, interval=float('inf'))
+
+
+def current_cancel_token():
+    """The token activated in this thread, or NULL_TOKEN (never cancelled)."""
+    return getattr(_local, 'token', None) or NULL_TOKEN
+
+
+class JobCostModel:
+    """Moving averages of what finished jobs cost: run time, and the outline call's prompt and completion tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._averages = {} # 'seconds' / 'prompt_tokens' / 'completion_tokens' -> moving average
+
+    def _observe(self, name, value):
+        previous = self._averages.get(name)
+        self._averages[name] = value if previous is None else previous + COST_WEIGHT * (value - previous)
+
+    def observe_job(self, seconds):
+        with self._lock:
+            self._observe('seconds', seconds)
+
+    def observe_outline(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self._observe('prompt_tokens', prompt_tokens)
+            self._observe('completion_tokens', completion_tokens)
+
+    def savings(self, token, chars_per_token):
+        """Estimated (seconds, tokens) saved by cancelling a job; None where nothing is known yet.
+
+        `token` is the running job's CancelToken, or None for a job that had not started.
+        """
+        with self._lock:
+            averages = dict(self._averages)
+        elapsed = time.monotonic() - token.started if token is not None else 0.0
+        outline = token.outline if token is not None else OUTLINE_PENDING
+        seconds = None
+        if 'seconds' in averages:
+            seconds = round(max(0.0, averages['seconds'] - elapsed), 3)
+        tokens = None
+        if outline == OUTLINE_DONE:
+            tokens = 0
+        elif 'completion_tokens' in averages:
+            streamed_tokens = token.streamed_chars / chars_per_token if token is not None else 0
+            tokens = max(0, round(averages['completion_tokens'] - streamed_tokens))
+            if outline == OUTLINE_PENDING:
+                tokens += round(averages['prompt_tokens'])
+        return seconds, tokens
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Map-reduce helpers for documents too large for a single outline prompt.
+
+The document is split into chunks on page/section/paragraph boundaries, each chunk is
+summarized by an independent LLM call (in parallel, bounded by a worker limit), and the
+ordered summaries are merged into the text used for the final outline pass.
+"""
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Lines that look like section headings make preferred chunk boundaries
+HEADING_PATTERN = re.compile(
+    r'^(?:(?i:chapter|section|part|appendix)\b.*|\d+(?:\.\d+)*\.?\s+\S.*|[A-Z][A-Z0-9 ,&:\-]{3,80})$'
+)
+
+
+def _is_heading(line):
+    line = line.strip()
+    return 0 < len(line) <= 100 and bool(HEADING_PATTERN.match(line)) and not line.endswith('.')
+
+
+def _split_long_paragraph(paragraph, chunk_chars):
+    """Hard-splits a single oversized paragraph on whitespace."""
+    pieces = []
+    while len(paragraph) > chunk_chars:
+        cut = paragraph.rfind(' ', 0, chunk_chars)
+        if cut <= 0:
+            cut = chunk_chars # No whitespace at all: cut mid-token as a last resort
+        pieces.append(paragraph[:cut].strip())
+        paragraph = paragraph[cut:].strip()
+    if paragraph:
+        pieces.append(paragraph)
+    return pieces
+
+
+def split_document(text, chunk_chars):
+    """Splits text into chunks of at most `chunk_chars`, breaking on boundaries where possible.
+
+    Form feeds (page breaks) always end a chunk once it is half full; headings end it once it
+    is half full; otherwise chunks are packed paragraph by paragraph.
+    """
+    chunks = []
+    current = []
+    current_len = 0
+    min_fill = chunk_chars // 2
+
+    def flush():
+        nonlocal current, current_len
+        if current:
+            chunks.append('\n'.join(current))
+        current, current_len = [], 0
+
+    for page in text.split('\f'):
+        for line in page.split('\n'):
+            if not line.strip():
+                continue
+            for piece in _split_long_paragraph(line, chunk_chars):
+                if current and (current_len + len(piece) + 1 > chunk_chars or (current_len >= min_fill and _is_heading(piece))):
+                    flush()
+                current.append(piece)
+                current_len += len(piece) + 1
+        if current_len >= min_fill:
+            flush() # Page boundary
+    flush()
+    return chunks
+
+
+def build_chunk_summary_prompt(chunk_text, index, total, audience="", tone=""):
+    """Builds the map-step prompt asking for a dense, fact-preserving summary of one chunk."""
+    context = []
+    if audience: context.append(f"The final presentation targets: {audience}.")
+    if tone: context.append(f"The desired tone is: {tone}.")
+    context_str = " ".join(context)
+    return f"""
+You are preparing source material for a presentation outline. Below is part {index} of {total} of a longer document.
+{context_str}
+
+Summarize this part so that a later step can build slides from the summaries of all parts:
+- Keep section headings and the order in which topics appear.
+- Preserve key facts, figures, dates, names, decisions and recommendations verbatim where possible.
+- Use concise bullet points ('- '), grouped under the headings they belong to.
+- Do not add an introduction or conclusion and do not invent content.
+
+**Document Part {index} of {total}:**
+\"\"\"
+{chunk_text}
+\"\"\"
+"""
+
+
+def merge_summaries(summaries):
+    """Joins ordered chunk summaries into the source text for the final outline pass."""
+    total = len(summaries)
+    return "\n\n".join(f"[Summary of document part {i} of {total}]\n{summary.strip()}"
+                       for i, summary in enumerate(summaries, start=1))
+
+
+def summarize_chunks(chunks, summarize, max_workers):
+    """Runs `summarize(chunk, index, total)` over all chunks with at most `max_workers` in flight.
+
+    Returns (summaries in document order, per-chunk stats list). On the first failure, queued
+    chunks are cancelled and the error is re-raised once in-flight calls have finished.
+    """
+    total = len(chunks)
+
+    def run(index, chunk):
+        started = time.monotonic()
+        summary = summarize(chunk, index, total)
+        elapsed = time.monotonic() - started
+        logging.info(f"Chunk {index}/{total} summarized in {elapsed:.1f}s ({len(chunk)} -> {len(summary)} chars).")
+        return summary, {"index": index, "chars": len(chunk), "summary_chars": len(summary), "seconds": round(elapsed, 3)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total)), thread_name_prefix='chunk') as executor:
+        futures = [executor.submit(run, i, chunk) for i, chunk in enumerate(chunks, start=1)]
+        try:
+            results = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel() # Don't start chunks that are still queued
+            raise
+    return [summary for summary, _ in results], [stats for _, stats in results]
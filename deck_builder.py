@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""Builds the PowerPoint deck from parsed slide dicts.
+
+The widescreen base presentation (including its notes master) is created once per process
+and kept as .pptx bytes; every deck is opened from that copy. Layout positions and
+placeholder indices are resolved from the base once, and each theme's paragraph/run
+formatting is precomputed as `<a:pPr>`/`<a:rPr>` elements that are copied onto new text
+instead of being set property by property.
+"""
+import logging
+import threading
+from copy import deepcopy
+from io import BytesIO
+
+from pptx import Presentation
+from pptx.util import Inches, Pt
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
+from pptx.text.text import _Paragraph
+from pptx.enum.text import MSO_ANCHOR, PP_PARAGRAPH_ALIGNMENT
+from pptx.dml.color import RGBColor
+from pptx.enum.shapes import MSO_SHAPE
+
+from slide_parser import DEFAULT_SUGGESTION
+
+SLIDE_WIDTH = Inches(13.333) # 16:9 aspect ratio (Widescreen)
+SLIDE_HEIGHT = Inches(7.5)
+TITLE_LAYOUT = 0 # Layout 0 is typically Title Slide
+CONTENT_LAYOUT = 1 # Layout 1 (Title and Content) is the default for content slides
+ERROR_LAYOUT = 5 # Layout 5 is often Title Only or Blank
+
+# Visual placeholder position/size on content slides (right side)
+VISUAL_BOX = (Inches(7.0), Inches(1.8), Inches(5.5), Inches(4.5))
+# Visual suggestions that mean "no visual"
+NO_VISUAL_PHRASES = {"none", "none needed", "text focus", "n/a", "text only", "no visual needed", ""}
+VISUAL_FILL_COLOR = RGBColor(240, 240, 240) # Light gray background
+MISSING_SUGGESTION_COLOR = RGBColor(128, 128, 128) # Color for "(Suggestion not generated...)" text
+
+
+class TextStyle:
+    """Paragraph and run properties computed once and copied onto each new run.
+
+    The elements are produced by python-pptx itself on a scratch paragraph, so the XML is the
+    same as setting the properties on every run.
+    """
+
+    __slots__ = ('_pPr', '_rPr')
+
+    def __init__(self, size, bold=False, italic=False, color=None, alignment=None, space_after=None, level=None):
+        paragraph = _Paragraph(parse_xml(f'<a:p {nsdecls("a")}><a:r><a:t/></a:r></a:p>'), None)
+        font = paragraph.runs[0].font
+        font.size = size
+        if bold: font.bold = True
+        if italic: font.italic = True
+        if color is not None: font.color.rgb = color
+        if level is not None: paragraph.level = level
+        if alignment is not None: paragraph.alignment = alignment
+        if space_after is not None: paragraph.space_after = space_after
+        self._pPr = paragraph._p.pPr # None when no paragraph property was set
+        self._rPr = paragraph._p.r_lst[0].rPr
+
+    def add_run(self, paragraph, text):
+        """Appends a run with `text` to `paragraph`, applying the paragraph properties as well."""
+        p = paragraph._p
+        if self._pPr is not None:
+            if p.pPr is not None:
+                p.remove(p.pPr)
+            p.insert(0, deepcopy(self._pPr))
+        r = p.add_r()
+        r.insert(0, deepcopy(self._rPr))
+        r.text = text
+
+    def add_paragraph(self, text_frame, text):
+        self.add_run(text_frame.add_paragraph(), text)
+
+
+class ThemeStyles:
+    """All text styles for one entry of TEMPLATES."""
+
+    def __init__(self, template):
+        title_color = template['title_color']
+        accent_color = template['accent_color']
+        text_color = template['text_color']
+        suggestion_color = template.get('notes_suggestion_color', RGBColor(80, 80, 80)) # Default gray if not in template
+        center = PP_PARAGRAPH_ALIGNMENT.CENTER
+        self.template = template
+        self.cover_title = TextStyle(Pt(44), bold=True, color=title_color, alignment=center)
+        self.cover_subtitle = TextStyle(Pt(24), color=accent_color, alignment=center)
+        self.slide_title = TextStyle(Pt(32), bold=True, color=title_color)
+        self.key_message = TextStyle(Pt(20), bold=True, italic=True, color=accent_color, space_after=Pt(10))
+        self.bullet = TextStyle(Pt(18), color=text_color, level=0)
+        self.notes_heading = TextStyle(Pt(11), bold=True, space_after=Pt(2))
+        self.notes_suggestion_heading = TextStyle(Pt(11), bold=True, color=suggestion_color, space_after=Pt(2))
+        self.notes_body = TextStyle(Pt(10), level=1, space_after=Pt(6))
+        self.notes_suggestion = TextStyle(Pt(10), italic=True, color=suggestion_color, level=1, space_after=Pt(6))
+        self.notes_missing_suggestion = TextStyle(Pt(10), italic=True, color=MISSING_SUGGESTION_COLOR, level=1, space_after=Pt(6))
+        self.visual_title = TextStyle(Pt(14), bold=True, color=template.get('accent_color', RGBColor(0, 0, 0)),
+                                      alignment=center, space_after=Pt(6))
+        self.visual_description = TextStyle(Pt(12), color=template.get('text_color', RGBColor(51, 51, 51)), alignment=center)
+        self.visual_border = template.get('accent_color', RGBColor(128, 128, 128))
+
+
+class LayoutIndex:
+    """Placeholder indices resolved once from the base presentation's layouts."""
+
+    __slots__ = ('subtitle_idx', 'content_idx')
+
+    def __init__(self, prs):
+        self.subtitle_idx = self._body_idx(prs.slide_layouts[TITLE_LAYOUT])
+        self.content_idx = self._body_idx(prs.slide_layouts[CONTENT_LAYOUT])
+
+    @staticmethod
+    def _body_idx(layout):
+        """idx of the placeholder that receives body text: idx 1, else the largest non-title one."""
+        candidates = [ph for ph in layout.iter_cloneable_placeholders() if ph.placeholder_format.idx != 0]
+        if any(ph.placeholder_format.idx == 1 for ph in candidates):
+            return 1
+        if not candidates:
+            return None
+        return max(candidates, key=lambda ph: (ph.width or 0) * (ph.height or 0)).placeholder_format.idx
+
+
+def _placeholder(slide, idx):
+    if idx is None:
+        return None
+    try:
+        return slide.placeholders[idx]
+    except KeyError:
+        return None
+
+
+class DeckBuilder:
+    """Creates presentations from a per-process base template and precomputed theme styles."""
+
+    def __init__(self, templates, default_template='professional'):
+        self.themes = {name: ThemeStyles(template) for name, template in templates.items()}
+        self.default_template = default_template
+        self._lock = threading.Lock()
+        self._base = None # (pptx bytes, LayoutIndex), built on first use
+
+    def _base_template(self):
+        with self._lock:
+            if self._base is None:
+                prs = Presentation()
+                prs.slide_width = SLIDE_WIDTH
+                prs.slide_height = SLIDE_HEIGHT
+                prs.notes_master # Creates the notes master now instead of once per deck
+                buffer = BytesIO()
+                prs.save(buffer)
+                self._base = (buffer.getvalue(), LayoutIndex(prs))
+            return self._base
+
+    def new_presentation(self):
+        """Returns (a fresh copy of the base presentation, its LayoutIndex)."""
+        data, index = self._base_template()
+        return Presentation(BytesIO(data)), index
+
+    def build(self, slides_data, template_name=None):
+        """Builds and returns an unsaved Presentation for the parsed slides."""
+        styles = self.themes.get(template_name) or self.themes[self.default_template] # Fallback to default template
+        prs, index = self.new_presentation()
+        layouts = prs.slide_layouts
+
+        # --- Title Slide ---
+        if slides_data:
+            try:
+                self._add_title_slide(prs, layouts[TITLE_LAYOUT], index, slides_data[0], styles)
+            except Exception as e:
+                logging.error(f"Critical Error creating Title Slide: {e}", exc_info=True)
+                # Consider adding a generic title slide if the first one fails critically
+                try:
+                    slide = prs.slides.add_slide(layouts[TITLE_LAYOUT])
+                    title = slide.shapes.title
+                    if title: title.text = "Presentation (Title Generation Error)"
+                except Exception as fallback_e:
+                    logging.error(f"Failed to add fallback title slide: {fallback_e}")
+
+        # --- Content Slides ---
+        content_layout = layouts[CONTENT_LAYOUT]
+        for idx, slide_data in enumerate(slides_data[1:]): # Iterate starting from the second item
+            slide_num_for_logging = idx + 2 # User-facing slide number (starts from 2)
+            slide_title_for_error = slide_data.get('title', f'Untitled Slide {slide_num_for_logging}')
+            try:
+                self._add_content_slide(prs, content_layout, index, slide_data, styles, slide_num_for_logging)
+            except Exception as e:
+                # Log the error with specific slide context
+                logging.error(f"Error processing content slide {slide_num_for_logging} ('{slide_title_for_error}'): {e}", exc_info=True)
+                self._add_error_slide(prs, layouts[ERROR_LAYOUT], slide_num_for_logging, slide_title_for_error, e)
+        return prs
+
+    def _add_title_slide(self, prs, layout, index, slide_data, styles):
+        slide = prs.slides.add_slide(layout)
+        title = slide.shapes.title # Get the title placeholder shape
+        subtitle = _placeholder(slide, index.subtitle_idx)
+
+        # Set Title Text
+        title_text = slide_data.get('title', 'Presentation') # Default title
+        if title and title.has_text_frame:
+            tf = title.text_frame; tf.clear()
+            styles.cover_title.add_run(tf.paragraphs[0], title_text) # Centered horizontally
+            tf.vertical_anchor = MSO_ANCHOR.MIDDLE # Center vertically
+        elif title: # Fallback if title shape exists but no text frame
+            title.text = title_text
+
+        # Set Subtitle Text (Using Key Message)
+        subtitle_text = slide_data.get('key_message', '').strip()
+        if subtitle and subtitle.has_text_frame:
+            tf = subtitle.text_frame; tf.clear()
+            if subtitle_text:
+                styles.cover_subtitle.add_run(tf.paragraphs[0], subtitle_text)
+                tf.vertical_anchor = MSO_ANCHOR.TOP # Align subtitle towards top
+            else:
+                tf.text = "" # Ensure empty if no text provided
+        elif subtitle: # Fallback if subtitle shape exists but no text frame
+            try: subtitle.text = subtitle_text
+            except AttributeError: logging.warning("Subtitle placeholder on title slide lacks text frame and direct text setting failed.")
+
+        # Add notes for the title slide
+        add_formatted_notes(slide.notes_slide.notes_text_frame, slide_data, styles)
+
+    def _add_content_slide(self, prs, layout, index, slide_data, styles, slide_num_for_logging):
+        slide_title_for_error = slide_data.get('title', f'Untitled Slide {slide_num_for_logging}')
+        slide = prs.slides.add_slide(layout)
+        title_shape = slide.shapes.title
+        content_placeholder = _placeholder(slide, index.content_idx)
+
+        # Set Slide Title
+        title_text = slide_data.get('title', f'Slide {slide_num_for_logging}')
+        if title_shape and title_shape.has_text_frame:
+            tf = title_shape.text_frame; tf.clear()
+            styles.slide_title.add_run(tf.paragraphs[0], title_text)
+        elif title_shape:
+            title_shape.text = title_text
+
+        # Populate Content Placeholder
+        if content_placeholder and content_placeholder.has_text_frame:
+            tf = content_placeholder.text_frame; tf.clear()
+            tf.word_wrap = True; tf.vertical_anchor = MSO_ANCHOR.TOP
+
+            # Add Key Message (Formatted differently, optional)
+            key_message = slide_data.get('key_message', '').strip()
+            if key_message:
+                styles.key_message.add_paragraph(tf, key_message)
+
+            # Add Bullets
+            for bullet_text in slide_data.get('bullets', []):
+                bullet_text = bullet_text.strip()
+                if bullet_text:
+                    styles.bullet.add_paragraph(tf, bullet_text)
+
+            # Add Visual Placeholder if suggested
+            visual_suggestion = slide_data.get('visual', '').strip()
+            if visual_suggestion and visual_suggestion.lower() not in NO_VISUAL_PHRASES:
+                add_visual_placeholder(slide, visual_suggestion, styles, *VISUAL_BOX)
+
+        elif content_placeholder:
+            logging.warning(f"Content placeholder found on slide {slide_num_for_logging} ('{slide_title_for_error}') but it lacks a text frame.")
+        else:
+            logging.warning(f"No suitable content placeholder found on slide {slide_num_for_logging} ('{slide_title_for_error}'). Content may be missing.")
+
+        # Add formatted notes to the notes slide page
+        add_formatted_notes(slide.notes_slide.notes_text_frame, slide_data, styles)
+
+    @staticmethod
+    def _add_error_slide(prs, layout, slide_num_for_logging, slide_title_for_error, e):
+        """Adds a placeholder slide explaining why slide generation failed."""
+        try:
+            error_slide = prs.slides.add_slide(layout)
+            title_shape = error_slide.shapes.title
+            if title_shape: title_shape.text = f"Error Generating Slide {slide_num_for_logging}"
+
+            # Add a textbox explaining the error
+            left, top, width, height = Inches(1), Inches(1.5), Inches(11), Inches(5)
+            txBox = error_slide.shapes.add_textbox(left, top, width, height)
+            tf_err = txBox.text_frame; tf_err.word_wrap = True
+            tf_err.text = f"Failed to generate content for slide:\n'{slide_title_for_error}'\n\nError Details:\n{str(e)[:500]}{'...' if len(str(e)) > 500 else ''}"
+            # Basic formatting for error text
+            for p in tf_err.paragraphs:
+                if p.runs: p.runs[0].font.size = Pt(14)
+
+            logging.info(f"Added error placeholder slide for failed slide {slide_num_for_logging}")
+
+        except Exception as inner_e:
+            logging.critical(f"CRITICAL FAILURE: Could not add error placeholder slide for slide {slide_num_for_logging}. Inner Exception: {inner_e}")
+
+
+# Order and titles of notes sections: (title, slide key, is_suggestion)
+NOTES_SECTIONS = (
+    ("Speaker Notes:", "notes", False),
+    ("Elaboration / Talking Points:", "elaboration", False), # Treat elaboration as core content
+    ("💡 Enhancement Suggestion:", "enhancement_suggestion", True),
+    ("⭐ Best Practice Tip:", "best_practice_tip", True),
+)
+
+
+def add_formatted_notes(notes_text_frame, slide_data, styles):
+    """Adds structured and formatted notes to the notes slide page."""
+    notes_text_frame.clear()
+    for title, content_key, is_suggestion in NOTES_SECTIONS:
+        content = slide_data.get(content_key, '').strip()
+        if not content and not is_suggestion: continue # Skip empty non-suggestion sections
+
+        if not is_suggestion:
+            styles.notes_heading.add_paragraph(notes_text_frame, title)
+            styles.notes_body.add_paragraph(notes_text_frame, content)
+        elif not content or content == DEFAULT_SUGGESTION:
+            styles.notes_suggestion_heading.add_paragraph(notes_text_frame, title)
+            styles.notes_missing_suggestion.add_paragraph(notes_text_frame, "(Suggestion not generated by AI)")
+        else:
+            styles.notes_suggestion_heading.add_paragraph(notes_text_frame, title)
+            styles.notes_suggestion.add_paragraph(notes_text_frame, content)
+
+
+def add_visual_placeholder(slide, visual_desc, styles, left, top, width, height):
+    """Adds a styled placeholder shape with the visual suggestion text."""
+    # Truncate long descriptions to fit reasonably
+    description = visual_desc[:250] + ('...' if len(visual_desc) > 250 else '') if visual_desc else "N/A"
+    try:
+        shape = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, left, top, width, height)
+
+        # Style the placeholder shape
+        shape.fill.solid()
+        shape.fill.fore_color.rgb = VISUAL_FILL_COLOR
+        shape.line.color.rgb = styles.visual_border # Border uses accent color
+        shape.line.width = Pt(1.5)
+        shape.shadow.inherit = False # Disable default shadow
+
+        # Configure text frame properties
+        tf = shape.text_frame
+        tf.margin_bottom = Inches(0.1); tf.margin_left = Inches(0.1)
+        tf.margin_right = Inches(0.1); tf.margin_top = Inches(0.1)
+        tf.vertical_anchor = MSO_ANCHOR.MIDDLE # Center text vertically
+        tf.word_wrap = True
+        tf.clear()
+
+        styles.visual_title.add_paragraph(tf, "Suggested Visual:")
+        styles.visual_description.add_paragraph(tf, description)
+
+    except Exception as e:
+        logging.error(f"Failed to create styled visual placeholder: {e}", exc_info=True)
+        # Fallback: Add a simple text box if shape fails
+        try:
+            # Slightly inset fallback box
+            fb_left, fb_top = left + Inches(0.1), top + Inches(0.1)
+            fb_width, fb_height = width - Inches(0.2), height - Inches(0.2)
+            txBox = slide.shapes.add_textbox(fb_left, fb_top, fb_width, fb_height)
+            tf_fb = txBox.text_frame; tf_fb.word_wrap = True; tf_fb.vertical_anchor = MSO_ANCHOR.MIDDLE
+
+            p_fb = tf_fb.add_paragraph()
+            # Combine title and description in fallback
+            p_fb.text = f"Visual Suggestion:\n{visual_desc[:250]}{'...' if len(visual_desc) > 250 else ''}"
+            p_fb.font.size = Pt(11)
+            p_fb.font.color.rgb = styles.template.get('text_color', RGBColor(51, 51, 51))
+            p_fb.alignment = PP_PARAGRAPH_ALIGNMENT.CENTER
+            logging.warning("Added fallback text box for visual suggestion due to shape error.")
+        except Exception as fallback_e:
+            logging.critical(f"CRITICAL: Failed even to add fallback text box for visual: {fallback_e}")
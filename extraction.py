@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""Document text extraction engines.
+
+PDF pages are streamed one at a time so extraction can stop as soon as the character budget
+is reached. PDFs read under a time limit are read in a long-lived process pool shared by the
+process's jobs: large ones fan page ranges out to its processes (PyPDF2 is pure Python, so
+threads would serialize on the GIL), small ones are one task. The parent stops waiting at the
+deadline, so the limit is hard even if a single page hangs; a document that times out retires
+the pool, which is terminated (killing the stuck page) once no other document is using it.
+
+DOCX text is read straight from the main document part (word/document.xml) with an
+incremental XML parser instead of building python-docx's object model. Paragraphs and table
+rows come out in document order, each row as one line of ' | '-separated cells, and reading
+stops once the character budget is reached. Parsed elements are cleared as soon as their text
+has been taken, so memory stays flat however long the document is.
+"""
+import io
+import time
+import atexit
+import logging
+import posixpath
+import zipfile
+import threading
+import multiprocessing
+from contextlib import contextmanager
+import xml.etree.ElementTree as ET
+
+from PyPDF2 import PdfReader, __version__ as PYPDF2_VERSION
+
+
+# Part of the extraction cache key: bump it whenever a change alters the text extracted from the same file
+EXTRACTOR_VERSION = '2'
+
+
+def extractor_version(file_ext, docx_engine='stream'):
+    """Identifies the code that extracts a file type, so cached text is not reused across extractor changes."""
+    if file_ext == '.pdf':
+        return f"{EXTRACTOR_VERSION}:pdf:PyPDF2-{PYPDF2_VERSION}"
+    return f"{EXTRACTOR_VERSION}:{file_ext.lstrip('.')}:{docx_engine}"
+
+
+class ExtractionTimeout(Exception):
+    """Raised internally when a document exceeds its extraction time limit."""
+
+
+def iter_pdf_pages(reader, start=0, stop=None, deadline=None):
+    """Yields (page_number, stripped_text, seconds) for pages [start, stop) of an open PdfReader.
+
+    `deadline` is a time.time() value checked before each page.
+    """
+    stop = len(reader.pages) if stop is None else stop
+    for page_no in range(start, stop):
+        if deadline is not None and time.time() > deadline:
+            raise ExtractionTimeout()
+        page_started = time.perf_counter()
+        text = reader.pages[page_no].extract_text() or ''
+        yield page_no, text.strip(), time.perf_counter() - page_started
+
+
+def _extract_page_range(source, start, stop, char_budget, deadline):
+    """Process-pool task: extracts a page range, stopping early at the budget or deadline.
+
+    `source` is a path or the raw PDF bytes (in-memory uploads cannot be shared by path).
+    """
+    pages = []
+    chars = 0
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        for page in iter_pdf_pages(PdfReader(source), start, stop, deadline):
+            pages.append(page)
+            chars += len(page[1])
+            if char_budget and chars >= char_budget:
+                break
+    except ExtractionTimeout:
+        pass # Return what was read; the parent enforces the limit
+    return pages
+
+
+class _PoolGeneration:
+    def __init__(self, workers):
+        # 'spawn' avoids forking a process that has job, cache and HTTP threads running;
+        # recycling processes caps PyPDF2's memory growth
+        self.pool = multiprocessing.get_context('spawn').Pool(processes=workers, maxtasksperchild=PDF_POOL_MAX_TASKS)
+        self.users = 0
+        self.retired = False
+
+
+class PdfProcessPool:
+    """The process pool PDF pages are read in, created on first use and shared by the documents of this process.
+
+    A document that times out may leave a process stuck on a page, and a pool cannot kill one
+    task; so that document retires the pool. New documents get a fresh one, and the retired
+    pool is terminated as soon as the last document using it is done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+        self._live = set() # Generations not yet terminated, the current one included
+
+    @contextmanager
+    def lease(self, workers):
+        """Yields the current multiprocessing pool (of `workers` processes if it has to be created)."""
+        with self._lock:
+            if self._current is None:
+                self._current = _PoolGeneration(workers)
+                self._live.add(self._current)
+            generation = self._current
+            generation.users += 1
+        try:
+            yield generation.pool
+        except ExtractionTimeout:
+            with self._lock:
+                generation.retired = True
+                if self._current is generation:
+                    self._current = None
+            raise
+        finally:
+            with self._lock:
+                generation.users -= 1
+                terminate = generation.retired and generation.users == 0 and generation in self._live
+                if terminate:
+                    self._live.discard(generation)
+            if terminate:
+                generation.pool.terminate() # Kills stragglers, including any stuck on a pathological page
+                generation.pool.join()
+
+    def shutdown(self):
+        """Terminates every pool, even with documents still being read (their waits then time out)."""
+        with self._lock:
+            generations, self._live, self._current = self._live, set(), None
+            for generation in generations:
+                generation.retired = True
+        for generation in generations:
+            generation.pool.terminate()
+            generation.pool.join()
+
+
+PDF_POOL_MAX_TASKS = 100
+pdf_pool = PdfProcessPool()
+# Registered after multiprocessing's own exit handler, so it runs first: terminating a pool from
+# that handler while a job thread still waits on it fails, because its result thread is gone
+atexit.register(pdf_pool.shutdown)
+
+
+def _iter_pages_pooled(source, page_count, workers, char_budget, deadline, range_count):
+    """Yields pages in document order, read as `range_count` page ranges in the shared process pool."""
+    bounds = [page_count * i // range_count for i in range(range_count + 1)]
+    with pdf_pool.lease(workers) as pool:
+        results = [pool.apply_async(_extract_page_range, (source, bounds[i], bounds[i + 1], char_budget, deadline))
+                   for i in range(range_count)]
+        for result in results:
+            try:
+                pages = result.get(timeout=max(0.0, deadline - time.time()) if deadline else None)
+            except multiprocessing.TimeoutError:
+                raise ExtractionTimeout()
+            for page in pages:
+                yield page
+
+
+def extract_pdf_text(source, char_budget=None, time_limit=None, parallel_min_pages=64, max_workers=1):
+    """Extracts text from a PDF path or binary file object, stopping once `char_budget` characters have been collected.
+
+    With a `time_limit`, or at least `parallel_min_pages` pages and `max_workers` above 1, the
+    pages are read in the shared pool of `max_workers` processes; the large PDFs are split into
+    page ranges across its processes. Returns (text, stats). If `time_limit` seconds pass, the text read so far is returned with
+    stats['timed_out'] set; if nothing was read, ValueError is raised.
+    """
+    started = time.perf_counter()
+    deadline = time.time() + time_limit if time_limit else None
+    reader = PdfReader(source)
+    page_count = len(reader.pages)
+    parallel = max_workers > 1 and page_count >= parallel_min_pages
+    if (parallel or deadline is not None) and page_count:
+        if hasattr(source, 'read'):
+            source.seek(0)
+            source = source.read() # Worker processes get the bytes instead of a shared file handle
+        # Several ranges per worker so the earliest pages come back quickly and later ranges can be skipped
+        range_count = min(page_count, max_workers * 4) if parallel else 1
+        pages = _iter_pages_pooled(source, page_count, max(1, max_workers), char_budget, deadline, range_count)
+    else:
+        pages = iter_pdf_pages(reader, deadline=deadline)
+
+    full_text = []
+    total_chars = 0
+    page_times = []
+    timed_out = False
+    try:
+        for page_no, text, seconds in pages:
+            page_times.append((seconds, page_no))
+            if text:
+                full_text.append(text)
+                total_chars += len(text) + 1
+            if char_budget and total_chars >= char_budget:
+                break
+    except ExtractionTimeout:
+        timed_out = True
+    finally:
+        pages.close() # Stops the generator (and releases the pool) when exiting early
+
+    stats = {
+        "pages_total": page_count,
+        "pages_read": len(page_times),
+        "chars": max(0, total_chars - 1),
+        "seconds": round(time.perf_counter() - started, 3),
+        "parallel": parallel,
+        "budget_reached": bool(char_budget) and total_chars >= char_budget,
+        "timed_out": timed_out,
+        "slowest_pages": [{"page": page_no + 1, "seconds": round(seconds, 3)}
+                          for seconds, page_no in sorted(page_times, reverse=True)[:5]],
+    }
+    if timed_out:
+        if not full_text:
+            raise ValueError(f"PDF text extraction exceeded the {time_limit}s time limit before any text was read.")
+        logging.warning(f"PDF extraction hit the {time_limit}s time limit after {len(page_times)}/{page_count} pages; using partial text.")
+    return '\f'.join(full_text), stats # Page breaks let normalization and chunking see page boundaries
+
+
+# --- DOCX ---
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+PACKAGE_RELS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOCX_MAIN_PART = 'word/document.xml'
+DOCX_TABLE_CELL_SEPARATOR = ' | '
+# Run-level elements that stand for characters (as python-docx's Run.text maps them)
+DOCX_RUN_CHARS = {W_NS + 'tab': '\t', W_NS + 'ptab': '\t', W_NS + 'cr': '\n', W_NS + 'noBreakHyphen': '-'}
+DOCX_READ_ERRORS = (zipfile.BadZipFile, zipfile.LargeZipFile, KeyError, ET.ParseError, RuntimeError, NotImplementedError)
+
+
+def _docx_main_part(archive):
+    """Name of the main document part, from the package relationships (word/document.xml in practice)."""
+    try:
+        with archive.open('_rels/.rels') as rels:
+            for rel in ET.parse(rels).getroot().iter(PACKAGE_RELS_NS + 'Relationship'):
+                if rel.get('Type') == OFFICE_DOCUMENT_REL:
+                    return posixpath.normpath(rel.get('Target', DOCX_MAIN_PART).lstrip('/'))
+    except (KeyError, ET.ParseError):
+        pass
+    return DOCX_MAIN_PART
+
+
+def _iter_document_xml(stream):
+    """Yields ('paragraph' | 'row', text) from a WordprocessingML document stream, in document order.
+
+    Paragraphs inside a table are joined into their cell's text; a nested table's text is part of
+    the outer cell. Text boxes are read from their mc:Choice content only (mc:Fallback repeats it).
+    """
+    paragraphs = [] # Text parts of the open paragraphs (text boxes nest paragraphs inside paragraphs)
+    table_depth = 0
+    row_cells = None
+    cell_parts = None
+    fallback_depth = 0
+    depth = 0
+    body = None
+
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            depth += 1
+            if tag == MC_FALLBACK:
+                fallback_depth += 1
+            elif fallback_depth:
+                continue
+            elif tag == W_NS + 'p':
+                paragraphs.append([])
+            elif tag == W_NS + 'tbl':
+                table_depth += 1
+            elif tag == W_NS + 'tr' and table_depth == 1:
+                row_cells = []
+            elif tag == W_NS + 'tc' and table_depth == 1:
+                cell_parts = []
+            elif tag == W_NS + 'body':
+                body = elem
+            continue
+
+        depth -= 1
+        if tag == MC_FALLBACK:
+            fallback_depth -= 1
+            elem.clear()
+        elif fallback_depth:
+            pass
+        elif tag == W_NS + 't':
+            if paragraphs:
+                paragraphs[-1].append(elem.text or '')
+        elif tag in DOCX_RUN_CHARS:
+            if paragraphs:
+                paragraphs[-1].append(DOCX_RUN_CHARS[tag])
+        elif tag == W_NS + 'br':
+            if paragraphs and elem.get(W_NS + 'type', 'textWrapping') == 'textWrapping':
+                paragraphs[-1].append('\n') # Page and column breaks carry no text
+        elif tag == W_NS + 'p':
+            text = ''.join(paragraphs.pop())
+            if text.strip():
+                if cell_parts is not None:
+                    cell_parts.append(text.strip())
+                elif not table_depth:
+                    yield 'paragraph', text
+        elif tag == W_NS + 'tc' and table_depth == 1:
+            row_cells.append(' '.join(cell_parts))
+            cell_parts = None
+        elif tag == W_NS + 'tr' and table_depth == 1:
+            if any(row_cells):
+                yield 'row', DOCX_TABLE_CELL_SEPARATOR.join(row_cells)
+            row_cells = None
+        elif tag == W_NS + 'tbl':
+            table_depth -= 1
+
+        if body is not None and depth == 2:
+            body.clear() # A top-level block is done; drop it (and everything before it) from the tree
+        elif tag == W_NS + 'tr':
+            elem.clear() # Long tables are released row by row
+
+
+def iter_docx_blocks(source):
+    """Yields ('paragraph' | 'row', text) for a .docx path or binary file object, in document order."""
+    with zipfile.ZipFile(source) as archive:
+        with archive.open(_docx_main_part(archive)) as stream:
+            yield from _iter_document_xml(stream)
+
+
+def extract_docx_text(source, char_budget=None):
+    """Extracts the paragraphs and table rows of a .docx, stopping once `char_budget` characters have been collected.
+
+    Returns (text, stats). Raises ValueError for files that are not readable .docx packages.
+    """
+    started = time.perf_counter()
+    full_text = []
+    total_chars = 0
+    counts = {'paragraph': 0, 'row': 0}
+    blocks = iter_docx_blocks(source)
+    try:
+        for kind, text in blocks:
+            counts[kind] += 1
+            full_text.append(text)
+            total_chars += len(text) + 1
+            if char_budget and total_chars >= char_budget:
+                break
+    except DOCX_READ_ERRORS as e:
+        raise ValueError(f"Could not process DOCX file: {e}")
+    finally:
+        blocks.close() # Closes the zip member and archive when stopping early
+    return '\n'.join(full_text), {
+        "engine": "stream",
+        "paragraphs": counts['paragraph'],
+        "table_rows": counts['row'],
+        "chars": max(0, total_chars - 1),
+        "seconds": round(time.perf_counter() - started, 3),
+        "budget_reached": bool(char_budget) and total_chars >= char_budget,
+    }
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Gunicorn production profile: several preloaded worker processes, recycled after a number of requests.
+
+PDF parsing and deck building are CPU-bound and share one GIL per process, so one Waitress
+process with many threads does not use more than one core for them. This profile runs
+GUNICORN_WORKERS processes with GUNICORN_THREADS threads each. The app is imported once in
+the master before forking (preload_app), so the python-pptx/PyPDF2 imports, theme styles,
+the deck builder's base template and the tokenizer are set up once and shared copy-on-write.
+
+Workers restart after about GUNICORN_MAX_REQUESTS requests (with jitter, so they do not all
+restart together), which caps slow memory growth. A restarting or stopping worker first lets
+its running jobs finish; the graceful timeout is derived from LLM_TIMEOUT_SECONDS, so a job
+waiting on the AI service is not killed mid-call.
+
+Jobs must be visible to every worker, so with more than one worker the job queue and the LLM
+governor default to their SQLite backends (JOB_BACKEND / GOVERNOR_BACKEND).
+
+    gunicorn app:app                 # reads this file from the working directory
+    SERVER=gunicorn python run.py
+"""
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv() # The app's .env can configure the server too
+
+# --- Server settings (environment variables) ---
+bind = os.environ.get('GUNICORN_BIND') or f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', os.cpu_count() or 1))
+# Threads keep server-sent event streams and status polls from tying up a whole process
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() in ['true', '1', 't']
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000)) # 0 disables recycling
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+# A stopping worker waits for its jobs' LLM calls (LLM_TIMEOUT_SECONDS each) before exiting; the
+# master only kills a worker that has been silent for `timeout`, so that must cover the wait
+LLM_TIMEOUT_SECONDS = int(os.environ.get('LLM_TIMEOUT_SECONDS', 300))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', LLM_TIMEOUT_SECONDS + 30))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', graceful_timeout + 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None # '-' logs requests to stdout
+
+# Per-process job queues and rate budgets would be invisible to the other workers
+SHARED_BACKENDS = ('JOB_BACKEND', 'GOVERNOR_BACKEND')
+if workers > 1:
+    for name in SHARED_BACKENDS:
+        os.environ.setdefault(name, 'sqlite')
+# Every worker's job threads claim from the shared queue; admission control sizes its limits and Retry-After by the total
+os.environ.setdefault('JOB_PROCESSES', str(workers))
+
+
+# --- Hooks ---
+def on_starting(server):
+    for name in SHARED_BACKENDS:
+        if workers > 1 and os.environ[name] != 'sqlite':
+            server.log.warning(f"{name}={os.environ[name]} with {workers} workers: each worker process keeps its own "
+                               f"state, so job status requests can reach a worker that does not know the job.")
+    server.log.info(f"Profile: {workers} workers x {threads} threads, preload {preload_app}, max requests "
+                    f"{max_requests} (+{max_requests_jitter}), graceful timeout {graceful_timeout}s, timeout {timeout}s.")
+
+
+def when_ready(server):
+    # Runs in the master before the first fork; with preloading the app module is already imported
+    if preload_app:
+        from app import warm_up
+        warm_up()
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        from app import warm_up
+        warm_up()
+
+
+def worker_exit(server, worker):
+    # Let this worker's running jobs finish before it exits (recycling, HUP or shutdown)
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.stop_job_manager(graceful_timeout)
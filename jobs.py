@@ -0,0 +1,574 @@
+# -*- coding: utf-8 -*-
+"""Background job subsystem for presentation generation.
+
+Request threads only enqueue work here; a bounded pool of worker threads claims
+jobs from a pluggable store and runs the pipeline. Two stores are provided:
+an in-process store (single process, nothing persisted) and a SQLite store
+(a local on-disk queue that survives restarts and is shared by every process
+on the host that points at the same database file).
+
+Both stores hand out queued jobs fairly between clients (the job's 'client' field):
+the next job is the oldest one of the client with the fewest running jobs, and among
+those of the client served least recently. Clients therefore take turns, and one that
+queued many documents gets no more workers than one that queued a few.
+
+A SQLite job outlives the process running it, so running rows carry a lease that the
+process renews; when a process crashes or is stopped mid-job, the lease runs out and the
+job is queued again (or failed after JOB_MAX_ATTEMPTS runs) instead of hanging forever.
+"""
+import os
+import json
+import time
+import uuid
+from collections import deque
+import sqlite3
+import logging
+import threading
+
+from cancellation import JobCancelled
+
+# --- Job States ---
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = {JOB_DONE, JOB_FAILED, JOB_CANCELLED}
+
+
+def new_job_id():
+    """Returns a fresh, URL-safe job identifier."""
+    return uuid.uuid4().hex
+
+
+def job_client(job):
+    """The client a job is queued for; jobs submitted without one share a single queue."""
+    return job.get('client') or ''
+
+
+# --- Job Stores ---
+class InProcessJobStore:
+    """Keeps jobs in a dict guarded by a lock; queued ids wait in one FIFO per client."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._pending = {} # client -> deque of queued job ids
+        self._running = {} # client -> running job count
+        self._last_claim = {} # client -> sequence number of its latest claim, while it has jobs
+        self._claims = 0
+
+    def add(self, job, admit=None):
+        """Stores a job; `admit(queued, client_queued)` may raise to refuse it, checked under the same lock."""
+        with self._lock:
+            if admit is not None:
+                admit(self._count(JOB_QUEUED), self._count(JOB_QUEUED, job_client(job)))
+            self._jobs[job['id']] = dict(job)
+            if job['status'] == JOB_QUEUED:
+                self._pending.setdefault(job_client(job), deque()).append(job['id'])
+                self._ready.notify()
+
+    def _next_client(self):
+        """The client whose oldest queued job runs next, or None; drops ids resolved while waiting."""
+        best = None
+        for client, job_ids in list(self._pending.items()):
+            while job_ids and self._jobs.get(job_ids[0], {}).get('status') != JOB_QUEUED:
+                job_ids.popleft() # Purged or otherwise resolved while waiting
+            if not job_ids:
+                del self._pending[client]
+                if client not in self._running:
+                    self._last_claim.pop(client, None)
+                continue
+            rank = (self._running.get(client, 0), self._last_claim.get(client, 0), self._jobs[job_ids[0]]['created_at'])
+            if best is None or rank < best[0]:
+                best = (rank, client)
+        return best[1] if best is not None else None
+
+    def claim(self, timeout=1.0):
+        """Blocks up to `timeout` seconds for a queued job and marks it running."""
+        deadline = time.monotonic() + timeout
+        with self._ready:
+            while True:
+                client = self._next_client()
+                if client is not None:
+                    job = self._jobs[self._pending[client].popleft()]
+                    job['status'] = JOB_RUNNING
+                    job['updated_at'] = job['claimed_at'] = time.time()
+                    self._running[client] = self._running.get(client, 0) + 1
+                    self._claims += 1
+                    self._last_claim[client] = self._claims
+                    return dict(job)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._ready.wait(remaining)
+
+    def _apply(self, job, fields):
+        if job['status'] == JOB_RUNNING and fields.get('status', JOB_RUNNING) != JOB_RUNNING:
+            client = job_client(job)
+            running = self._running.pop(client, 0) - 1
+            if running > 0:
+                self._running[client] = running
+            elif client not in self._pending:
+                self._last_claim.pop(client, None)
+        job.update(fields)
+        job['updated_at'] = time.time()
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._apply(job, fields)
+
+    def update_if_status(self, job_id, expected_status, expected_claim=None, **fields):
+        """Applies `fields` only if the job is still in `expected_status` (and, if given, still
+        carries the `claimed_at` of `expected_claim`); returns whether it was."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != expected_status or \
+                    (expected_claim is not None and job.get('claimed_at') != expected_claim):
+                return False
+            self._apply(job, fields)
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def count(self, status, client=None):
+        """Jobs in `status`, optionally only those of one client."""
+        with self._lock:
+            return self._count(status, client)
+
+    def _count(self, status, client=None):
+        if status == JOB_QUEUED and client is not None:
+            return sum(1 for job_id in self._pending.get(client, ()) if self._jobs.get(job_id, {}).get('status') == status)
+        return sum(1 for job in self._jobs.values()
+                   if job['status'] == status and (client is None or job_client(job) == client))
+
+    def purge(self, older_than):
+        """Removes finished jobs last updated before `older_than` and returns them."""
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in FINISHED_STATES and job['updated_at'] < older_than]
+            return [self._jobs.pop(job_id) for job_id in expired]
+
+    def heartbeat(self, job_ids):
+        """Running jobs need no lease here: they cannot outlive the process that holds them."""
+
+    def requeue_expired(self, older_than, max_attempts):
+        return [], []
+
+
+# Row columns kept outside the JSON data: indexed for claims, counts and leases
+STORE_COLUMNS = ('id', 'status', 'created_at', 'updated_at', 'client', 'claimed_at', 'attempts')
+SELECT_COLUMNS = "id, status, created_at, updated_at, client, claimed_at, attempts, data"
+# Columns added since the first schema, with their declarations
+ADDED_COLUMNS = (
+    ('client', "TEXT NOT NULL DEFAULT ''"),
+    ('claimed_at', "REAL"),
+    ('heartbeat_at', "REAL"), # Renewed while a worker runs the job; the job's lease
+    ('attempts', "INTEGER NOT NULL DEFAULT 0"), # Runs lost to a stopped worker
+)
+
+
+class SQLiteJobStore:
+    """Persists jobs in a SQLite table; workers in any process claim rows atomically.
+
+    A running row holds a lease that its process renews (`heartbeat`). A row whose lease ran
+    out belongs to a worker that crashed or was stopped mid-job, and `requeue_expired` queues
+    it again or fails it.
+    """
+
+    def __init__(self, db_path, poll_interval=0.5):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE") # Processes starting together must not both migrate
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, declaration in ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {declaration}")
+            if 'client' not in columns:
+                # Rows written before the columns existed kept these fields in their data
+                conn.execute("UPDATE jobs SET client = COALESCE(json_extract(data, '$.client'), ''),"
+                             " claimed_at = json_extract(data, '$.claimed_at')")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_client ON jobs (status, client, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_client_claimed ON jobs (client, claimed_at)")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A short-lived connection per call keeps the store safe to share across threads and forks
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _row_to_job(row):
+        job_id, status, created_at, updated_at, client, claimed_at, attempts, data = row
+        job = json.loads(data)
+        job.update(id=job_id, status=status, created_at=created_at, updated_at=updated_at)
+        if client:
+            job['client'] = client
+        if claimed_at is not None:
+            job['claimed_at'] = claimed_at
+        if attempts:
+            job['attempts'] = attempts
+        return job
+
+    @staticmethod
+    def _split(job):
+        data = {k: v for k, v in job.items() if k not in STORE_COLUMNS}
+        return json.dumps(data)
+
+    def add(self, job, admit=None):
+        """Inserts a job; `admit(queued, client_queued)` may raise to refuse it, checked in the same transaction."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if admit is not None:
+                    admit(conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)).fetchone()[0],
+                          conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND client = ?",
+                                       (JOB_QUEUED, job_client(job))).fetchone()[0])
+                conn.execute(
+                    "INSERT INTO jobs (id, status, created_at, updated_at, client, data) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job['id'], job['status'], job['created_at'], job['updated_at'], job_client(job), self._split(job))
+                )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def claim(self, timeout=1.0):
+        """Atomically moves the next queued row to running, polling until `timeout` elapses.
+
+        The next row is the oldest one of the client with the fewest running jobs, then the
+        one whose latest claim is oldest. Both are index lookups per client with queued rows.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                client = conn.execute(
+                    "SELECT client FROM jobs AS queued WHERE status = ? GROUP BY client"
+                    " ORDER BY (SELECT COUNT(*) FROM jobs AS running WHERE running.status = ? AND running.client = queued.client),"
+                    " (SELECT COALESCE(MAX(claimed.claimed_at), 0) FROM jobs AS claimed WHERE claimed.client = queued.client),"
+                    " MIN(created_at) LIMIT 1",
+                    (JOB_QUEUED, JOB_RUNNING)
+                ).fetchone()
+                if client is not None:
+                    row = conn.execute(
+                        f"SELECT {SELECT_COLUMNS} FROM jobs WHERE status = ? AND client = ? ORDER BY created_at LIMIT 1",
+                        (JOB_QUEUED, client[0])
+                    ).fetchone()
+                    now = time.time()
+                    conn.execute("UPDATE jobs SET status = ?, updated_at = ?, claimed_at = ?, heartbeat_at = ? WHERE id = ?",
+                                 (JOB_RUNNING, now, now, now, row[0]))
+                    conn.execute("COMMIT")
+                    job = self._row_to_job(row)
+                    job.update(status=JOB_RUNNING, updated_at=now, claimed_at=now)
+                    return job
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def update(self, job_id, **fields):
+        self.update_if_status(job_id, None, **fields)
+
+    def update_if_status(self, job_id, expected_status, expected_claim=None, **fields):
+        """Applies `fields` only if the row is still in `expected_status` (any status if None) and,
+        if given, still carries the `claimed_at` of `expected_claim`; returns whether it was.
+
+        The claim time identifies a run: a requeued row gets a new one when it is claimed again.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(f"SELECT {SELECT_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or (expected_status is not None and row[1] != expected_status) or \
+                    (expected_claim is not None and row[5] != expected_claim):
+                conn.execute("COMMIT")
+                return False
+            job = self._row_to_job(row)
+            job.update(fields)
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, data = ? WHERE id = ?",
+                (job['status'], time.time(), self._split(job), job_id)
+            )
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {SELECT_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def count(self, status, client=None):
+        """Rows in `status`, optionally only those of one client."""
+        with self._connect() as conn:
+            if client is None:
+                return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND client = ?", (status, client)).fetchone()[0]
+
+    def heartbeat(self, job_ids):
+        """Renews the lease of running jobs."""
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND id IN ({placeholders})",
+                         (time.time(), JOB_RUNNING, *job_ids))
+
+    def requeue_expired(self, older_than, max_attempts):
+        """Queues running rows whose lease was last renewed before `older_than` again.
+
+        A row that has already been lost `max_attempts` times is failed instead (cancelled, if
+        a cancellation was pending). Returns (requeued jobs, finished jobs).
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"SELECT {SELECT_COLUMNS} FROM jobs WHERE status = ? AND COALESCE(heartbeat_at, claimed_at, updated_at) < ?",
+                (JOB_RUNNING, older_than)
+            ).fetchall()
+            requeued, finished = [], []
+            now = time.time()
+            for row in rows:
+                job = self._row_to_job(row)
+                attempts = job['attempts'] = job.get('attempts', 0) + 1
+                if job.get('cancel_requested'):
+                    job.update(status=JOB_CANCELLED, error=JobCancelled(job['cancel_requested']).args[0])
+                    finished.append(job)
+                elif attempts < max_attempts:
+                    job.update(status=JOB_QUEUED, stage=None, slide_titles=[])
+                    requeued.append(job)
+                else:
+                    job.update(status=JOB_FAILED, error="The server stopped while generating this presentation. Please try again.")
+                    finished.append(job)
+                conn.execute("UPDATE jobs SET status = ?, updated_at = ?, attempts = ?, heartbeat_at = NULL, data = ? WHERE id = ?",
+                             (job['status'], now, attempts, self._split(job), job['id']))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return requeued, finished
+
+    def purge(self, older_than):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            placeholders = ", ".join("?" for _ in FINISHED_STATES)
+            rows = conn.execute(
+                f"SELECT {SELECT_COLUMNS} FROM jobs"
+                f" WHERE status IN ({placeholders}) AND updated_at < ?", (*FINISHED_STATES, older_than)
+            ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(row[0],) for row in rows])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return [self._row_to_job(row) for row in rows]
+
+
+def create_job_store(backend, db_path=None):
+    """Factory for the configured job store ('memory' or 'sqlite')."""
+    backend = (backend or 'memory').lower()
+    if backend == 'memory':
+        return InProcessJobStore()
+    if backend == 'sqlite':
+        return SQLiteJobStore(db_path or 'jobs.db')
+    raise ValueError(f"Unknown job backend '{backend}'. Expected 'memory' or 'sqlite'.")
+
+
+# --- Job Manager ---
+class JobManager:
+    """Runs a bounded pool of worker threads that execute `handler(job)` for each claimed job.
+
+    The handler returns a dict of fields to record on success (e.g. the result path) and raises
+    to fail the job; `error_formatter(exc)` turns the exception into a user-facing message.
+    A handler that raises JobCancelled finishes its job as cancelled instead.
+    `on_expire(job)` is called for each finished job removed by the TTL purge.
+
+    A maintenance thread renews the leases of the jobs this manager is running every quarter
+    of `lease_seconds`, queues jobs whose lease ran out again (at most `max_attempts` runs in
+    all), and purges expired jobs.
+    """
+
+    def __init__(self, store, handler, max_workers=4, result_ttl=3600, error_formatter=str, on_expire=None,
+                 lease_seconds=60, max_attempts=2):
+        self.store = store
+        self.handler = handler
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.error_formatter = error_formatter
+        self.on_expire = on_expire
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._threads = []
+        self._maintenance = None
+        self._stop = threading.Event()
+        self._stop_maintenance = threading.Event()
+        self._start_lock = threading.Lock()
+        self._active = set() # Ids of the jobs this manager's workers are running
+        self._active_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._threads or self._stop.is_set():
+                return # Running, or stopped for good (a stopping process must not claim new jobs)
+            for i in range(self.max_workers):
+                t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._maintenance = threading.Thread(target=self._maintenance_loop, name="job-maintenance", daemon=True)
+            self._maintenance.start()
+            logging.info(f"Job manager started with {self.max_workers} worker threads ({type(self.store).__name__}).")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        # Leases are renewed until the running jobs have finished, so no other process takes them over
+        self._stop_maintenance.set()
+        if self._maintenance is not None:
+            self._maintenance.join(timeout)
+            self._maintenance = None
+
+    def submit(self, admit=None, **fields):
+        """Enqueues a new job and returns its id.
+
+        `admit(queued, client_queued)` is called with the queued job counts (overall and of the
+        job's client) atomically with the insert, and may raise to refuse the job.
+        """
+        self.start()
+        now = time.time()
+        job = dict(fields, id=new_job_id(), status=JOB_QUEUED, created_at=now, updated_at=now, error=None)
+        self.store.add(job, admit)
+        logging.info(f"Job {job['id']} queued.")
+        return job['id']
+
+    def add_record(self, record_id, **fields):
+        """Stores a finished record that no worker claims (e.g. a batch manifest).
+
+        Records share the store and the result TTL with jobs; `update()` refreshes their age.
+        """
+        now = time.time()
+        self.store.add(dict(fields, id=record_id, status=JOB_DONE, created_at=now, updated_at=now, error=None))
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def update(self, job_id, **fields):
+        self.store.update(job_id, **fields)
+
+    def count(self, status, client=None):
+        """Jobs in `status`, optionally only those submitted by `client`."""
+        return self.store.count(status, client)
+
+    def cancel(self, job_id, trigger='request', **queued_fields):
+        """Cancels a job; returns its status when the request arrived, or None if it is unknown.
+
+        A queued job is finished as cancelled at once (recording `queued_fields` too). A running
+        job is only flagged with `cancel_requested`; its handler notices the flag and raises
+        JobCancelled. Finished jobs are left alone.
+        """
+        if self.store.update_if_status(job_id, JOB_QUEUED, status=JOB_CANCELLED,
+                                       error=JobCancelled(trigger).args[0], **queued_fields):
+            logging.info(f"Job {job_id} cancelled while queued ({trigger}).")
+            return JOB_QUEUED
+        if self.store.update_if_status(job_id, JOB_RUNNING, cancel_requested=trigger):
+            logging.info(f"Job {job_id} asked to stop ({trigger}).")
+            return JOB_RUNNING
+        job = self.store.get(job_id)
+        return job['status'] if job is not None else None
+
+    def purge_expired(self):
+        for job in self.store.purge(time.time() - self.result_ttl):
+            logging.info(f"Job {job['id']} expired after {self.result_ttl}s.")
+            if self.on_expire:
+                try:
+                    self.on_expire(job)
+                except Exception as e:
+                    logging.error(f"Error cleaning up expired job {job['id']}: {e}", exc_info=True)
+
+    def expire_leases(self):
+        """Queues again (or finishes) running jobs whose worker stopped renewing their lease."""
+        requeued, finished = self.store.requeue_expired(time.time() - self.lease_seconds, self.max_attempts)
+        for job in requeued:
+            logging.warning(f"Job {job['id']} lost its worker; queued again (run {job['attempts'] + 1} of {self.max_attempts}).")
+        for job in finished:
+            logging.warning(f"Job {job['id']} lost its worker; marked {job['status']}.")
+
+    def _maintenance_loop(self):
+        while not self._stop_maintenance.wait(self.lease_seconds / 4):
+            try:
+                with self._active_lock:
+                    active = list(self._active)
+                self.store.heartbeat(active)
+                self.expire_leases()
+                self.purge_expired()
+            except Exception as e:
+                logging.error(f"Job store maintenance failed: {e}", exc_info=True)
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim(timeout=1.0)
+            except Exception as e:
+                logging.error(f"Job store claim failed: {e}", exc_info=True)
+                time.sleep(1.0)
+                continue
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job):
+        job_id = job['id']
+        started = time.monotonic()
+        logging.info(f"Job {job_id} started.")
+        with self._active_lock:
+            self._active.add(job_id)
+
+        def finish(**fields):
+            # Only this run may finish the job: if its lease ran out, the job may have been queued
+            # again and claimed by another worker, or cancelled, and that outcome must stand
+            if self.store.update_if_status(job_id, JOB_RUNNING, expected_claim=job.get('claimed_at'), **fields):
+                return True
+            logging.warning(f"Job {job_id} was taken over or finished elsewhere while this run lost its lease; "
+                            f"dropping this run's outcome ({fields['status']}).")
+            return False
+
+        try:
+            result_fields = self.handler(job) or {}
+        except JobCancelled as e:
+            if finish(status=JOB_CANCELLED, error=str(e), cancellation=e.details):
+                logging.info(f"Job {job_id} cancelled after {time.monotonic() - started:.1f}s ({e.trigger}).")
+        except Exception as e:
+            if finish(status=JOB_FAILED, error=self.error_formatter(e)):
+                logging.warning(f"Job {job_id} failed after {time.monotonic() - started:.1f}s: {e}")
+        else:
+            if finish(status=JOB_DONE, **result_fields):
+                logging.info(f"Job {job_id} finished in {time.monotonic() - started:.1f}s.")
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Shared HTTP client for the Azure OpenAI endpoint.
+
+One `requests.Session` per process keeps TCP/TLS connections alive between calls, with a
+connection pool sized for the number of concurrent callers. Transient failures (429, 5xx and
+connection errors) are retried with exponential backoff and full jitter, honouring
+`Retry-After`. A circuit breaker fails fast while the endpoint is consistently down.
+"""
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without contacting the endpoint while the circuit breaker is open."""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Circuit open; endpoint calls suspended for another {retry_in:.0f}s.")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and half-opens after `reset_timeout` seconds.
+
+    While half-open a single trial request is let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half_open' if time.monotonic() - self._opened_at >= self.reset_timeout else 'open'
+
+    def before_request(self):
+        """Raises CircuitOpenError if calls are currently suspended. Returns True if this call is the half-open trial."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            if self._trial_in_flight:
+                raise CircuitOpenError(0)
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            was_trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if was_trial or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.times_opened += 1
+                logging.error(f"LLM endpoint circuit opened after {self._failures} consecutive failures; "
+                              f"failing fast for {self.reset_timeout:.0f}s.")
+
+    def release_trial(self):
+        """Ends a trial that produced no verdict on the endpoint, so the next call can be the trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def parse_retry_after(value):
+    """Returns the delay in seconds from a Retry-After header (seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """Keep-alive, retrying POST client with circuit breaking and usage counters."""
+
+    def __init__(self, pool_size=10, max_retries=3, backoff_base=1.0, backoff_max=30.0,
+                 max_retry_after=60.0, failure_threshold=5, reset_timeout=30.0, poll_interval=0.25):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.poll_interval = poll_interval
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        # Retries are handled here (with Retry-After support), not by urllib3
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'circuit_rejections': 0}
+        self._status_counts = {}
+        self._usage = {'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def record_usage(self, prompt_tokens, cached_tokens, completion_tokens):
+        """Adds one response's reported token usage; `cached_tokens` is the prompt prefix served from the provider's cache."""
+        with self._lock:
+            self._usage['prompt_tokens'] += prompt_tokens
+            self._usage['cached_tokens'] += cached_tokens
+            self._usage['completion_tokens'] += completion_tokens
+
+    def _backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, raised to at least the server's Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _sleep(self, seconds, check=None):
+        """Sleeps `seconds` in `poll_interval` steps, calling `check()` (which may raise) at each step."""
+        deadline = time.monotonic() + seconds
+        while True:
+            if check is not None:
+                check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.poll_interval, remaining))
+
+    def post(self, url, check=None, **kwargs):
+        """POSTs with retries. Returns the final Response (which may still be an error status).
+
+        Raises CircuitOpenError when the breaker is open, or the last connection error once
+        retries are exhausted. Read timeouts are not retried: the caller's timeout is a budget.
+        `check()` (e.g. a job's cancel check, which may raise) is called while waiting between
+        attempts, so a cancelled job does not sit out the backoff or send another request.
+        """
+        self._count('requests')
+        attempt = 0
+        while True:
+            try:
+                trial = self.breaker.before_request()
+            except CircuitOpenError:
+                self._count('circuit_rejections')
+                raise
+            self._count('attempts')
+            try:
+                response = self.session.post(url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    self._count('failures')
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"LLM request connection error ({e}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s.")
+            except requests.exceptions.RequestException:
+                self.breaker.record_failure()
+                self._count('failures')
+                raise
+            except Exception:
+                if trial:
+                    self.breaker.release_trial() # Not the endpoint's fault (e.g. a bad argument); don't stay half-open
+                self._count('failures')
+                raise
+            else:
+                with self._lock:
+                    self._status_counts[response.status_code] = self._status_counts.get(response.status_code, 0) + 1
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success() # 4xx other than 429 means the endpoint itself is healthy
+                    return response
+                if response.status_code == 429:
+                    self.breaker.record_success() # Throttling means the endpoint is up, not an outage
+                else:
+                    self.breaker.record_failure()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if attempt >= self.max_retries or (retry_after is not None and retry_after > self.max_retry_after):
+                    self._count('failures')
+                    return response
+                delay = self._backoff(attempt, retry_after)
+                logging.warning(f"LLM request returned {response.status_code}; retry {attempt + 1}/{self.max_retries} in {delay:.1f}s.")
+                response.close() # Release the connection back to the pool before sleeping
+            attempt += 1
+            self._count('retries')
+            self._sleep(delay, check)
+
+    def stats(self):
+        """Request/retry counters, status code counts, circuit state, connection reuse and recorded token usage."""
+        connections = requests_sent = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys(): # The container does not support direct iteration
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        with self._lock:
+            return dict(
+                self._counters,
+                status_codes={str(code): count for code, count in self._status_counts.items()},
+                circuit_state=self.breaker.state,
+                circuit_opened=self.breaker.times_opened,
+                connections_opened=connections,
+                connections_reused=max(0, requests_sent - connections),
+                usage=dict(self._usage, cached_share=round(self._usage['cached_tokens'] / self._usage['prompt_tokens'], 4)
+                           if self._usage['prompt_tokens'] else 0.0),
+            )
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Combines several extracted documents into one source text for a single outline.
+
+Paragraphs are deduplicated across (and within) the documents by a hash of their
+normalized text, so boilerplate shared by related documents (contract clauses, disclaimers,
+letterheads) is sent once. The remaining unique text is fitted into the prompt budget
+proportionally: if it does not fit, every document keeps the same fraction of its unique
+text, cut on paragraph boundaries. Prompt size therefore tracks the unique content rather
+than the combined size of the uploads.
+"""
+import re
+import hashlib
+
+# Shorter paragraphs (headings, labels, list markers) are always kept so each document's structure survives
+DEDUP_MIN_CHARS = 30
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def paragraph_key(paragraph):
+    """Hash of a paragraph with case and whitespace differences removed."""
+    normalized = WHITESPACE_PATTERN.sub(' ', paragraph).strip().casefold()
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+
+def source_header(index, total, filename):
+    return f"=== Source document {index} of {total}: {filename} ==="
+
+
+def dedupe_paragraphs(documents):
+    """Drops paragraphs already seen earlier in the same or a previous document.
+
+    `documents` is a list of (filename, text). Returns a list of (filename, paragraphs, stats),
+    where stats counts the input and the duplicates that were removed.
+    """
+    seen = set()
+    results = []
+    for filename, text in documents:
+        kept = []
+        duplicates = 0
+        duplicate_chars = 0
+        for paragraph in text.replace('\f', '\n').split('\n'): # Page breaks end a paragraph too
+            stripped = paragraph.strip()
+            if not stripped:
+                continue
+            if len(stripped) >= DEDUP_MIN_CHARS:
+                key = paragraph_key(stripped)
+                if key in seen:
+                    duplicates += 1
+                    duplicate_chars += len(stripped) + 1
+                    continue
+                seen.add(key)
+            kept.append(stripped)
+        results.append((filename, kept, {
+            "filename": filename,
+            "chars": len(text),
+            "duplicate_paragraphs": duplicates,
+            "duplicate_chars": duplicate_chars,
+        }))
+    return results
+
+
+def take_paragraphs(paragraphs, max_chars):
+    """Leading paragraphs that fit in `max_chars` (newline-joined); at least part of the first one."""
+    taken = []
+    used = 0
+    for paragraph in paragraphs:
+        cost = len(paragraph) + (1 if taken else 0)
+        if used + cost > max_chars:
+            if not taken and max_chars > 0:
+                taken.append(paragraph[:max_chars]) # A single oversized paragraph: keep its start
+            break
+        taken.append(paragraph)
+        used += cost
+    return taken
+
+
+def merge_documents(documents, max_chars):
+    """Dedupes `documents` ([(filename, text)]) and fits them into `max_chars`. Returns (text, stats).
+
+    Each document is introduced by a header line naming it. When the unique text is longer
+    than the budget left after the headers, each document gets a share proportional to its
+    unique size.
+    """
+    deduped = dedupe_paragraphs(documents)
+    total = len(deduped)
+    headers = [source_header(i, total, filename) for i, (filename, _, _) in enumerate(deduped, start=1)]
+    unique_sizes = [sum(len(p) + 1 for p in paragraphs) for _, paragraphs, _ in deduped]
+    unique_total = sum(unique_sizes)
+    # Each section costs its header, a newline after it and a blank line before the next one
+    available = max(0, max_chars - sum(len(header) + 3 for header in headers))
+    ratio = min(1.0, available / unique_total) if unique_total else 1.0
+
+    sections = []
+    document_stats = []
+    for header, (filename, paragraphs, stats), unique_size in zip(headers, deduped, unique_sizes):
+        budget = int(unique_size * ratio)
+        taken = paragraphs if ratio >= 1.0 else take_paragraphs(paragraphs, budget)
+        body = '\n'.join(taken)
+        sections.append(f"{header}\n{body}")
+        stats.update(unique_chars=unique_size, budget_chars=budget, used_chars=len(body),
+                     truncated=len(body) < unique_size - 1) # unique_size counts a newline after every paragraph
+        document_stats.append(stats)
+
+    merged = '\n\n'.join(sections)
+    return merged, {
+        "document_count": total,
+        "input_chars": sum(len(text) for _, text in documents),
+        "unique_chars": unique_total,
+        "duplicate_paragraphs": sum(s["duplicate_paragraphs"] for s in document_stats),
+        "merged_chars": len(merged),
+        "budget_chars": max_chars,
+        "budget_ratio": round(ratio, 4),
+        "documents": document_stats,
+    }
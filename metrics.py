@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""Per-stage pipeline timings exported as Prometheus text-format metrics.
+
+Each job gets a RequestTrace that times its stages (extraction, LLM call, parsing, deck
+building, ...) and records request attributes (file size, extracted/prompt characters, slide
+count, finish_reason, cache outcome). Finished traces feed the process-wide histograms served
+on /metrics and can also be kept as a JSON document per request. With metrics and traces
+disabled, jobs get NULL_TRACE, whose methods do nothing.
+
+Metrics are kept per process; scrape each worker process separately.
+"""
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 4e6, 1e7, 3.2e7)
+SLIDE_BUCKETS = (1, 5, 10, 15, 20, 30, 50, 100)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=SECONDS_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {values[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(float(values[-2]))}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {values[-1]}"
+
+
+class PipelineMetrics:
+    """The process-wide metric families for presentation jobs."""
+
+    def __init__(self, prefix='pptx'):
+        self.stage_seconds = Histogram(f"{prefix}_stage_seconds", "Time spent in each pipeline stage.", labelnames=('stage',))
+        self.job_seconds = Histogram(f"{prefix}_job_seconds", "End-to-end job time, excluding queue wait.", labelnames=('outcome',))
+        self.upload_bytes = Histogram(f"{prefix}_upload_bytes", "Uploaded file size.", SIZE_BUCKETS)
+        self.extracted_chars = Histogram(f"{prefix}_extracted_chars", "Characters of text extracted per document.", SIZE_BUCKETS)
+        self.prompt_chars = Histogram(f"{prefix}_prompt_chars", "Characters in the outline prompt.", SIZE_BUCKETS)
+        self.slides = Histogram(f"{prefix}_slides", "Slides per generated deck.", SLIDE_BUCKETS)
+        self.jobs = Counter(f"{prefix}_jobs", "Finished jobs by outcome and result cache status.", ('outcome', 'cache'))
+        self.finish_reasons = Counter(f"{prefix}_llm_finish_reasons", "Outline LLM calls by finish_reason.", ('finish_reason',))
+        self.prompt_tokens = Counter(f"{prefix}_llm_prompt_tokens", "Outline prompt tokens reported by the API, by provider prefix cache outcome.", ('cache',))
+        self.cancellations = Counter(f"{prefix}_cancelled_jobs", "Cancelled jobs by trigger and the stage they stopped in.", ('trigger', 'stage'))
+        self.saved_seconds = Counter(f"{prefix}_cancel_saved_seconds", "Estimated job seconds saved by cancellations.")
+        self.saved_tokens = Counter(f"{prefix}_cancel_saved_tokens", "Estimated outline tokens saved by cancellations (never sent or never generated).")
+        self._families = [self.stage_seconds, self.job_seconds, self.upload_bytes, self.extracted_chars,
+                          self.prompt_chars, self.slides, self.jobs, self.finish_reasons, self.prompt_tokens,
+                          self.cancellations, self.saved_seconds, self.saved_tokens]
+
+    def record(self, trace):
+        """Folds a finished trace into the histograms and counters."""
+        for stage, seconds in trace.stages:
+            self.stage_seconds.observe(seconds, stage=stage)
+        attributes = trace.attributes
+        self.job_seconds.observe(trace.seconds, outcome=trace.outcome)
+        self.jobs.inc(outcome=trace.outcome, cache=attributes.get('cache') or 'none')
+        for histogram, name in ((self.upload_bytes, 'file_size'), (self.extracted_chars, 'extracted_chars'),
+                                (self.prompt_chars, 'prompt_chars'), (self.slides, 'slide_count')):
+            if attributes.get(name) is not None:
+                histogram.observe(attributes[name])
+        if attributes.get('finish_reason'):
+            self.finish_reasons.inc(finish_reason=attributes['finish_reason'])
+        if attributes.get('prompt_tokens') is not None:
+            cached = attributes.get('cached_tokens') or 0
+            self.prompt_tokens.inc(cached, cache='hit')
+            self.prompt_tokens.inc(attributes['prompt_tokens'] - cached, cache='miss')
+
+    def record_cancellation(self, details):
+        """Counts a cancelled job and its estimated savings (a JobCancelled's details)."""
+        self.cancellations.inc(trigger=details['trigger'], stage=details.get('stage') or 'unknown')
+        if details.get('saved_seconds') is not None:
+            self.saved_seconds.inc(details['saved_seconds'])
+        if details.get('saved_tokens') is not None:
+            self.saved_tokens.inc(details['saved_tokens'])
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        for family in self._families:
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(family.samples())
+        return '\n'.join(lines) + '\n'
+
+
+_local = threading.local()
+
+
+class RequestTrace:
+    """Stage timings and attributes for one job.
+
+    `finish(outcome)` records the trace into `metrics` (if given) and returns it as a dict;
+    the dict is also appended as a JSON line to `trace_path` when set.
+    """
+
+    def __init__(self, request_id, metrics=None, trace_path=None):
+        self.request_id = request_id
+        self.metrics = metrics
+        self.trace_path = trace_path
+        self._timeline = [] # (stage, seconds, seconds since the trace started when it ended), in the order they finished
+        self.attributes = {}
+        self.outcome = None
+        self.seconds = None
+        self._started = time.perf_counter()
+        self._started_at = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            self._timeline.append((name, ended - started, ended - self._started))
+
+    def record(self, name, seconds):
+        """Adds a stage that was timed elsewhere (e.g. accumulated over many small calls), ending now."""
+        self._timeline.append((name, seconds, time.perf_counter() - self._started))
+
+    @property
+    def stages(self):
+        """(stage, seconds) in the order the stages finished."""
+        return [(name, seconds) for name, seconds, _ in self._timeline]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @contextmanager
+    def activate(self):
+        """Makes this the trace returned by current_trace() in this thread."""
+        previous = getattr(_local, 'trace', None)
+        _local.trace = self
+        try:
+            yield self
+        finally:
+            _local.trace = previous
+
+    def finish(self, outcome):
+        self.outcome = outcome
+        self.seconds = time.perf_counter() - self._started
+        if self.metrics is not None:
+            self.metrics.record(self)
+        trace = self.to_dict()
+        if self.trace_path:
+            try:
+                with open(self.trace_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(trace) + '\n')
+            except OSError as e:
+                logging.warning(f"Could not write request trace to '{self.trace_path}': {e}")
+        return trace
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "started_at": self._started_at,
+            "outcome": self.outcome,
+            "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+            # ended_at (epoch seconds) lets a stage be matched with samples taken outside the process, e.g. memory
+            "stages": [{"stage": stage, "seconds": round(seconds, 4), "ended_at": round(self._started_at + ended, 4)}
+                       for stage, seconds, ended in self._timeline],
+            **self.attributes,
+        }
+
+
+class _NullStage:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullTrace:
+    """Stand-in used when metrics and traces are disabled; every method is a no-op."""
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def record(self, name, seconds):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def activate(self):
+        return self._stage
+
+    def finish(self, outcome):
+        return None
+
+
+NULL_TRACE = NullTrace()
+
+
+def current_trace():
+    """The trace activated in this thread, or NULL_TRACE."""
+    return getattr(_local, 'trace', None) or NULL_TRACE
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Text normalization between extraction and prompt building.
+
+Extracted text carries a lot that costs tokens without adding content: running headers and
+footers repeated on every page, page numbers, table-of-contents lines, disclaimers pasted
+many times over, and runs of whitespace. normalize_text() removes these in one pass:
+
+1. whitespace inside lines is collapsed and blank lines are dropped;
+2. page numbers (a bare number, or "Page 3 of 20", on one of a page's edge lines) and
+   table-of-contents lines (dot leaders ending in a page number, or a run of
+   TOC_TAB_MIN_RUN tab-separated lines whose page numbers never decrease) are dropped;
+3. lines at the top or bottom of a page that recur there on most pages (compared with digits
+   masked, so "Page 3 of 20" matches "Page 4 of 20") are running headers/footers and dropped;
+4. any other line that occurs BOILERPLATE_MIN_REPEATS or more times is kept once.
+
+Page breaks ('\\f', as produced by the PDF extractor) are preserved for the chunker. Token
+counts in the stats come from the caller's counter (the prompt budget's, so the saving
+matches what is sent), or the same characters-per-token estimate it falls back to.
+"""
+import re
+import time
+
+from prompt_budget import estimate_tokens
+
+PAGE_BREAK = '\f'
+INLINE_WHITESPACE_PATTERN = re.compile(r'[ \t\u00a0\u2000-\u200b\u3000]+')
+PAGE_NUMBER_PATTERN = re.compile(r'^(?:page\s*)?[-–—]?\s*\d{1,4}\s*[-–—]?(?:\s*(?:of|/)\s*\d{1,4})?$', re.IGNORECASE)
+# Page numbers of a TOC entry: arabic, or lower-case roman for front matter (case-sensitive, so "Size\tXL" is not one)
+TOC_DOT_LINE_PATTERN = re.compile(r'^\S.{0,150}?\s*(?:\.\s?){3,}\s*(?:\d{1,4}|[ivxlcdm]{1,7})$')
+TOC_TAB_LINE_PATTERN = re.compile(r'^\S[^\t]{0,150}\t+\s*(\d{1,4}|[ivxlcdm]{1,7})$')
+# Tab-separated "label<TAB>number" lines are also table rows, so alone they are kept; only a run
+# of this many with non-decreasing page numbers is taken for a table of contents
+TOC_TAB_MIN_RUN = 3
+DIGITS_PATTERN = re.compile(r'\d+')
+
+# A line is page furniture if it is among the first or last PAGE_EDGE_LINES lines of at least
+# PAGE_FURNITURE_PAGE_SHARE of the pages (and of at least PAGE_FURNITURE_MIN_PAGES pages)
+PAGE_EDGE_LINES = 3
+PAGE_FURNITURE_MIN_PAGES = 3
+PAGE_FURNITURE_PAGE_SHARE = 0.5
+PAGE_FURNITURE_MAX_CHARS = 200
+# Longer lines repeated this often are boilerplate; shorter ones (headings, labels) are left alone
+BOILERPLATE_MIN_REPEATS = 3
+BOILERPLATE_MIN_CHARS = 20
+
+
+def _signature(line):
+    return DIGITS_PATTERN.sub('#', line).casefold()
+
+
+def _edge_indexes(lines):
+    count = len(lines)
+    return set(range(min(PAGE_EDGE_LINES, count))) | set(range(max(0, count - PAGE_EDGE_LINES), count))
+
+
+def _toc_indexes(raw_lines):
+    """Indexes of the table-of-contents lines among a page's stripped (not collapsed) lines."""
+    indexes = {index for index, raw in enumerate(raw_lines) if TOC_DOT_LINE_PATTERN.match(raw)}
+    run = [] # (index, page number; 0 for roman front matter) of consecutive tab-leader lines
+    for index, raw in enumerate(raw_lines + [None]):
+        match = TOC_TAB_LINE_PATTERN.match(raw) if raw is not None else None
+        if match is not None:
+            run.append((index, int(match.group(1)) if match.group(1).isdigit() else 0))
+            continue
+        if len(run) >= TOC_TAB_MIN_RUN and all(a[1] <= b[1] for a, b in zip(run, run[1:])):
+            indexes.update(i for i, _ in run)
+        run = []
+    return indexes
+
+
+def normalize_text(text, count_tokens=estimate_tokens):
+    """Returns (normalized_text, stats); stats reports before/after sizes and what was removed.
+
+    `count_tokens(text)` gives the stats' token counts.
+    """
+    started = time.perf_counter()
+    removed = {"page_furniture_lines": 0, "page_number_lines": 0, "toc_lines": 0, "boilerplate_lines": 0}
+
+    # 1-2. Collapse whitespace; drop blank, page-number and table-of-contents lines. Without page
+    #      breaks there are no page edges, so no line is taken for a page number.
+    paged = PAGE_BREAK in text
+    pages = []
+    for page in text.split(PAGE_BREAK):
+        raw_lines, collapsed = [], []
+        for raw_line in page.split('\n'):
+            line = INLINE_WHITESPACE_PATTERN.sub(' ', raw_line).strip()
+            if line:
+                raw_lines.append(raw_line.strip()) # Tab leaders are only visible before collapsing
+                collapsed.append(line)
+        edges = _edge_indexes(collapsed) if paged else ()
+        toc = _toc_indexes(raw_lines)
+        lines = []
+        for index, line in enumerate(collapsed):
+            if index in edges and PAGE_NUMBER_PATTERN.match(line):
+                removed["page_number_lines"] += 1
+            elif index in toc:
+                removed["toc_lines"] += 1
+            else:
+                lines.append(line)
+        pages.append(lines)
+
+    # 3. Running headers and footers: short lines found on most pages
+    furniture = set()
+    if len(pages) >= PAGE_FURNITURE_MIN_PAGES:
+        page_counts = {}
+        for lines in pages:
+            edge_lines = (lines[i] for i in _edge_indexes(lines))
+            for signature in {_signature(line) for line in edge_lines if len(line) <= PAGE_FURNITURE_MAX_CHARS}:
+                page_counts[signature] = page_counts.get(signature, 0) + 1
+        threshold = max(PAGE_FURNITURE_MIN_PAGES, PAGE_FURNITURE_PAGE_SHARE * len(pages))
+        furniture = {signature for signature, count in page_counts.items() if count >= threshold}
+
+    # 4. Boilerplate: frequently repeated longer lines are kept the first time only
+    line_counts = {}
+    for lines in pages:
+        for line in lines:
+            if len(line) >= BOILERPLATE_MIN_CHARS:
+                key = line.casefold()
+                line_counts[key] = line_counts.get(key, 0) + 1
+    seen_boilerplate = set()
+
+    output_pages = []
+    for lines in pages:
+        kept = []
+        edges = _edge_indexes(lines) if furniture else ()
+        for index, line in enumerate(lines):
+            if index in edges and _signature(line) in furniture:
+                removed["page_furniture_lines"] += 1
+                continue
+            key = line.casefold()
+            if line_counts.get(key, 0) >= BOILERPLATE_MIN_REPEATS:
+                if key in seen_boilerplate:
+                    removed["boilerplate_lines"] += 1
+                    continue
+                seen_boilerplate.add(key)
+            kept.append(line)
+        output_pages.append('\n'.join(kept))
+    normalized = PAGE_BREAK.join(output_pages).strip(PAGE_BREAK + '\n')
+
+    return normalized, {
+        "chars_before": len(text),
+        "chars_after": len(normalized),
+        "estimated_tokens_before": count_tokens(text),
+        "estimated_tokens_after": count_tokens(normalized),
+        "removed": removed,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+def combine_stats(stats_list):
+    """Sums the stats of several normalize_text() calls (e.g. the documents of a merge)."""
+    combined = {"chars_before": 0, "chars_after": 0, "estimated_tokens_before": 0, "estimated_tokens_after": 0,
+                "removed": {}, "seconds": 0.0}
+    for stats in stats_list:
+        for key in ("chars_before", "chars_after", "estimated_tokens_before", "estimated_tokens_after", "seconds"):
+            combined[key] += stats[key]
+        for reason, count in stats["removed"].items():
+            combined["removed"][reason] = combined["removed"].get(reason, 0) + count
+    combined["seconds"] = round(combined["seconds"], 4)
+    return combined
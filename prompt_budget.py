@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Token budgets for outline prompts.
+
+The model's context window is split between the completion (the output limit) and the
+prompt; what remains of the prompt after the instructions and a safety margin is the budget
+for document text. Text over the budget is trimmed on line (paragraph) boundaries, never
+mid-word unless a single paragraph is larger than the whole budget.
+
+Tokens are counted with tiktoken when it is installed and its encoding can be loaded.
+Otherwise a characters-per-token estimate is used, calibrated from the prompt token counts
+the API reports, so the estimate converges on the deployed model's tokenizer.
+"""
+import re
+import math
+import logging
+import threading
+
+try:
+    import tiktoken
+except ImportError: # Optional: the calibrated estimate is used instead
+    tiktoken = None
+
+# (model name prefix, context window tokens, maximum output tokens); first match wins
+MODEL_LIMITS = (
+    ('gpt-4.1', 1047576, 32768),
+    ('gpt-4o', 128000, 16384),
+    ('gpt-4-turbo', 128000, 4096),
+    ('gpt-4-32k', 32768, 8192),
+    ('gpt-4', 8192, 4096),
+    ('gpt-35-turbo', 16385, 4096),
+    ('gpt-3.5-turbo', 16385, 4096),
+)
+DEFAULT_CONTEXT_TOKENS = 128000
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# Weight of each new observation in the characters-per-token moving average
+CALIBRATION_WEIGHT = 0.2
+CALIBRATION_MIN_CHARS = 1000 # Short texts say little about the average
+DEPLOYMENT_PATTERN = re.compile(r'/deployments/([^/?]+)')
+
+
+def model_from_endpoint(endpoint):
+    """The deployment name in an Azure OpenAI chat-completions URL, or ''."""
+    match = DEPLOYMENT_PATTERN.search(endpoint or '')
+    return match.group(1) if match else ''
+
+
+def model_limits(model):
+    """(context_tokens, max_output_tokens) for a model or deployment name, or None if it is unknown."""
+    name = (model or '').lower()
+    for prefix, context_tokens, output_tokens in MODEL_LIMITS:
+        if name.startswith(prefix):
+            return context_tokens, output_tokens
+    return None
+
+
+def estimate_tokens(text, chars_per_token=DEFAULT_CHARS_PER_TOKEN):
+    """Token estimate from the text's length, as PromptBudget.count makes it without tiktoken."""
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def _load_encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e: # The encoding file is downloaded on first use and may be unavailable offline
+        logging.warning(f"tiktoken encoding could not be loaded ({e}); using the calibrated token estimate.")
+        return None
+
+
+class PromptBudget:
+    """Splits a model's context window between prompt and output and fits text into the prompt share."""
+
+    def __init__(self, model='', context_tokens=0, max_output_tokens=8192, safety_tokens=512,
+                 chars_per_token=DEFAULT_CHARS_PER_TOKEN):
+        known = model_limits(model)
+        self.model = model or 'unknown'
+        self.context_tokens = context_tokens or (known[0] if known else DEFAULT_CONTEXT_TOKENS)
+        # The configured output limit, capped by what the model can produce and by its window
+        output_tokens = min(max_output_tokens, known[1]) if known else max_output_tokens
+        self.output_tokens = max(1, min(output_tokens, self.context_tokens // 2))
+        self.safety_tokens = safety_tokens
+        self.input_tokens = max(0, self.context_tokens - self.output_tokens - safety_tokens)
+        self._encoding = _load_encoding(model)
+        self.tokenizer = f"tiktoken:{self._encoding.name}" if self._encoding is not None else 'estimate'
+        self._chars_per_token = chars_per_token
+        self._lock = threading.Lock()
+
+    @property
+    def chars_per_token(self):
+        return self._chars_per_token
+
+    def observe(self, chars, tokens):
+        """Feeds an observed (characters, tokens) pair into the characters-per-token estimate."""
+        if chars < CALIBRATION_MIN_CHARS or not tokens:
+            return
+        with self._lock:
+            self._chars_per_token += CALIBRATION_WEIGHT * (chars / tokens - self._chars_per_token)
+
+    def count(self, text):
+        """Tokens in `text`, exact with tiktoken and estimated otherwise."""
+        if not text:
+            return 0
+        if self._encoding is not None:
+            tokens = len(self._encoding.encode(text, disallowed_special=()))
+            self.observe(len(text), tokens)
+            return tokens
+        return estimate_tokens(text, self._chars_per_token)
+
+    def chars_for(self, tokens):
+        """Characters expected to fill `tokens` at the current estimate."""
+        return int(tokens * self._chars_per_token)
+
+    def fit(self, text, max_tokens):
+        """Returns (text, tokens, truncated): the leading lines of `text` that fit in `max_tokens`."""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text, tokens, False
+        kept = []
+        used = 0
+        for line in text.split('\n'):
+            cost = self.count(line) + (1 if kept else 0) # Each joined line also costs its newline
+            if used + cost > max_tokens:
+                if not kept and max_tokens > 0:
+                    # A single paragraph larger than the budget: keep its start, cut at a space
+                    cut = self.chars_for(max_tokens)
+                    space = line.rfind(' ', 0, cut)
+                    kept.append(line[:space if space > 0 else cut])
+                    used = self.count(kept[0])
+                break
+            kept.append(line)
+            used += cost
+        return '\n'.join(kept), used, True
+
+    def exceeds(self, text, max_tokens):
+        """Whether `text` is over `max_tokens`, without tokenizing text that is clearly under or over."""
+        if len(text) <= max_tokens: # No tokenizer produces fewer than one character per token
+            return False
+        if self._encoding is not None and len(text) > 4 * self.chars_for(max_tokens):
+            return True # Far over: skip tokenizing megabytes of text
+        return self.count(text) > max_tokens
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "tokenizer": self.tokenizer,
+            "context_tokens": self.context_tokens,
+            "output_tokens": self.output_tokens,
+            "input_tokens": self.input_tokens,
+            "chars_per_token": round(self._chars_per_token, 3),
+        }
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Versioned prompt templates.
+
+A PromptTemplate is a static prefix followed by a short suffix with placeholders. The suffix
+is parsed once, when the module is imported, so rendering is a join of precompiled parts. All
+per-request text (user context, the document) lives in the suffix. Every request therefore
+starts with the same system message and the same instruction block, and providers that cache
+prompt prefixes (Azure OpenAI caches 1,024 or more identical leading tokens) can reuse it
+across documents.
+"""
+from string import Formatter
+
+
+class PromptTemplate:
+    """A static prefix plus a suffix with `{name}` placeholders, compiled once."""
+
+    def __init__(self, name, version, prefix, suffix):
+        self.name = name
+        self.version = version # Bump whenever the text changes so cached results from the old prompt are not reused
+        self.prefix = prefix
+        self._parts = [] # (literal text, field name or None)
+        for literal, field, format_spec, conversion in Formatter().parse(suffix):
+            if format_spec or conversion:
+                raise ValueError(f"Template '{name}' uses a format spec or conversion on '{field}'; only plain fields are supported.")
+            self._parts.append((literal, field))
+        self.fields = {field for _, field in self._parts if field is not None}
+
+    def render(self, **values):
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Template '{self.name}' is missing values for: {', '.join(sorted(missing))}")
+        out = [self.prefix]
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(values[field])
+        return ''.join(out)
+
+
+SLIDE_BLOCK_FORMAT = """\
+---
+Slide Title: [Concise Title in Title Case]
+Content Type: [Text Only / Text and Image / Text and Chart / etc.]
+Key Message: [**Single sentence essence** tailored for Audience/Tone.]
+- [Bullet 1: **Informative point** (~10-15 words/short sentence) directly from or synthesized from the source text.]
+- [Bullet 2: (Optional) ditto. Use 3-5 relevant bullets per slide.]
+- [...]
+Visual Suggestion: [Specific & actionable suggestion (e.g., 'Bar chart comparing Q1 vs Q2 sales', 'Icon representing collaboration') or "Text Focus".]
+Design Note: [Optional: Suggest specific emphasis, layout idea, or callout.]
+Notes: [Optional: Brief background context, source reference, or data point origin.]
+**Elaboration:** [REQUIRED: Expand significantly on the slide's points (2-4 detailed sentences). Provide context, nuance, or talking points for the speaker.]
+**Enhancement Suggestion:** [REQUIRED: Offer 1-2 concrete, actionable ideas for the user to improve this specific slide (e.g., 'Add a customer quote here', 'Break this into two slides if time permits').]
+**Best Practice Tip:** [REQUIRED: Provide one relevant presentation best practice tip for this type of slide content (e.g., 'Use high-contrast colors for accessibility', 'Limit text to 6 lines per slide').]
+---"""
+
+# Two-phase generation splits each block: the skeleton's fields are rendered on the slide, the
+# notes fields (Notes and the bold-labelled ones) go to the notes page and are written per slide
+SKELETON_BLOCK_FORMAT = '\n'.join(line for line in SLIDE_BLOCK_FORMAT.split('\n') if not line.startswith(('Notes:', '**')))
+NOTES_FIELDS_FORMAT = '\n'.join(line for line in SLIDE_BLOCK_FORMAT.split('\n') if line.startswith(('Notes:', '**')))
+
+PRESENTATION_FLOW_GUIDANCE = """\
+**Presentation Flow Guidance (Adapt as needed based on content):**
+1. Title Slide, 2. Agenda/Overview, 3. Introduction/Problem Statement, 4. Section 1 (1-3 slides), 5. Section 2 (1-3 slides), 6. Section 3 (1-3 slides) [Adjust section count based on text length/complexity], 7. Key Findings/Analysis (if applicable), 8. Recommendations/Solutions, 9. Next Steps/Call to Action, 10. Conclusion/Summary, 11. Q&A/Contact Information"""
+
+OUTLINE_PROMPT = PromptTemplate('outline', '2', """\
+You are an expert presentation designer AND coach creating a **robust and detailed first draft** PowerPoint outline (~10-15 slides) with speaker notes and suggestions. Structure information logically for the audience/tone. Ensure bullet points are informative (~10-15 words/short sentences).
+
+**CRITICAL INSTRUCTIONS:**
+1. Generate the entire response following the structure below for **EVERY** slide.
+2. **ALL fields listed (Slide Title, Content Type, Key Message, Bullets (at least one), Visual Suggestion, Design Note, Notes, Elaboration, Enhancement Suggestion, Best Practice Tip) ARE REQUIRED for each slide block.** Do not omit fields. Provide meaningful content or state 'None' or 'N/A' where appropriate but the field label MUST be present.
+3. Start each slide block *exactly* with `---` on its own line.
+4. Ensure bullets start with '- ' and contain substantial information, not just keywords.
+5. Elaboration MUST expand significantly on the bullets/key message for the speaker.
+6. Enhancement Suggestion and Best Practice Tip MUST be actionable and relevant.
+
+**Required Slide Block Format (Example Included):**
+
+""" + SLIDE_BLOCK_FORMAT + """
+
+**Example of ONE complete slide block:**
+---
+Slide Title: Understanding the Core Problem
+Content Type: Text Only
+Key Message: Current manual processes lead to significant delays and potential errors in reporting, impacting timely decisions.
+- Manual data entry is time-consuming, taking approximately 4 hours per week per analyst involved in the process.
+- Lack of real-time validation mechanisms increases the risk of inaccurate financial statements being circulated.
+- Reporting delays directly impact the ability of executive leadership to make informed, timely strategic decisions.
+Visual Suggestion: Icon representing 'Time Wasted' or 'Error Symbol'. Consider a simple process flow showing the manual steps.
+Design Note: Use bold text or a distinct color for the time/delay figures mentioned in the elaboration.
+Notes: Data based on internal Q3 process review document and interviews with the finance team.
+**Elaboration:** The 4-hour figure represents an average across five analysts; peak times near month-end are higher. Errors identified later require significant rework, sometimes delaying the final month-end close by up to two business days. Leadership relies on these reports for the Wednesday morning strategy meeting, requiring accuracy by EOD Tuesday.
+**Enhancement Suggestion:** Quantify the potential financial cost of errors (e.g., average cost per correction, impact of delayed decisions) if possible. Consider adding a brief, anonymous quote from an analyst about the manual process friction.
+**Best Practice Tip:** When presenting a problem slide, clearly articulate the 'so what?' – the direct impact on key business objectives or stakeholders (like leadership decision-making).
+---
+
+**(Continue generating ALL subsequent slide blocks using the EXACT format above, including ALL required fields)**
+
+""" + PRESENTATION_FLOW_GUIDANCE + """
+
+**Content & Style Guidelines:**
+* Structure Comprehensively: Ensure a logical flow from start to finish.
+* Informative Bullets: ~10-15 words per bullet, focus on clarity and impact.
+* Prioritize Key Info: Extract the most important messages from the source text.
+* Tailor Tone/Audience: Reflect the specified audience and tone in language and focus.
+* Elaborate Meaningfully: Notes should add real value for the speaker.
+* Actionable Suggestions: Enhancements and Tips should be practical.
+* Data Storytelling: If data is present, weave it into a narrative.
+* Handle Missing Content Gracefully: If source text is sparse for a section, indicate this clearly (e.g., in Notes) but still attempt to generate a placeholder slide with suggestions.
+
+""", '''\
+**User-Provided Context:**
+{context}
+
+**Source Document Text:**
+"""
+{document}
+"""
+
+Generate the **complete** presentation outline now, following ALL instructions meticulously for **EVERY** slide. Ensure all required fields (Slide Title, Content Type, Key Message, Bullets, Visual Suggestion, Design Note, Notes, Elaboration, Enhancement Suggestion, Best Practice Tip) are present in each block starting with `---`.
+''')
+
+SLIDE_REPAIR_PROMPT = PromptTemplate('slide_repair', '1', """\
+You are completing ONE slide of a PowerPoint outline. Its block was cut off or is missing required fields. Rewrite it as one complete block in exactly this format:
+
+""" + SLIDE_BLOCK_FORMAT + """
+
+**Rules:**
+1. Keep the slide's existing title, key message, bullets and facts; complete or add only what is missing.
+2. Do not invent figures or claims that the partial block does not support.
+3. Every field label must be present. Output only the block, starting and ending with `---`.
+
+""", '''\
+**User-Provided Context:**
+{context}
+
+**Position:** Slide {position} of {total}. Previous slide: {previous_title}. Next slide: {next_title}.
+**Missing or incomplete fields:** {missing}
+
+**Partial slide block:**
+"""
+{block}
+"""
+''')
+
+OUTLINE_CONTINUATION_PROMPT = PromptTemplate('outline_continuation', '2', "", '''\
+Your previous response reached the output limit{cut_note}. Continue the outline with the remaining slides, \
+starting each block with `---` and using exactly the same format and required fields. Do not repeat slides already written.
+''')
+
+OUTLINE_SKELETON_PROMPT = PromptTemplate('outline_skeleton', '1', """\
+You are an expert presentation designer creating the **skeleton** of a PowerPoint outline (~10-15 slides): the content that appears on the slides. Speaker notes are written separately for each slide afterwards, so do not write them. Structure information logically for the audience/tone. Ensure bullet points are informative (~10-15 words/short sentences).
+
+**CRITICAL INSTRUCTIONS:**
+1. Every slide block contains exactly these fields: Slide Title, Content Type, Key Message, Bullets (at least one), Visual Suggestion, Design Note.
+2. Do NOT write Notes, Elaboration, Enhancement Suggestion or Best Practice Tip fields.
+3. Start each slide block *exactly* with `---` on its own line.
+4. Ensure bullets start with '- ' and contain substantial information, not just keywords.
+
+**Required Slide Block Format:**
+
+""" + SKELETON_BLOCK_FORMAT + """
+
+""" + PRESENTATION_FLOW_GUIDANCE + """
+
+**Content & Style Guidelines:**
+* Structure Comprehensively: Ensure a logical flow from start to finish.
+* Informative Bullets: ~10-15 words per bullet, focus on clarity and impact.
+* Prioritize Key Info: Extract the most important messages from the source text.
+* Tailor Tone/Audience: Reflect the specified audience and tone in language and focus.
+* Data Storytelling: If data is present, weave it into a narrative.
+
+""", '''\
+**User-Provided Context:**
+{context}
+
+**Source Document Text:**
+"""
+{document}
+"""
+
+Generate the **complete** presentation skeleton now. Ensure every block starting with `---` has Slide Title, Content Type, Key Message, Bullets, Visual Suggestion and Design Note.
+''')
+
+SLIDE_NOTES_PROMPT = PromptTemplate('slide_notes', '1', """\
+You are an expert presentation coach writing the speaker notes for ONE slide of a PowerPoint outline. Write exactly these four fields for the slide marked at the end, in this format, and nothing else:
+
+""" + NOTES_FIELDS_FORMAT + """
+
+**Rules:**
+1. Ground the notes in the source document text; do not invent figures it does not contain.
+2. Write sentences, not bullet lists, and do not repeat the slide's bullets word for word.
+3. Every field label must be present. Do not repeat the slide's title, key message or bullets.
+
+""", '''\
+**User-Provided Context:**
+{context}
+
+**Source Document Text:**
+"""
+{document}
+"""
+
+**Full Outline:**
+{outline}
+
+**Write the notes for slide {position} of {total}:**
+{block}
+''')
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""Client-side admission control for LLM calls.
+
+Requests reserve capacity from a tokens-per-minute and a requests-per-minute bucket before
+they are sent. Reservations may drive a bucket negative; the deficit divided by the refill
+rate is the caller's wait, so waits are predictable and roughly first-come-first-served.
+Calls whose wait would exceed `max_wait` are shed instead of queued. An optional concurrency
+limit caps in-flight calls; each holds a lease that a background thread renews while the call
+(with all of its retries) runs, so only the slots of a process that died expire. State lives in memory (one process) or in SQLite (shared by all
+processes on the host).
+"""
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call would have to wait longer than the governor allows."""
+
+    def __init__(self, wait_seconds, reason):
+        super().__init__(f"{reason}; estimated wait {wait_seconds:.0f}s")
+        self.wait_seconds = wait_seconds
+        self.reason = reason
+
+
+# --- Bucket / Lease State Backends ---
+class InMemoryGovernorState:
+    """Bucket levels and concurrency leases for a single process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {} # name -> (level, updated_at)
+        self._leases = {} # lease_id -> expires_at
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self
+
+    def get_bucket(self, name, capacity, now):
+        return self._buckets.get(name, (capacity, now))
+
+    def set_bucket(self, name, level, now):
+        self._buckets[name] = (level, now)
+
+    def active_leases(self, now):
+        self._leases = {k: v for k, v in self._leases.items() if v > now}
+        return len(self._leases)
+
+    def add_lease(self, lease_id, expires_at):
+        self._leases[lease_id] = expires_at
+
+    def remove_lease(self, lease_id):
+        self._leases.pop(lease_id, None)
+
+    def renew_leases(self, lease_ids, expires_at):
+        for lease_id in lease_ids:
+            if lease_id in self._leases:
+                self._leases[lease_id] = expires_at
+
+
+class SQLiteGovernorState:
+    """Bucket levels and concurrency leases in a SQLite file shared across processes."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._local = threading.local()
+        with self.transaction():
+            self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    @contextmanager
+    def transaction(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self._local.conn = conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield self
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+            self._local.conn = None
+
+    @property
+    def _conn(self):
+        return self._local.conn
+
+    def get_bucket(self, name, capacity, now):
+        row = self._conn.execute("SELECT level, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        return row if row is not None else (capacity, now)
+
+    def set_bucket(self, name, level, now):
+        self._conn.execute("INSERT OR REPLACE INTO buckets (name, level, updated_at) VALUES (?, ?, ?)", (name, level, now))
+
+    def active_leases(self, now):
+        self._conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        return self._conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+
+    def add_lease(self, lease_id, expires_at):
+        self._conn.execute("INSERT INTO leases (id, expires_at) VALUES (?, ?)", (lease_id, expires_at))
+
+    def remove_lease(self, lease_id):
+        self._conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    def renew_leases(self, lease_ids, expires_at):
+        self._conn.executemany("UPDATE leases SET expires_at = ? WHERE id = ?", [(expires_at, lease_id) for lease_id in lease_ids])
+
+
+def create_governor_state(backend, db_path=None):
+    """Factory for the configured governor state ('memory' or 'sqlite')."""
+    backend = (backend or 'memory').lower()
+    if backend == 'memory':
+        return InMemoryGovernorState()
+    if backend == 'sqlite':
+        return SQLiteGovernorState(db_path or 'governor.db')
+    raise ValueError(f"Unknown governor backend '{backend}'. Expected 'memory' or 'sqlite'.")
+
+
+# --- Governor ---
+class LLMGovernor:
+    """Admits LLM calls through TPM/RPM token buckets and an optional concurrency limit.
+
+    A limit of 0 disables that dimension. `lease_seconds` bounds how long a concurrency slot
+    is held if its holder dies without releasing it; live holders renew their leases every
+    third of that, however long their call and its retries take.
+    """
+
+    def __init__(self, state, tokens_per_minute=0, requests_per_minute=0, max_concurrent=0,
+                 max_wait=120.0, lease_seconds=360.0, poll_interval=0.25):
+        self.state = state
+        self.limits = {'tokens': tokens_per_minute, 'requests': requests_per_minute}
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._stats_lock = threading.Lock()
+        self._stats = {'admitted': 0, 'shed': 0, 'waited_seconds': 0.0, 'tokens_reserved': 0, 'tokens_refunded': 0}
+        self._held = set() # Lease ids of this process's in-flight calls
+        self._held_lock = threading.Lock()
+        self._renewal = None
+
+    @property
+    def enabled(self):
+        return any(self.limits.values()) or self.max_concurrent > 0
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    @staticmethod
+    def _refilled(level, updated_at, capacity, now):
+        return min(capacity, level + (now - updated_at) * capacity / 60.0)
+
+    def _costs(self, tokens):
+        costs = {}
+        if self.limits['tokens']:
+            capacity = self.limits['tokens']
+            if tokens > capacity:
+                logging.warning(f"LLM call estimated at {tokens} tokens exceeds the {capacity} tokens-per-minute limit; reserving the full minute.")
+            costs['tokens'] = min(tokens, capacity)
+        if self.limits['requests']:
+            costs['requests'] = 1
+        return costs
+
+    def estimate_wait(self, tokens):
+        """Seconds a call of `tokens` would wait for bucket capacity if submitted now."""
+        now = time.time()
+        wait = 0.0
+        with self.state.transaction() as state:
+            for name, cost in self._costs(tokens).items():
+                capacity = self.limits[name]
+                level = self._refilled(*state.get_bucket(name, capacity, now), capacity, now)
+                wait = max(wait, max(0.0, cost - level) * 60.0 / capacity)
+        return wait
+
+    def _reserve(self, costs):
+        """Atomically reserves `costs` from every bucket, or raises if the wait is too long."""
+        now = time.time()
+        with self.state.transaction() as state:
+            levels = {}
+            wait = 0.0
+            for name, cost in costs.items():
+                capacity = self.limits[name]
+                levels[name] = self._refilled(*state.get_bucket(name, capacity, now), capacity, now)
+                wait = max(wait, max(0.0, cost - levels[name]) * 60.0 / capacity)
+            if wait > self.max_wait:
+                raise RateLimitExceeded(wait, "LLM rate limit budget exhausted")
+            for name, cost in costs.items():
+                state.set_bucket(name, levels[name] - cost, now)
+        return wait
+
+    def _unreserve(self, costs):
+        """Returns reserved amounts (bucket name -> amount) to their buckets."""
+        costs = {name: amount for name, amount in costs.items() if self.limits[name] and amount > 0}
+        if not costs:
+            return
+        now = time.time()
+        with self.state.transaction() as state:
+            for name, amount in costs.items():
+                capacity = self.limits[name]
+                level = self._refilled(*state.get_bucket(name, capacity, now), capacity, now)
+                state.set_bucket(name, min(capacity, level + amount), now)
+        self._count('tokens_refunded', costs.get('tokens', 0))
+
+    def refund(self, tokens):
+        """Returns over-reserved tokens (estimate minus actual usage) to the TPM bucket."""
+        self._unreserve({'tokens': tokens})
+
+    def _sleep(self, seconds, check=None):
+        """Sleeps `seconds` in `poll_interval` steps, calling `check()` (which may raise) at each step."""
+        deadline = time.monotonic() + seconds
+        while True:
+            if check is not None:
+                check()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _acquire_slot(self, deadline, check=None):
+        lease_id = uuid.uuid4().hex
+        while True:
+            now = time.time()
+            with self.state.transaction() as state:
+                if state.active_leases(now) < self.max_concurrent:
+                    state.add_lease(lease_id, now + self.lease_seconds)
+                    return lease_id
+            if now >= deadline:
+                raise RateLimitExceeded(self.max_wait, "Too many concurrent LLM calls")
+            self._sleep(self.poll_interval, check)
+
+    def _release_slot(self, lease_id):
+        with self._held_lock:
+            self._held.discard(lease_id)
+        with self.state.transaction() as state:
+            state.remove_lease(lease_id)
+
+    def _hold_slot(self, lease_id):
+        """Keeps `lease_id` renewed until it is released; starts the renewal thread on first use."""
+        with self._held_lock:
+            self._held.add(lease_id)
+            if self._renewal is None:
+                self._renewal = threading.Thread(target=self._renew_loop, name='llm-lease-renewal', daemon=True)
+                self._renewal.start()
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._held_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                with self.state.transaction() as state:
+                    state.renew_leases(held, time.time() + self.lease_seconds)
+            except sqlite3.Error as e:
+                logging.warning(f"LLM governor: could not renew {len(held)} concurrency leases: {e}")
+
+    @contextmanager
+    def acquire(self, tokens, check=None):
+        """Waits for capacity for a call estimated at `tokens`, then yields a GovernorLease.
+
+        Raises RateLimitExceeded (without reserving anything) if the call would wait longer than
+        `max_wait` seconds. A call that is not admitted after its reservation (no concurrency
+        slot in time) returns the reservation to the buckets. `check()` is called while waiting
+        and may raise to abandon the wait, e.g. a job's CancelToken.check.
+        """
+        if not self.enabled:
+            yield GovernorLease(self, 0)
+            return
+        started = time.monotonic()
+        costs = self._costs(tokens)
+        lease = GovernorLease(self, costs.get('tokens', 0))
+        try:
+            wait = self._reserve(costs) if costs else 0.0
+        except RateLimitExceeded as e:
+            self._count('shed')
+            logging.warning(f"LLM call shed: {e}")
+            raise
+        lease_id = None
+        admitted = False
+        try:
+            if wait > 0:
+                logging.info(f"LLM governor: waiting {wait:.1f}s for rate limit capacity ({tokens} estimated tokens).")
+                self._sleep(wait, check)
+            if self.max_concurrent > 0:
+                try:
+                    lease_id = self._acquire_slot(time.time() + max(0.0, self.max_wait - wait), check)
+                    self._hold_slot(lease_id)
+                except RateLimitExceeded as e:
+                    self._count('shed')
+                    logging.warning(f"LLM call shed: {e}")
+                    raise
+            admitted = True
+        finally:
+            if not admitted:
+                self._unreserve(costs) # Nothing was sent, so the capacity is not used
+        waited = time.monotonic() - started
+        self._count('admitted')
+        self._count('waited_seconds', waited)
+        self._count('tokens_reserved', costs.get('tokens', 0))
+        try:
+            yield lease
+        finally:
+            if lease_id is not None:
+                self._release_slot(lease_id)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(
+            enabled=self.enabled,
+            tokens_per_minute=self.limits['tokens'],
+            requests_per_minute=self.limits['requests'],
+            max_concurrent=self.max_concurrent,
+        )
+        return stats
+
+
+class GovernorLease:
+    """Handle for an admitted call; `settle(actual_tokens)` refunds unused reserved tokens."""
+
+    def __init__(self, governor, reserved_tokens):
+        self.governor = governor
+        self.reserved_tokens = reserved_tokens
+        self._settled = False
+
+    def settle(self, actual_tokens):
+        if self._settled or not self.governor.enabled or actual_tokens is None:
+            return
+        self._settled = True
+        self.governor.refund(self.reserved_tokens - actual_tokens)
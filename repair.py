@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Repair stage for outlines with dropped, incomplete or truncated slide blocks.
+
+Instead of re-running the whole outline generation, only the damaged parts are regenerated:
+each block missing a required field gets a small, targeted request with the partial block
+and its neighbours' titles, and an outline cut off by the output limit gets one continuation
+request, which rewrites the cut-off slide and writes the ones that never were. These requests
+run concurrently (bounded by a worker limit) and their results are merged back in outline order.
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from slide_parser import SLIDE_CORE_REQUIRED_FIELDS, split_slide_blocks, join_slide_blocks, missing_slide_fields, slide_block_title
+
+# An outline with more damaged blocks than this has a format problem that block repairs will not fix
+MAX_REPAIRED_BLOCKS = 8
+
+
+def _is_slide(missing):
+    """Blocks with none of the core fields (preambles, closing remarks) are not slides."""
+    return not all(field in missing for field in SLIDE_CORE_REQUIRED_FIELDS)
+
+
+def find_damaged_blocks(blocks, truncated=False):
+    """Returns [(index, missing_fields)] for slide blocks that lack required fields.
+
+    When the output was `truncated`, its last block was cut mid-way and counts as damaged
+    even if every field label made it into the output.
+    """
+    damaged = []
+    for index, block in enumerate(blocks):
+        missing = missing_slide_fields(block)
+        if not _is_slide(missing):
+            continue
+        if missing or (truncated and index == len(blocks) - 1):
+            damaged.append((index, missing))
+    return damaged
+
+
+def needs_repair(llm_text, truncated=False):
+    return truncated or bool(find_damaged_blocks(split_slide_blocks(llm_text)))
+
+
+def _first_slide_block(text):
+    for block in split_slide_blocks(text):
+        if _is_slide(missing_slide_fields(block)):
+            return block
+    return None
+
+
+def repair_outline(llm_text, truncated, regenerate_block, continue_outline=None, max_workers=4):
+    """Regenerates the damaged blocks of an outline, plus its missing tail if it was `truncated`.
+
+    `regenerate_block(block, position, total, previous_title, next_title, missing)` returns
+    text containing the replacement block. `continue_outline(complete_text, cut_title)` returns
+    the slide blocks that follow `complete_text` (the outline without its cut-off last block),
+    starting with that block written again in full; `cut_title` is its title, or None. Either
+    may raise ValueError. A failed repair keeps the original block; a failed continuation is
+    recorded in the stats as 'continuation_error', and the cut-off block is put back and
+    repaired like the others. Returns (repaired text, stats).
+    """
+    started = time.monotonic()
+    blocks = split_slide_blocks(llm_text)
+    continuing = truncated and continue_outline is not None and bool(blocks)
+    # The continuation rewrites the cut-off block, so it is not also repaired (which would duplicate the slide)
+    cut_block = blocks.pop() if continuing else None
+    damaged = find_damaged_blocks(blocks, truncated and not continuing)
+    if len(damaged) > MAX_REPAIRED_BLOCKS:
+        logging.warning(f"Outline has {len(damaged)} damaged slide blocks; repairing the first {MAX_REPAIRED_BLOCKS}.")
+    stats = {"truncated": truncated, "damaged_blocks": len(damaged), "repaired": 0, "failed": 0, "continued_slides": 0}
+    damaged = damaged[:MAX_REPAIRED_BLOCKS]
+    titles = [slide_block_title(block) or 'untitled' for block in blocks]
+
+    def regenerate(index, missing):
+        previous_title = titles[index - 1] if index > 0 else 'none (this is the first slide)'
+        next_title = titles[index + 1] if index + 1 < len(blocks) else 'none (this is the last slide so far)'
+        return regenerate_block(blocks[index], index + 1, len(blocks), previous_title, next_title, missing)
+
+    def apply_repair(index, result):
+        """Puts the block returned by `result()` in place of blocks[index] if it is a usable slide."""
+        try:
+            replacement = _first_slide_block(result())
+        except ValueError as e:
+            logging.warning(f"Repair of slide block {index + 1} failed: {e}")
+            replacement = None
+        if replacement is None or any(field in missing_slide_fields(replacement) for field in SLIDE_CORE_REQUIRED_FIELDS):
+            stats["failed"] += 1
+            return
+        blocks[index] = replacement
+        stats["repaired"] += 1
+
+    workers = max(1, min(max_workers, len(damaged) + (1 if continuing else 0)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        repairs = [(index, pool.submit(regenerate, index, missing)) for index, missing in damaged]
+        continuation = None
+        if continuing:
+            complete_text = join_slide_blocks(blocks) if blocks else ''
+            continuation = pool.submit(continue_outline, complete_text, slide_block_title(cut_block) or None)
+
+        for index, future in repairs:
+            apply_repair(index, future.result)
+
+        if continuation is not None:
+            try:
+                continued = split_slide_blocks(continuation.result())
+            except ValueError as e:
+                logging.error(f"Outline continuation failed, so the outline stays cut off: {e}")
+                stats["continuation_error"] = str(e)
+                continued = []
+                blocks.append(cut_block)
+                titles.append(slide_block_title(cut_block) or 'untitled')
+                missing = missing_slide_fields(cut_block)
+                if _is_slide(missing):
+                    stats["damaged_blocks"] += 1
+                    apply_repair(len(blocks) - 1, lambda: regenerate(len(blocks) - 1, missing))
+            # The continuation sometimes restates slides it was given; keep only new titles
+            seen_titles = {slide_block_title(block).casefold() for block in blocks}
+            for block in continued:
+                if _is_slide(missing_slide_fields(block)) and slide_block_title(block).casefold() not in seen_titles:
+                    seen_titles.add(slide_block_title(block).casefold())
+                    blocks.append(block)
+                    stats["continued_slides"] += 1
+
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    logging.info(f"Outline repair: {stats['repaired']}/{stats['damaged_blocks']} damaged blocks repaired, "
+                 f"{stats['continued_slides']} slides continued after truncation, in {stats['seconds']}s.")
+    return join_slide_blocks(blocks) if blocks else llm_text, stats
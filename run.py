@@ -1,11 +1,67 @@
 import os
-from waitress import serve
-from app import app # Import the Flask app object from your app.py file
+import sys
 
-if __name__ == '__main__':
-    host = '0.0.0.0' # Listen on all network interfaces
-    port = 5000      # Port the app will run on
-    threads = 8      # Number of threads to handle concurrent requests (adjust as needed)
+# SERVER selects the launch profile: 'waitress' (one process, WAITRESS_THREADS threads) or
+# 'gunicorn' (several preloaded worker processes configured by gunicorn.conf.py; not on Windows)
+SERVER = os.environ.get('SERVER', 'waitress').lower()
+
+
+def run_gunicorn():
+    """Replaces this process with gunicorn, which loads the app itself (once, before forking its workers)."""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(repo_dir, 'gunicorn.conf.py')
+    args = [sys.executable, '-m', 'gunicorn', '--config', config_path, '--pythonpath', repo_dir, 'app:app']
+    print(f"--- Starting Gunicorn Production Server (config: {config_path}) ---")
+    sys.stdout.flush()
+    os.execv(sys.executable, args)
+
+
+def main():
+    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() in ['true', '1', 't']
+    if SERVER == 'gunicorn' and not debug_mode:
+        run_gunicorn() # Does not return
+    from app import app, AZURE_ENDPOINT, AZURE_API_KEY # Import the Flask app object from your app.py file
 
-    print(f"Starting Waitress server on http://{host}:{port}")
-    serve(app, host=host, port=port, threads=threads)
\ No newline at end of file
+    # Check for essential Azure configuration at startup and print warning if missing
+    if not AZURE_ENDPOINT or not AZURE_API_KEY:
+        print("\n" + "="*75)
+        print("!!! WARNING: Azure OpenAI Credentials (Endpoint or API Key) Missing !!!")
+        print("!!! The application will run, but PowerPoint generation will fail.  !!!")
+        print("!!! Please set AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY      !!!")
+        print("!!! environment variables or ensure they are in a '.env' file.    !!!")
+        print("="*75 + "\n")
+
+    host = os.environ.get('HOST', '0.0.0.0') # Listen on all network interfaces
+    port = int(os.environ.get('PORT', 5000)) # Port the app will run on
+
+    if not debug_mode:
+        try:
+            from waitress import serve
+            threads = int(os.environ.get('WAITRESS_THREADS', 8)) # Number of threads to handle concurrent requests (adjust as needed)
+            print(f"--- Starting Waitress Production Server ---")
+            print(f"--- Listening on: http://{host}:{port}")
+            print(f"--- Worker Threads: {threads}")
+            print(f"--- Azure Endpoint Configured: {'YES' if AZURE_ENDPOINT else 'NO (!)'}")
+            print(f"--- Azure API Key Configured:  {'YES' if AZURE_API_KEY else 'NO (!)'}")
+            print("--- Press Ctrl+C to quit ---")
+            serve(app, host=host, port=port, threads=threads)
+        except ImportError:
+            print("\n--- Waitress Package Not Found ---")
+            print("--- Falling back to Flask Development Server (NOT FOR PRODUCTION) ---")
+            print(f"--- Listening on: http://{host}:{port}")
+            print(f"--- Azure Endpoint Configured: {'YES' if AZURE_ENDPOINT else 'NO (!)'}")
+            print(f"--- Azure API Key Configured:  {'YES' if AZURE_API_KEY else 'NO (!)'}")
+            print("--- Debug Mode: True ---")
+            app.run(host=host, port=port, debug=True)
+    else:
+        print("--- Starting Flask Development Server ---")
+        print(f"--- Listening on: http://{host}:{port}")
+        print(f"--- Azure Endpoint Configured: {'YES' if AZURE_ENDPOINT else 'NO (!)'}")
+        print(f"--- Azure API Key Configured:  {'YES' if AZURE_API_KEY else 'NO (!)'}")
+        print("--- Debug Mode: True (Reloads on code changes) ---")
+        print("--- Press Ctrl+C to quit ---")
+        app.run(host=host, port=port, debug=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Parser for the structured slide outline returned by the LLM.
+
+Blocks are separated by `---` lines. Each line is classified once: a bullet (`- `), a field
+prefix (matched by a single precompiled, case-insensitive alternation), or a continuation of
+the previous field. Field text is collected as a list of lines and joined once per slide.
+"""
+import re
+import logging
+
+# Define all expected fields, including required and optional ones
+SLIDE_CORE_REQUIRED_FIELDS = ('title', 'content_type', 'key_message')
+SLIDE_SUGGESTION_FIELDS = ('elaboration', 'enhancement_suggestion', 'best_practice_tip')
+SLIDE_OPTIONAL_FIELDS = ('visual', 'design_note', 'notes', 'bullets') # Bullets are technically optional if content dictates
+SLIDE_TEXT_FIELDS = SLIDE_CORE_REQUIRED_FIELDS + SLIDE_SUGGESTION_FIELDS + ('visual', 'design_note', 'notes')
+
+# Default text for required suggestion fields if LLM omits them (though prompt asks it not to)
+DEFAULT_SUGGESTION = "Suggestion not provided by AI."
+
+# Line prefix -> field name. The group name is the field, so a match needs no further lookup.
+SLIDE_FIELD_PREFIXES = {
+    'title': 'slide title:',
+    'content_type': 'content type:',
+    'key_message': 'key message:',
+    'visual': 'visual suggestion:',
+    'design_note': 'design note:',
+    'notes': 'notes:',
+    'elaboration': 'elaboration:',
+    'enhancement_suggestion': 'enhancement suggestion:',
+    'best_practice_tip': 'best practice tip:',
+}
+# The prompt asks for some labels in bold ("**Elaboration:**"), so surrounding '**' is accepted
+FIELD_PREFIX_PATTERN = re.compile(
+    r'(?:\*\*)?(?:' + '|'.join(f"(?P<{field}>{re.escape(prefix)})" for field, prefix in SLIDE_FIELD_PREFIXES.items()) + r')(?:\*\*)?',
+    re.IGNORECASE,
+)
+# '---' possibly surrounded by whitespace, on its own line
+BLOCK_SEPARATOR_PATTERN = re.compile(r'\n\s*---\s*\n')
+
+
+class SlideRecord:
+    """Accumulates one slide's fields; text fields are lists of lines until `to_dict()`."""
+
+    __slots__ = SLIDE_TEXT_FIELDS + ('bullets',)
+
+    def __init__(self):
+        for field in SLIDE_TEXT_FIELDS:
+            setattr(self, field, None)
+        self.bullets = []
+
+    def to_dict(self):
+        slide = {}
+        for field in SLIDE_TEXT_FIELDS:
+            parts = getattr(self, field)
+            slide[field] = '\n'.join(parts) if parts else ''
+        slide['bullets'] = self.bullets
+        return slide
+
+
+def _read_slide_block(block):
+    """Collects a stripped block's fields into a slide dict, without validation or defaults."""
+    record = SlideRecord()
+    current_parts = None # Line list of the field receiving continuation lines (None after a bullet)
+    match_prefix = FIELD_PREFIX_PATTERN.match
+
+    for line in block.split('\n'):
+        line_strip = line.strip()
+        if not line_strip: continue # Skip empty lines
+
+        if line.startswith('- '):
+            bullet_content = line[2:].strip()
+            if bullet_content: # Only add non-empty bullets
+                record.bullets.append(bullet_content)
+            current_parts = None # Lines following a bullet are not appended anywhere
+            continue
+
+        match = match_prefix(line)
+        if match is not None:
+            # A repeated prefix replaces the earlier value
+            current_parts = [line[match.end():].strip()]
+            setattr(record, match.lastgroup, current_parts)
+        elif current_parts is not None:
+            current_parts.append(line_strip) # Multi-line content for Notes, Elaboration, etc.
+
+    return record.to_dict()
+
+
+def missing_slide_fields(block):
+    """Required fields (core and suggestion) that are missing or empty in a block."""
+    slide = _read_slide_block(block.strip())
+    return [f for f in SLIDE_CORE_REQUIRED_FIELDS + SLIDE_SUGGESTION_FIELDS if not slide[f].strip()]
+
+
+def slide_block_title(block):
+    """A block's slide title, or '' if it has none."""
+    return _read_slide_block(block.strip())['title']
+
+
+def parse_slide_block(block, block_idx):
+    """Parses one `---`-delimited block into a slide dict, or returns None if core fields are missing."""
+    block = block.strip()
+    if not block or block == '---': # Skip empty blocks or blocks just containing the separator
+        return None
+
+    slide = _read_slide_block(block)
+
+    missing_or_empty_core = [f for f in SLIDE_CORE_REQUIRED_FIELDS if not slide[f].strip()]
+    if missing_or_empty_core:
+        logging.warning(
+            f"Skipping Block {block_idx+1}. Missing/Empty Core Fields: {missing_or_empty_core}. "
+            f"Title='{slide['title']}'. Block Preview: '{block[:150]}...'"
+        )
+        return None
+
+    # Apply defaults for suggestion fields if they are missing or empty
+    for f in SLIDE_SUGGESTION_FIELDS:
+        if not slide[f].strip():
+            slide[f] = DEFAULT_SUGGESTION
+    return slide
+
+
+def split_slide_blocks(llm_text):
+    """The non-empty `---`-delimited blocks of an outline, stripped, in order."""
+    blocks = []
+    for block in BLOCK_SEPARATOR_PATTERN.split(llm_text.strip()):
+        block = block.strip()
+        if block.startswith('---'):
+            block = block[3:].strip() # A separator on the first line, which the pattern cannot see
+        if block.endswith('---') and block[:-3].endswith('\n'):
+            block = block[:-3].strip() # Likewise for a final separator
+        if block:
+            blocks.append(block)
+    return blocks
+
+
+def join_slide_blocks(blocks):
+    """Reassembles blocks into outline text in the format split_slide_blocks() reads."""
+    return '---\n' + '\n---\n'.join(blocks) + '\n---\n'
+
+
+def parse_slides(llm_text):
+    """Parses the complete LLM output into a list of slide dicts (possibly empty)."""
+    slides = []
+    for block_idx, block in enumerate(split_slide_blocks(llm_text)):
+        slide = parse_slide_block(block, block_idx)
+        if slide is not None:
+            slides.append(slide)
+    return slides
+
+
+def finalize_parsed_slides(slides, llm_text):
+    """Raises if nothing could be parsed; otherwise logs and returns the slides."""
+    if not slides:
+        # Critical if no slides could be parsed
+        logging.error(f"Failed to parse ANY valid slide blocks from the LLM output. Output Preview: {llm_text[:500]}...")
+        raise ValueError("AI response parsing failed. Could not find any slides with the required structure (Title, Content Type, Key Message). Please check the AI's output format.")
+
+    logging.info(f"Successfully parsed {len(slides)} slides from LLM output.")
+    return slides
+
+
+class SlideStreamParser:
+    """Incremental counterpart of parse_llm_output for streamed LLM output.
+
+    `feed(text)` accepts arbitrary text fragments and returns the slides whose `---` terminator
+    has arrived; `close()` parses the trailing block and returns the complete slide list.
+    """
+
+    def __init__(self):
+        self.slides = []
+        self._partial_line = ''
+        self._block_lines = []
+        self._block_idx = 0
+        self._text_parts = []
+
+    def feed(self, text):
+        self._text_parts.append(text)
+        lines = (self._partial_line + text).split('\n')
+        self._partial_line = lines.pop() # Last element is an unterminated line (possibly empty)
+        completed = []
+        for line in lines:
+            if line.strip() == '---':
+                slide = self._finish_block()
+                if slide is not None:
+                    completed.append(slide)
+            else:
+                self._block_lines.append(line)
+        return completed
+
+    def _finish_block(self):
+        block = '\n'.join(self._block_lines)
+        self._block_lines = []
+        if not block.strip():
+            return None # Separator before the first block, or consecutive separators
+        slide = parse_slide_block(block, self._block_idx)
+        self._block_idx += 1
+        if slide is not None:
+            self.slides.append(slide)
+        return slide
+
+    def close(self):
+        if self._partial_line.strip() != '---':
+            self._block_lines.append(self._partial_line)
+        self._partial_line = ''
+        self._finish_block()
+        return finalize_parsed_slides(self.slides, ''.join(self._text_parts))
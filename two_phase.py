@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Two-phase outline generation: a skeleton first, then each slide's speaker notes in parallel.
+
+A single outline call writes titles, bullets and four notes fields for every slide in one
+long sequential completion. In two-phase mode the first call returns only the skeleton (the
+fields shown on the slides), which is short and can be shown to the user at once; the notes
+fields are then written by one small call per slide, run concurrently, so the notes take
+about as long as the slowest single slide instead of the sum of all of them. The notes are
+appended to their skeleton blocks, giving the same outline text as a single call.
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from slide_parser import FIELD_PREFIX_PATTERN, SLIDE_CORE_REQUIRED_FIELDS, missing_slide_fields, join_slide_blocks
+
+NOTES_FIELDS = ('notes', 'elaboration', 'enhancement_suggestion', 'best_practice_tip')
+
+
+def extract_notes_fields(text):
+    """The notes-field lines of a notes response; any restated slide fields and separators are dropped.
+
+    Lines are kept from a notes field label up to the next label that is not a notes field.
+    Dash-prefixed lines inside a field become plain continuation lines, since in a slide block
+    they would be read as bullets.
+    """
+    kept = []
+    keeping = False
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if not stripped or stripped == '---':
+            continue
+        match = FIELD_PREFIX_PATTERN.match(stripped)
+        if match is not None:
+            keeping = match.lastgroup in NOTES_FIELDS
+        elif stripped.startswith('- ') and keeping:
+            stripped = stripped[2:].strip()
+        elif stripped.startswith('- '):
+            continue # A restated bullet
+        if keeping:
+            kept.append(stripped)
+    return '\n'.join(kept)
+
+
+def fill_notes(blocks, generate_notes, max_workers):
+    """Generates the notes fields of every skeleton slide block concurrently.
+
+    `generate_notes(block, position, total)` returns the notes response for one slide and may
+    raise ValueError, in which case the block is kept without notes (the repair stage or the
+    parser's defaults take over). Returns (outline text, stats).
+    """
+    started = time.monotonic()
+    slide_indexes = [i for i, block in enumerate(blocks)
+                     if not all(f in missing_slide_fields(block) for f in SLIDE_CORE_REQUIRED_FIELDS)]
+    total = len(slide_indexes)
+    stats = {"slides": total, "fan_out": max_workers, "filled": 0, "failed": 0}
+    blocks = list(blocks)
+    slowest = 0.0
+
+    def run(index, position):
+        call_started = time.monotonic()
+        return generate_notes(blocks[index], position, total), time.monotonic() - call_started
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total or 1))) as pool:
+        futures = [(index, pool.submit(run, index, position)) for position, index in enumerate(slide_indexes, start=1)]
+        for index, future in futures:
+            try:
+                response, seconds = future.result()
+            except ValueError as e:
+                logging.warning(f"Notes for slide block {index + 1} could not be generated: {e}")
+                stats["failed"] += 1
+                continue
+            slowest = max(slowest, seconds)
+            notes = extract_notes_fields(response)
+            if not notes:
+                stats["failed"] += 1
+                continue
+            blocks[index] = f"{blocks[index]}\n{notes}"
+            stats["filled"] += 1
+
+    stats["slowest_seconds"] = round(slowest, 3)
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    logging.info(f"Slide notes: {stats['filled']}/{total} slides filled in {stats['seconds']}s "
+                 f"(slowest call {stats['slowest_seconds']}s, fan-out {max_workers}).")
+    return join_slide_blocks(blocks) if blocks else '', stats
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Streaming parser for single-document uploads.
+
+Flask parses a multipart body completely before a view runs: the file part is spooled to a
+temporary file, and only then could the route check the file name and copy the upload to
+where its job reads it. read_upload() parses the raw request stream itself, in chunks, with
+Werkzeug's incremental multipart decoder:
+
+- the file name is validated as soon as the part's headers arrive;
+- the first bytes are checked against the signature of the claimed type (a PDF header, or
+  the zip local-file header every DOCX starts with), so a renamed or corrupt file is
+  rejected after its first kilobyte instead of after the whole body;
+- the part is then written straight to the upload's storage while its SHA-256 is computed,
+  which the extraction cache uses instead of reading the file a second time.
+
+Text fields are kept in memory; they may come before or after the file part.
+"""
+import time
+import hashlib
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+UPLOAD_CHUNK_BYTES = 64 * 1024
+PDF_SIGNATURE = b'%PDF-'
+ZIP_SIGNATURE = b'PK\x03\x04'
+# PDF readers accept a header anywhere in the first kilobyte, so that much is read before rejecting
+SNIFF_BYTES = 1024
+
+
+def sniff_document_type(head):
+    """The extension whose signature the first bytes of a file carry: '.pdf', '.docx' or None."""
+    if head.startswith(ZIP_SIGNATURE):
+        return '.docx'
+    if PDF_SIGNATURE in head[:SNIFF_BYTES]:
+        return '.pdf'
+    return None
+
+
+def check_signature(head, file_ext, complete=False):
+    """Whether `head` (the first bytes of an upload) carries the signature of `file_ext`.
+
+    Returns True on a match and False while more bytes are needed to decide; `complete` means
+    no more are coming. Raises ValueError on a mismatch.
+    """
+    if not head and complete:
+        raise ValueError("The uploaded file is empty.")
+    found = sniff_document_type(head)
+    if found == file_ext:
+        return True
+    if not complete and len(head) < SNIFF_BYTES:
+        return False
+    detail = f" (it looks like a {found} file)" if found else ""
+    raise ValueError(f"The file's contents do not match its {file_ext} extension{detail}.")
+
+
+def read_upload(stream, boundary, validate_filename, open_storage, file_field='file',
+                chunk_size=UPLOAD_CHUNK_BYTES, max_field_bytes=None):
+    """Reads a multipart/form-data body from `stream`, writing its `file_field` file to storage as it arrives.
+
+    `validate_filename(filename)` returns the file's extension or raises ValueError.
+    `open_storage(filename)` is called once the file's signature has been checked and returns
+    a writable binary file; if this function raises, whatever it opened is the caller's to release.
+    Other file parts are skipped. Text fields over `max_field_bytes` in total raise RequestEntityTooLarge.
+    Returns (form, upload): a MultiDict of the text fields and a dict with the file's
+    filename, file_ext, size, sha256 and seconds. Raises ValueError for a missing, empty or
+    mismatched file and for malformed bodies.
+    """
+    started = time.perf_counter()
+    decoder = MultipartDecoder(boundary)
+    form = MultiDict()
+    upload = None
+    part = None # The upload dict, a [name, bytearray] field, or None for skipped parts
+    head = bytearray() # The upload's first bytes, held until its signature is checked
+    storage = None
+    digest = hashlib.sha256()
+    field_bytes = 0
+
+    def write(data):
+        storage.write(data)
+        digest.update(data)
+        upload['size'] += len(data)
+
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                part = None
+                if event.name == file_field and upload is None:
+                    if not event.filename:
+                        raise ValueError("No file selected for upload.")
+                    upload = part = {'filename': event.filename, 'file_ext': validate_filename(event.filename), 'size': 0}
+            elif isinstance(event, Field):
+                part = [event.name, bytearray()]
+            elif isinstance(event, Data) and part is upload and upload is not None:
+                if storage is not None:
+                    write(event.data)
+                else:
+                    head += event.data
+                    if check_signature(head, upload['file_ext'], complete=not event.more_data):
+                        storage = open_storage(upload['filename'])
+                        write(bytes(head))
+                        head = None
+            elif isinstance(event, Data) and part is not None:
+                field_bytes += len(event.data)
+                if max_field_bytes is not None and field_bytes > max_field_bytes:
+                    raise RequestEntityTooLarge()
+                part[1] += event.data
+                if not event.more_data:
+                    form.add(part[0], part[1].decode('utf-8', 'replace'))
+            event = decoder.next_event()
+        if isinstance(event, Epilogue) or not chunk:
+            break
+
+    if upload is None:
+        raise ValueError("No file part in the request.")
+    if storage is None:
+        raise ValueError("The upload ended before the file was complete.")
+    upload.update(sha256=digest.hexdigest(), seconds=round(time.perf_counter() - started, 3))
+    return form, upload